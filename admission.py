@@ -0,0 +1,133 @@
+import threading
+
+from flask import g, request, jsonify
+
+# route class -> (max in-flight requests, seconds to wait for a slot, Retry-After)
+# Payments and admin work wait longest; anonymous pages are shed first.
+DEFAULT_ADMISSION_LIMITS = {
+    'payment': (16, 10.0, 5),
+    'admin': (16, 5.0, 5),
+    'student': (32, 2.0, 10),
+    'public': (32, 0.25, 30),
+}
+
+# Checked in order, first matching path prefix wins. Streams and long polls
+# stay open for as long as they run, so holding a slot would starve their
+# class; they map to None and are never gated.
+ROUTE_CLASSES = [
+    ('/student/payments', 'payment'),
+    ('/student/certificate/payment', 'payment'),
+    ('/admin/export/', None),
+    ('/admin', 'admin'),
+    ('/student', 'student'),
+    ('/tickets', 'student'),
+    ('/notifications/stream', None),
+    ('/mark_notifications_read', 'student'),
+    ('/login', 'student'),
+    ('/logout', 'student'),
+    ('/register', 'student'),
+]
+
+# Long polls nested under a gated prefix, e.g. /tickets/<id>/messages/wait
+UNGATED_SUFFIXES = ('/messages/wait',)
+
+
+class AdmissionGate:
+    """Caps concurrent requests for one route class and queues the overflow"""
+
+    def __init__(self, name, limit, queue_timeout, retry_after):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            if self.in_flight >= self.limit:
+                self.waiting += 1
+                try:
+                    has_slot = self._cond.wait_for(lambda: self.in_flight < self.limit, timeout=self.queue_timeout)
+                finally:
+                    self.waiting -= 1
+                if not has_slot:
+                    self.shed += 1
+                    return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def snapshot(self):
+        return {
+            'limit': self.limit,
+            'queue_timeout': self.queue_timeout,
+            'in_flight': self.in_flight,
+            'queued': self.waiting,
+            'admitted': self.admitted,
+            'shed': self.shed,
+        }
+
+
+gates = {}
+
+
+def route_class(path):
+    """Gate name for a request path, or None if it is not gated"""
+    if path.endswith(UNGATED_SUFFIXES):
+        return None
+    for prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return 'public'
+
+
+def _admit():
+    if request.endpoint == 'static':
+        return None
+
+    name = route_class(request.path)
+    if name is None:
+        return None
+    gate = gates[name]
+    if not gate.acquire():
+        message = 'The portal is very busy right now. Please try again shortly.'
+        headers = {'Retry-After': str(gate.retry_after)}
+        if request.accept_mimetypes.best == 'application/json' or request.method != 'GET':
+            return jsonify({'success': False, 'message': message}), 503, headers
+        return message, 503, headers
+    g.admission_gate = gate
+    return None
+
+
+def _release(exc=None):
+    gate = g.pop('admission_gate', None)
+    if gate is not None:
+        gate.release()
+
+
+def init_admission(app):
+    """Install per-route-class admission control on the app
+
+    Limits apply per worker process; ADMISSION_LIMITS in the app config
+    overrides any entry of DEFAULT_ADMISSION_LIMITS.
+    """
+    limits = dict(DEFAULT_ADMISSION_LIMITS)
+    limits.update(app.config.get('ADMISSION_LIMITS', {}))
+    for name, (limit, queue_timeout, retry_after) in limits.items():
+        gates[name] = AdmissionGate(name, limit, queue_timeout, retry_after)
+
+    app.before_request(_admit)
+    app.teardown_request(_release)
+
+
+def admission_metrics():
+    return {name: gate.snapshot() for name, gate in gates.items()}
@@ -0,0 +1,15 @@
+"""ASGI entry point.
+
+Serves the same Flask app, with notification streaming and ticket long
+polling handled by async handlers (see realtime.py):
+
+    pip install aiosqlite uvicorn
+    uvicorn asgi:application --workers 2
+
+The WSGI entry point (run.py) keeps working without these packages; pages
+then fall back to periodic polling.
+"""
+from realtime import RealtimeApp
+from run import app
+
+application = RealtimeApp(app)
@@ -0,0 +1,137 @@
+"""Bytes saved and CPU spent by response compression, per route.
+
+Seeds a throwaway database, then requests every GET route uncompressed and
+once per encoding the middleware offers (gzip, plus br when the brotli
+package is installed), and reports response sizes and the compression CPU
+time per response:
+
+    python benchmarks/compression.py --students 200
+    python benchmarks/compression.py --gzip-level 9 --brotli-quality 5
+"""
+import argparse
+import gzip
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from routes import seed, url_values, role_for  # noqa: E402
+
+
+def decode(encoding, data):
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    import brotli
+
+    return brotli.decompress(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=200, help='students seeded')
+    parser.add_argument('--repeat', type=int, default=5, help='compressed requests per route and encoding')
+    parser.add_argument('--gzip-level', type=int, default=None)
+    parser.add_argument('--brotli-quality', type=int, default=None)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "portal.db")}'
+    os.environ['ACTIVITY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    os.environ['PASSWORD_HASH_CONCURRENCY'] = '1'
+    os.environ['COMPRESSION_ENABLED'] = '0'
+
+    from flask import url_for
+
+    from compression import init_compression
+    from run import app
+    from models import (db, User, Program, Course, Application, Document, Payment, StudentID,
+                        Certificate, Ticket, TicketMessage, Notification, Project, NewsAnnouncement)
+
+    if args.gzip_level is not None:
+        app.config['COMPRESSION_GZIP_LEVEL'] = args.gzip_level
+    if args.brotli_quality is not None:
+        app.config['COMPRESSION_BROTLI_QUALITY'] = args.brotli_quality
+    app.config['COMPRESSION_ENABLED'] = True
+    # Thresholds are part of what is measured, so every response is offered for compression
+    app.config['COMPRESSION_MIN_SIZE'] = 0
+    init_compression(app)
+    middleware = app.extensions['compression']
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    app.logger.disabled = True
+
+    with app.app_context():
+        db.create_all()
+        seed(db, (User, Program, Course, Application, Document, Payment, StudentID, Certificate,
+                  Ticket, TicketMessage, Notification, Project, NewsAnnouncement), 0, args.students)
+        values = url_values((User, Application, Certificate, Ticket, Document, Project, NewsAnnouncement), None)
+        users = {'admin': User.query.filter_by(email='admin@example.com').first().id,
+                 'student': User.query.filter_by(email='student0@example.com').first().id}
+
+    clients = {}
+    for role in ('admin', 'student', 'anonymous'):
+        clients[role] = app.test_client()
+        if role in users:
+            with clients[role].session_transaction() as session:
+                session['_user_id'] = str(users[role])
+                session['_fresh'] = True
+
+    cases = []
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+            if 'GET' not in rule.methods or rule.endpoint in ('static', 'logout'):
+                continue
+            params = {arg: values[arg] for arg in rule.arguments if arg in values}
+            if len(params) != len(rule.arguments):
+                continue
+            for role in role_for(rule):
+                cases.append((role, rule.rule, url_for(rule.endpoint, **params)))
+
+    encodings = list(middleware.encoders)
+    header = f'{"route":<58} {"status":>6} {"raw KB":>8}'
+    for encoding in encodings:
+        header += f' {encoding + " KB":>8} {"saved":>6} {"cpu ms":>7}'
+    print(header)
+
+    totals = {encoding: [0, 0.0] for encoding in encodings}
+    raw_total = 0
+    for role, rule, url in cases:
+        client = clients[role]
+        response = client.get(url, headers={'Accept-Encoding': 'identity'})
+        raw = response.get_data()
+        status = response.status_code
+        response.close()
+        line = f'{role + " " + rule:<58} {status:>6} {len(raw) / 1024:>8.1f}'
+        raw_total += len(raw)
+
+        for encoding in encodings:
+            before = dict(middleware.stats[encoding])
+            size = len(raw)
+            for _ in range(args.repeat):
+                response = client.get(url, headers={'Accept-Encoding': encoding})
+                data = response.get_data()
+                if response.headers.get('Content-Encoding') == encoding:
+                    size = len(data)
+                    decode(encoding, data)
+                response.close()
+            after = middleware.stats[encoding]
+            compressed = after['responses'] - before['responses']
+            cpu = (after['cpu_ms'] - before['cpu_ms']) / compressed if compressed else 0.0
+            saved = 1 - size / len(raw) if raw else 0.0
+            totals[encoding][0] += size
+            totals[encoding][1] += cpu
+            line += f' {size / 1024:>8.1f} {saved:>6.0%} {cpu:>7.2f}'
+        print(line)
+
+    line = f'{"total (" + str(len(cases)) + " routes)":<58} {"":>6} {raw_total / 1024:>8.1f}'
+    for encoding in encodings:
+        size, cpu = totals[encoding]
+        line += f' {size / 1024:>8.1f} {1 - size / raw_total if raw_total else 0:>6.0%} {cpu:>7.2f}'
+    print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Measure password verification throughput under concurrent logins.
+
+Simulates many students signing in at once against PasswordHasher with
+different hash parameters and concurrency caps, and reports logins/sec,
+latency and how many attempts were shed with HashingBusy.
+
+    python benchmarks/login_throughput.py --clients 64 --logins 400
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher, HashingBusy  # noqa: E402
+
+METHODS = ['pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1']
+
+
+def run(method, concurrency, queue_timeout, clients, logins):
+    hasher = PasswordHasher(method=method, concurrency=concurrency, queue_timeout=queue_timeout)
+    stored = hasher.hash('correct horse battery staple')
+    latencies = []
+    shed = [0]
+    lock = threading.Lock()
+
+    def attempt(_):
+        start = time.perf_counter()
+        try:
+            hasher.verify(stored, 'correct horse battery staple')
+        except HashingBusy:
+            with lock:
+                shed[0] += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(attempt, range(logins)))
+    elapsed = time.perf_counter() - start
+
+    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else 0
+    print(f'{method:<24} cap={concurrency:<3} ok={len(latencies):<5} shed={shed[0]:<5} '
+          f'{len(latencies) / elapsed:8.1f} logins/s  p50={statistics.median(latencies) * 1000:7.1f}ms  '
+          f'p95={p95 * 1000:7.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32, help='concurrent login requests')
+    parser.add_argument('--logins', type=int, default=200, help='total login attempts per run')
+    parser.add_argument('--queue-timeout', type=float, default=5.0)
+    parser.add_argument('--methods', nargs='*', default=METHODS)
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    caps = sorted({1, max(1, cpus // 2), cpus, cpus * 2})
+    for method in args.methods:
+        for cap in caps:
+            run(method, cap, args.queue_timeout, args.clients, args.logins)
+
+
+if __name__ == '__main__':
+    main()
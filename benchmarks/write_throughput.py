@@ -0,0 +1,98 @@
+"""Compare small-write throughput on SQLite with and without group commit.
+
+Many threads each insert notifications one at a time, first committing
+every write themselves and then through the WriteCoordinator. Reports
+writes/sec, latency and how many writes failed (e.g. "database is locked").
+
+    python benchmarks/write_throughput.py --clients 32 --writes 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from models import db, User, Notification  # noqa: E402
+from databases import init_databases  # noqa: E402
+from writes import WriteCoordinator, init_write_coordinator, perform_write  # noqa: E402
+
+
+def make_app(path, coordinator, window_ms, max_batch):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_BINDS'] = {'activity': app.config['SQLALCHEMY_DATABASE_URI']}
+    app.config['WRITE_COORDINATOR'] = coordinator
+    app.config['WRITE_BATCH_WINDOW_MS'] = window_ms
+    app.config['WRITE_BATCH_MAX'] = max_batch
+    app.config['WRITE_TIMEOUT'] = 60
+    db.init_app(app)
+    init_databases(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(email='bench@example.com', full_name='Bench', password_hash='x'))
+        db.session.commit()
+    init_write_coordinator(app)
+    return app
+
+
+def add_notification(user_id, n):
+    db.session.add(Notification(user_id=user_id, message=f'benchmark {n}'))
+
+
+def run(label, coordinator, clients, writes, window_ms, max_batch):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'), coordinator, window_ms, max_batch)
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def write(n):
+            with app.app_context():
+                start = time.perf_counter()
+                try:
+                    perform_write(add_notification, 1, n)
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+                    return
+                finally:
+                    db.session.remove()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(write, range(writes)))
+        elapsed = time.perf_counter() - start
+
+        extra = ''
+        writer = app.extensions.get('write_coordinator')
+        if isinstance(writer, WriteCoordinator):
+            extra = f'  avg batch={writer.snapshot()["avg_batch_size"]}'
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else 0
+        print(f'{label:<22} ok={len(latencies):<6} failed={errors[0]:<5} '
+              f'{len(latencies) / elapsed:9.1f} writes/s  p50={statistics.median(latencies) * 1000:7.1f}ms  '
+              f'p95={p95 * 1000:7.1f}ms{extra}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32, help='concurrent writers')
+    parser.add_argument('--writes', type=int, default=1000, help='total writes per run')
+    parser.add_argument('--window-ms', type=float, default=5)
+    parser.add_argument('--max-batch', type=int, default=64)
+    args = parser.parse_args()
+
+    run('commit per write', False, args.clients, args.writes, args.window_ms, args.max_batch)
+    run('group commit', True, args.clients, args.writes, args.window_ms, args.max_batch)
+
+
+if __name__ == '__main__':
+    main()
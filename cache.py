@@ -0,0 +1,500 @@
+"""Caches and how they are kept coherent across worker processes.
+
+Two backends share one interface (get, get_many, set, set_many, delete,
+clear, stats):
+
+- LRUCache: this process's memory, bounded by entry count, optional TTL
+- RedisCache: one Redis shared by every worker and host
+
+Cached data that follows the database is keyed by a VersionStamp: a
+token kept in a stamp file that every worker on this host reads with one
+stat(). Bumping writes a new token, so every worker's next lookup uses
+new keys and old entries simply age out. VersionedCache stores its entries
+in the configured backend, so with CACHE_BACKEND=redis every worker and
+host shares them. When CACHE_REDIS_URL is set each bump is also published
+on a Redis channel, and a listener thread in each worker writes the new
+token into its own host's stamp file, so hosts agree on the current keys.
+Any Redis-compatible server works, including a local stand-in such as
+fakeredis' TcpFakeServer.
+"""
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Version stamps live next to the database so every worker on the host sees them
+VERSION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cache_versions')
+
+DEFAULT_CACHE_MAX_ENTRIES = 4096
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_KEY_PREFIX = 'portal:'
+
+# Invalidation name that drops everything, sent when messages may have been missed
+INVALIDATE_ALL = '*'
+
+_MISSING = object()
+
+
+class LRUCache:
+    """In-process cache of at most max_entries, least recently used evicted first"""
+
+    def __init__(self, max_entries=DEFAULT_CACHE_MAX_ENTRIES, default_ttl=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        found, _ = self.get_many([key])
+        return found.get(key, default)
+
+    def get_many(self, keys):
+        """Return a dict of the cached keys and the list of keys that missed"""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is not None and entry[0] <= now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    missing.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, values, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'backend': 'lru',
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class RedisCache:
+    """Cache in Redis, shared by every worker process and host
+
+    Values are pickled, so only cache data the app produced itself. If Redis
+    is unreachable, reads miss and writes are dropped rather than failing
+    the request; the errors are counted in stats().
+    """
+
+    def __init__(self, url=None, prefix=DEFAULT_CACHE_KEY_PREFIX, default_ttl=DEFAULT_CACHE_TTL, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        from redis.exceptions import RedisError
+
+        self.client = client
+        self.prefix = prefix + 'cache:'
+        self.default_ttl = default_ttl
+        self._errors = RedisError
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key):
+        return self.prefix + (key if isinstance(key, str) else repr(key))
+
+    def get(self, key, default=None):
+        found, _ = self.get_many([key])
+        return found.get(key, default)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}, []
+        try:
+            values = self.client.mget([self._key(key) for key in keys])
+        except self._errors:
+            self.errors += 1
+            values = [None] * len(keys)
+        found = {key: pickle.loads(value) for key, value in zip(keys, values) if value is not None}
+        missing = [key for key in keys if key not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, values, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(self._key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=ttl or None)
+        try:
+            pipeline.execute()
+        except self._errors:
+            self.errors += 1
+
+    def delete(self, key):
+        try:
+            return bool(self.client.delete(self._key(key)))
+        except self._errors:
+            self.errors += 1
+            return False
+
+    def clear(self):
+        """Delete this cache's keys only, never the rest of the Redis database"""
+        try:
+            batch = []
+            for key in self.client.scan_iter(match=self.prefix + '*', count=1000):
+                batch.append(key)
+                if len(batch) >= 1000:
+                    self.client.delete(*batch)
+                    batch = []
+            if batch:
+                self.client.delete(*batch)
+        except self._errors:
+            self.errors += 1
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+        }
+
+
+class InvalidationBus:
+    """Tells the other worker processes which cached names were invalidated
+
+    A message carries a stamp name and its new token; the token is written
+    to this host's stamp file before listeners are called with the name.
+    Listeners also get INVALIDATE_ALL after (re)connecting, since messages
+    sent while disconnected are lost. Until configure() is called nothing
+    is sent.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        self.channel = None
+        self.origin = None
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def configure(self, client, channel):
+        self._client = client
+        self.channel = channel
+        self._pid = None
+
+    def _deliver(self, name):
+        for listener in self._listeners:
+            listener(name)
+
+    def ensure_listening(self):
+        """Start this process's listener thread; safe to call on every request"""
+        if self._client is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked worker gets its own origin and thread
+            self._pid = os.getpid()
+            self.origin = uuid.uuid4().hex
+            self.connected = False
+            threading.Thread(target=self._listen, args=(self._pid,), name='cache-invalidation', daemon=True).start()
+
+    def _listen(self, pid):
+        from redis.exceptions import RedisError
+
+        while self._pid == pid:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                self._deliver(INVALIDATE_ALL)
+                self.connected = True
+                for message in pubsub.listen():
+                    data = message['data']
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    origin, name, token = (data.split(' ', 2) + [''])[:3]
+                    if origin != self.origin:
+                        self.received += 1
+                        if token:
+                            _write_stamp(name, token)
+                        self._deliver(name)
+            except RedisError:
+                self.connected = False
+                self.errors += 1
+                time.sleep(1)
+            finally:
+                # Each reconnect opens a new connection; release the broken one
+                pubsub.close()
+
+    def publish(self, name, token=''):
+        if self._client is None:
+            return
+        from redis.exceptions import RedisError
+
+        self.ensure_listening()
+        try:
+            self._client.publish(self.channel, f'{self.origin} {name} {token}'.rstrip())
+            self.published += 1
+        except RedisError:
+            self.errors += 1
+
+    def snapshot(self):
+        return {
+            'channel': self.channel,
+            'connected': self.connected,
+            'published': self.published,
+            'received': self.received,
+            'errors': self.errors,
+        }
+
+
+invalidations = InvalidationBus()
+
+
+def _stamp_path(name):
+    # 'user:42' is kept as user/42, so the identity shards get a directory of their own
+    return os.path.join(VERSION_PATH, *name.split(':'))
+
+
+def _read_stamp(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return '0'
+
+
+def _write_stamp(name, token):
+    """Atomically replace a stamp file's token; no-op if it already holds it"""
+    path = _stamp_path(name)
+    if _read_stamp(path) == token:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    with open(tmp_path, 'w') as f:
+        f.write(token)
+    os.replace(tmp_path, path)
+
+
+class VersionStamp:
+    """A version token shared by all worker processes through a stamp file
+
+    Checking the version is a single stat() call, and the file is only read
+    again when it was replaced, so checking it on every request costs no
+    database query. Bumping writes a new random token, which every process
+    on the host sees at once, and broadcasts it to workers on other hosts.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._seen = None
+        self._token = '0'
+
+    @property
+    def path(self):
+        # Resolved on use, so stamps created at import follow VERSION_PATH
+        return _stamp_path(self.name)
+
+    def current(self):
+        path = self.path
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return '0'
+        seen = (path, stat.st_ino, stat.st_mtime_ns)
+        if seen != self._seen:
+            self._token = _read_stamp(path)
+            self._seen = seen
+        return self._token
+
+    def bump(self):
+        token = uuid.uuid4().hex
+        _write_stamp(self.name, token)
+        invalidations.publish(self.name, token)
+        return token
+
+
+_versioned_caches = []
+
+
+class VersionedCache:
+    """Entries in the app cache that are only valid for one version stamp
+
+    Keys include the stamp's token, so after a bump lookups miss and the old
+    entries are left to the backend's TTL and eviction.
+    """
+
+    def __init__(self, stamp, ttl=None):
+        self.stamp = stamp
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        _versioned_caches.append(self)
+
+    def version(self):
+        return self.stamp.current()
+
+    def _key(self, version, key):
+        return f'{self.stamp.name}:{version}:{key!r}'
+
+    def get(self, key, default=None):
+        found, _ = self.get_many([key])
+        return found.get(key, default)
+
+    def get_many(self, keys):
+        """Return a dict of the cached keys and the list of keys that missed"""
+        version = self.version()
+        keys = list(keys)
+        stored, _ = get_cache().get_many([self._key(version, key) for key in keys])
+        found = {}
+        missing = []
+        for key in keys:
+            value = stored.get(self._key(version, key), _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def set(self, key, value, version):
+        """Store a value read while `version` was current"""
+        self.set_many({key: value}, version)
+
+    def set_many(self, values, version):
+        # A bump while the values were being read makes them stale already
+        if version == self.version():
+            get_cache().set_many({self._key(version, key): value for key, value in values.items()}, self.ttl)
+
+    def stats(self):
+        return {'name': self.stamp.name, 'hits': self.hits, 'misses': self.misses}
+
+
+def create_cache(config):
+    backend = config.get('CACHE_BACKEND', 'local')
+    if backend == 'local':
+        return LRUCache(
+            max_entries=config.get('CACHE_MAX_ENTRIES', DEFAULT_CACHE_MAX_ENTRIES),
+            default_ttl=config.get('CACHE_DEFAULT_TTL', DEFAULT_CACHE_TTL)
+        )
+    if backend == 'redis':
+        return RedisCache(
+            url=config['CACHE_REDIS_URL'],
+            prefix=config.get('CACHE_KEY_PREFIX', DEFAULT_CACHE_KEY_PREFIX),
+            default_ttl=config.get('CACHE_DEFAULT_TTL', DEFAULT_CACHE_TTL)
+        )
+    raise ValueError(f'Unknown CACHE_BACKEND: {backend}')
+
+
+def init_cache(app):
+    """Set up the app cache and, with CACHE_REDIS_URL, cross-host invalidation"""
+    app.extensions['cache'] = create_cache(app.config)
+    url = app.config.get('CACHE_REDIS_URL')
+    if url:
+        import redis
+
+        prefix = app.config.get('CACHE_KEY_PREFIX', DEFAULT_CACHE_KEY_PREFIX)
+        invalidations.configure(redis.Redis.from_url(url), prefix + 'invalidate')
+        cache = app.extensions['cache']
+        if isinstance(cache, LRUCache):
+            # Bumps missed while disconnected leave stale stamp files; a shared
+            # backend relies on TTLs instead of being wiped for every worker
+            invalidations.subscribe(lambda name: name == INVALIDATE_ALL and cache.clear())
+        # Workers fork after startup, so each starts its listener on its first request
+        app.before_request(invalidations.ensure_listening)
+
+
+def get_cache():
+    """Cache backend configured for the current app"""
+    cache = current_app.extensions.get('cache')
+    if cache is None:
+        cache = current_app.extensions['cache'] = create_cache(current_app.config)
+    return cache
+
+
+def cache_metrics():
+    return {
+        'backend': get_cache().stats(),
+        'versioned': [cache.stats() for cache in _versioned_caches],
+        'invalidation': invalidations.snapshot(),
+    }
+
+
+_watched = []
+
+
+def bump_on_change(stamp, *models):
+    """Bump `stamp` after any commit that inserts, updates or deletes `models`"""
+    _watched.append((stamp, models))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_stamps(session, flush_context):
+    changed = set(session.new) | set(session.dirty) | set(session.deleted)
+    if not changed:
+        return
+    pending = session.info.setdefault('pending_stamps', set())
+    for stamp, models in _watched:
+        if any(isinstance(obj, models) for obj in changed):
+            pending.add(stamp)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_stamps(session):
+    for stamp in session.info.pop('pending_stamps', ()):
+        stamp.bump()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stamps(session):
+    session.info.pop('pending_stamps', None)
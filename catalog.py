@@ -0,0 +1,81 @@
+from collections import namedtuple
+
+from sqlalchemy import tuple_
+
+from cache import VersionStamp, VersionedCache, bump_on_change
+from models import Program, Course
+
+# Any committed write to a program or course bumps this stamp on every worker
+catalog_stamp = VersionStamp('catalog')
+bump_on_change(catalog_stamp, Program, Course)
+
+# Program rows change far less often than courses, so they get their own stamp
+program_stamp = VersionStamp('programs')
+bump_on_change(program_stamp, Program)
+
+ProgramEntry = namedtuple('ProgramEntry', [
+    'id', 'name', 'name_ar', 'description', 'category'
+])
+
+CourseEntry = namedtuple('CourseEntry', [
+    'id', 'name', 'name_ar', 'description', 'program_id', 'level', 'semester'
+])
+
+_program_cache = VersionedCache(program_stamp)
+_course_cache = VersionedCache(catalog_stamp)
+
+
+def all_programs():
+    """Return every Program as a tuple of ProgramEntry, ordered by name"""
+    version = _program_cache.version()
+    programs = _program_cache.get('all')
+    if programs is None:
+        programs = tuple(
+            ProgramEntry(
+                id=program.id,
+                name=program.name,
+                name_ar=program.name_ar,
+                description=program.description,
+                category=program.category
+            )
+            for program in Program.query.order_by(Program.name).all()
+        )
+        _program_cache.set('all', programs, version)
+    return programs
+
+
+def _course_entry(course):
+    return CourseEntry(
+        id=course.id,
+        name=course.name,
+        name_ar=course.name_ar,
+        description=course.description,
+        program_id=course.program_id,
+        level=course.level,
+        semester=course.semester
+    )
+
+
+def courses_for(pairs):
+    """Return {(program_id, level): [CourseEntry, ...]} ordered by semester
+
+    Cached pairs are served from memory; the rest are fetched together in a
+    single IN query instead of one query per pair.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    version = _course_cache.version()
+    found, missing = _course_cache.get_many(pairs)
+
+    if missing:
+        fetched = {pair: [] for pair in missing}
+        rows = Course.query.filter(
+            tuple_(Course.program_id, Course.level).in_(missing)
+        ).order_by(Course.semester, Course.id).all()
+        for course in rows:
+            fetched[(course.program_id, course.level)].append(_course_entry(course))
+
+        fetched = {pair: tuple(entries) for pair, entries in fetched.items()}
+        _course_cache.set_many(fetched, version)
+        found.update(fetched)
+
+    return {pair: found[pair] for pair in pairs}
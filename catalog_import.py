@@ -0,0 +1,359 @@
+"""Bulk import of programs and courses from CSV or XLSX.
+
+One row per course, with its program's columns repeated on every row; a row
+without a course only creates or updates the program:
+
+    program, program_ar, category, program_description,
+    course, course_ar, level, semester, description
+
+Programs are matched on name and courses on (program, level, course name),
+so loading next year's catalog updates existing rows in place. The file is
+read as a stream and written in batches, one multi-row upsert per table per
+batch. Invalid rows, including repeats of a course earlier in the file, are
+skipped and reported with their line number.
+"""
+import csv
+import io
+import os
+import zipfile
+from xml.etree import ElementTree
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+
+from catalog import catalog_stamp, program_stamp
+from models import db, Program, Course
+from schema import create_missing_indexes
+
+CATALOG_COLUMNS = ['program', 'program_ar', 'category', 'program_description',
+                   'course', 'course_ar', 'level', 'semester', 'description']
+
+LEVELS = ('diploma', 'masters', 'doctorate')
+SEMESTERS = (1, 2)
+
+IMPORT_BATCH_SIZE = 2000
+# Errors kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 200
+
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+class CatalogImportError(Exception):
+    """Raised when a file cannot be imported at all (unknown format, bad header)"""
+
+
+class ImportReport:
+    """Counts and per-line errors for one import"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.programs = set()
+        self.courses = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'rows': self.rows,
+            'programs': len(self.programs),
+            'courses': self.courses,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors],
+        }
+
+
+# Readers: yield (line number, [cell text, ...])
+
+def read_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _column_index(reference):
+    """0-based column of a cell reference such as 'C12'"""
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _first_sheet_path(archive):
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{XLSX_NS}sheets/{XLSX_NS}sheet')
+    if sheet is None:
+        raise CatalogImportError('The workbook has no sheets')
+    rel_id = sheet.get(f'{XLSX_REL_NS}id')
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    target = next(rel.get('Target') for rel in rels if rel.get('Id') == rel_id)
+    return target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, element in ElementTree.iterparse(f):
+            if element.tag == f'{XLSX_NS}si':
+                # Plain text, or rich text split into runs (phonetic hints are skipped)
+                text = element.find(f'{XLSX_NS}t')
+                if text is not None:
+                    strings.append(text.text or '')
+                else:
+                    strings.append(''.join(t.text or '' for t in element.findall(f'{XLSX_NS}r/{XLSX_NS}t')))
+                element.clear()
+    return strings
+
+
+def _cell_text(cell, strings):
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        return ''.join(t.text or '' for t in cell.iter(f'{XLSX_NS}t'))
+    value = cell.findtext(f'{XLSX_NS}v') or ''
+    if cell_type == 's':
+        return strings[int(value)] if value else ''
+    if cell_type == 'b':
+        return 'TRUE' if value == '1' else 'FALSE'
+    # Whole numbers (e.g. semester 2) may be stored as "2.0"
+    if cell_type in (None, 'n') and value.endswith('.0'):
+        return value[:-2]
+    return value
+
+
+def read_xlsx(fileobj):
+    """Rows of the first sheet, parsed incrementally so large sheets stay small in memory"""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise CatalogImportError('Not a valid XLSX file')
+    with archive:
+        strings = _shared_strings(archive)
+        with archive.open(_first_sheet_path(archive)) as sheet:
+            line = 0
+            for _, element in ElementTree.iterparse(sheet):
+                if element.tag != f'{XLSX_NS}row':
+                    continue
+                line = int(element.get('r') or line + 1)
+                values = []
+                for cell in element.iter(f'{XLSX_NS}c'):
+                    reference = cell.get('r')
+                    if reference:
+                        values.extend([''] * (_column_index(reference) - len(values)))
+                    values.append(_cell_text(cell, strings))
+                yield line, values
+                element.clear()
+
+
+def read_rows(fileobj, filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        return read_csv(fileobj)
+    if extension == '.xlsx':
+        return read_xlsx(fileobj)
+    raise CatalogImportError('Catalog files must be .csv or .xlsx')
+
+
+def _records(rows):
+    """Yield (line, {column: value}) using the header row's column names"""
+    for line, header in rows:
+        if any(cell.strip() for cell in header):
+            break
+    else:
+        raise CatalogImportError('The file is empty')
+
+    columns = [cell.strip().lower().replace(' ', '_') for cell in header]
+    if 'program' not in columns:
+        raise CatalogImportError(f"Header must include a 'program' column; expected {', '.join(CATALOG_COLUMNS)}")
+
+    for line, row in rows:
+        if not any(cell.strip() for cell in row):
+            continue
+        yield line, {column: value.strip() for column, value in zip(columns, row) if column in CATALOG_COLUMNS}
+
+
+def _check_length(record, column, limit):
+    if len(record.get(column, '')) > limit:
+        raise ValueError(f'{column} is longer than {limit} characters')
+
+
+def _validate(record, line, programs_seen, courses_seen):
+    """Program and course values for a row; raises ValueError with the reason"""
+    name = record.get('program', '')
+    if not name:
+        raise ValueError('program is required')
+    for column, limit in (('program', 200), ('program_ar', 200), ('category', 100),
+                          ('course', 200), ('course_ar', 200)):
+        _check_length(record, column, limit)
+
+    # Later rows of the same program may leave its columns blank
+    earlier = programs_seen.get(name, {})
+    program = {
+        'name': name,
+        'name_ar': record.get('program_ar') or earlier.get('name_ar'),
+        'category': record.get('category') or earlier.get('category'),
+        'description': record.get('program_description') or earlier.get('description'),
+    }
+    if not program['name_ar']:
+        raise ValueError('program_ar is required the first time a program appears')
+
+    course = None
+    if record.get('course'):
+        level = record.get('level', '').lower()
+        if level not in LEVELS:
+            raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+        try:
+            semester = int(record.get('semester', ''))
+        except ValueError:
+            semester = None
+        if semester not in SEMESTERS:
+            raise ValueError('semester must be 1 or 2')
+        if not record.get('course_ar'):
+            raise ValueError('course_ar is required')
+        # The upsert would let the last repeat silently overwrite the first
+        key = (name, level, record['course'])
+        if key in courses_seen:
+            raise ValueError(f'duplicate of line {courses_seen[key]}')
+        courses_seen[key] = line
+        course = {
+            'program': name,
+            'name': record['course'],
+            'name_ar': record['course_ar'],
+            'level': level,
+            'semester': semester,
+            'description': record.get('description') or None,
+        }
+
+    programs_seen[name] = program
+    return program, course
+
+
+def _write_batch(connection, batch, program_ids):
+    """Upsert one batch of (program, course) rows: one statement per table"""
+    programs = {program['name']: program for program, _ in batch}
+    program_table = Program.__table__
+    stmt = insert(program_table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={
+            'name_ar': stmt.excluded.name_ar,
+            # Blank optional columns keep what the program already has
+            'category': func.coalesce(stmt.excluded.category, program_table.c.category),
+            'description': func.coalesce(stmt.excluded.description, program_table.c.description),
+        }
+    )
+    connection.execute(stmt, list(programs.values()))
+
+    missing = [name for name in programs if name not in program_ids]
+    if missing:
+        program_ids.update((name, program_id) for program_id, name in connection.execute(
+            select(program_table.c.id, program_table.c.name).where(program_table.c.name.in_(missing))
+        ))
+
+    courses = [
+        dict(course, program_id=program_ids[course.pop('program')])
+        for _, course in batch if course is not None
+    ]
+    if courses:
+        course_table = Course.__table__
+        stmt = insert(course_table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['program_id', 'level', 'name'],
+            set_={
+                'name_ar': stmt.excluded.name_ar,
+                'semester': stmt.excluded.semester,
+                'description': stmt.excluded.description,
+            }
+        )
+        connection.execute(stmt, courses)
+    return len(courses)
+
+
+def import_catalog(fileobj, filename, dry_run=False, batch_size=IMPORT_BATCH_SIZE):
+    """Import a catalog file and return its ImportReport
+
+    Each batch is committed on its own so the write lock is never held for
+    the whole file. Re-running an import is safe: rows are upserted.
+    """
+    report = ImportReport(dry_run)
+    rows = read_rows(fileobj, filename)
+    if not dry_run:
+        # Upserts need the natural-key indexes on databases created before them
+        try:
+            create_missing_indexes(Program)
+            create_missing_indexes(Course)
+        except IntegrityError:
+            raise CatalogImportError('The existing catalog has duplicate programs or courses; '
+                                     'merge them before importing')
+
+    programs_seen = {}
+    courses_seen = {}
+    program_ids = {}
+    batch = []
+
+    def flush():
+        if batch and not dry_run:
+            report.courses += _write_batch(db.session.connection(), batch, program_ids)
+            db.session.commit()
+        batch.clear()
+
+    try:
+        for line, record in _records(rows):
+            report.rows += 1
+            try:
+                program, course = _validate(record, line, programs_seen, courses_seen)
+            except ValueError as e:
+                report.error(line, str(e))
+                continue
+            report.programs.add(program['name'])
+            if dry_run and course is not None:
+                report.courses += 1
+            batch.append((program, course))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    except UnicodeDecodeError:
+        db.session.rollback()
+        raise CatalogImportError('CSV files must be UTF-8 encoded')
+    finally:
+        if report.rows and not dry_run:
+            # Core upserts skip the ORM events that normally bump these
+            catalog_stamp.bump()
+            program_stamp.bump()
+    return report
+
+
+@click.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Validate the file without writing anything.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows written per batch.')
+@with_appcontext
+def import_catalog_command(path, dry_run, batch_size):
+    """Import programs and courses from a CSV or XLSX file."""
+    with open(path, 'rb') as f:
+        try:
+            report = import_catalog(f, path, dry_run=dry_run, batch_size=batch_size)
+        except CatalogImportError as e:
+            raise click.ClickException(str(e))
+
+    for line, message in report.errors:
+        click.echo(f'line {line}: {message}', err=True)
+    if report.error_count > len(report.errors):
+        click.echo(f'... and {report.error_count - len(report.errors)} more errors', err=True)
+    action = 'Validated' if dry_run else 'Imported'
+    click.echo(f'{action} {report.rows} rows: {len(report.programs)} programs, '
+               f'{report.courses} courses, {report.error_count} rows skipped.')
@@ -0,0 +1,244 @@
+"""gzip and brotli compression of dynamic responses.
+
+CompressionMiddleware wraps the WSGI app and compresses text responses
+(HTML, JSON, CSV, JS, CSS, XML) for clients that accept it, preferring
+brotli when the optional `brotli` package is installed:
+
+    pip install brotli
+
+Responses with a known length are compressed in one go and keep an exact
+Content-Length. Streamed responses (exports) are compressed chunk by chunk,
+with each chunk the app yields flushed through, so downloads still start
+right away. Bodies under the minimum size, images, uploads and other
+already-compressed types, partial content and event streams pass through
+untouched. ETags become weak, since the bytes differ per encoding, and
+conditional requests keep answering 304.
+
+Static files are left alone: they never change between deploys, so the front
+server should serve them pre-compressed (gzip_static / brotli_static) rather
+than have a worker compress the same CSS and JS on every request.
+"""
+import threading
+import time
+import zlib
+from itertools import chain
+
+from flask import current_app
+from werkzeug.http import parse_accept_header
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_GZIP_LEVEL = 6
+# Quality 11 is meant for static assets; 4-5 is close to gzip -6 in speed and smaller
+DEFAULT_BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'application/xhtml+xml', 'image/svg+xml')
+# Streams whose chunks must not wait for a buffer to fill
+UNBUFFERED_TYPES = ('text/event-stream',)
+
+
+class _GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, quality):
+        import brotli
+
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def _header(headers, name):
+    name = name.lower()
+    return next((value for key, value in headers if key.lower() == name), None)
+
+
+def _without(headers, *names):
+    names = {name.lower() for name in names}
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+class CompressionMiddleware:
+    """WSGI middleware negotiating gzip or brotli per request"""
+
+    def __init__(self, wsgi_app, min_size=DEFAULT_MIN_SIZE, gzip_level=DEFAULT_GZIP_LEVEL,
+                 brotli_quality=DEFAULT_BROTLI_QUALITY, skip_paths=()):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.skip_paths = tuple(skip_paths)
+        # In order of preference when the client accepts several equally
+        self.encoders = {}
+        try:
+            import brotli  # noqa: F401
+            self.encoders['br'] = lambda: _BrotliEncoder(brotli_quality)
+        except ImportError:
+            pass
+        self.encoders['gzip'] = lambda: _GzipEncoder(gzip_level)
+
+        self._lock = threading.Lock()
+        self.stats = {encoding: {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_ms': 0.0}
+                      for encoding in self.encoders}
+        self.skipped = 0
+
+    def negotiate(self, accept_encoding):
+        """Best encoding the client accepts, or None"""
+        if not accept_encoding:
+            return None
+        accept = parse_accept_header(accept_encoding)
+        quality, _, encoding = max((accept.quality(encoding), -i, encoding)
+                                   for i, encoding in enumerate(self.encoders))
+        return encoding if quality > 0 else None
+
+    def _compressible(self, status, headers):
+        code = int(status.split(' ', 1)[0])
+        content_type = (_header(headers, 'Content-Type') or '').lower()
+        return (code >= 200 and code not in (204, 206, 304)
+                and content_type.startswith(COMPRESSIBLE_TYPES)
+                and not content_type.startswith(UNBUFFERED_TYPES)
+                and _header(headers, 'Content-Encoding') is None
+                and _header(headers, 'Content-Range') is None
+                and 'no-transform' not in (_header(headers, 'Cache-Control') or ''))
+
+    def __call__(self, environ, start_response):
+        encoding = None
+        if environ.get('REQUEST_METHOD') != 'HEAD' and not environ.get('PATH_INFO', '').startswith(self.skip_paths):
+            encoding = self.negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            # Flask never uses the legacy write() callable, so it is not supported
+            return None
+
+        body = self.wsgi_app(environ, capture)
+        return self._respond(body, captured, encoding, start_response)
+
+    def _record(self, encoding, bytes_in, bytes_out, cpu):
+        with self._lock:
+            stats = self.stats[encoding]
+            stats['responses'] += 1
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['cpu_ms'] += cpu * 1000
+
+    def _compressed_headers(self, headers, encoding, length=None):
+        headers = _without(headers, 'Content-Length', 'Content-Encoding')
+        headers.append(('Content-Encoding', encoding))
+        if length is not None:
+            headers.append(('Content-Length', str(length)))
+        vary = _header(headers, 'Vary')
+        if vary is None:
+            headers.append(('Vary', 'Accept-Encoding'))
+        elif 'accept-encoding' not in vary.lower() and vary != '*':
+            headers = _without(headers, 'Vary') + [('Vary', f'{vary}, Accept-Encoding')]
+        etag = _header(headers, 'ETag')
+        if etag and not etag.startswith('W/'):
+            headers = _without(headers, 'ETag') + [('ETag', f'W/{etag}')]
+        return headers
+
+    def _respond(self, body, captured, encoding, start_response):
+        try:
+            status, headers = captured['status'], captured['headers']
+            exc_info = captured['exc_info']
+            length = _header(headers, 'Content-Length')
+            if not self._compressible(status, headers) or (length is not None and int(length) < self.min_size):
+                self.skipped += 1
+                start_response(status, headers, exc_info)
+                yield from body
+                return
+
+            encoder = self.encoders[encoding]()
+            if length is not None:
+                # Already in memory: compress it whole and keep an exact length
+                data = b''.join(body)
+                started = time.thread_time()
+                out = encoder.compress(data) + encoder.finish()
+                self._record(encoding, len(data), len(out), time.thread_time() - started)
+                start_response(status, self._compressed_headers(headers, encoding, len(out)), exc_info)
+                yield out
+                return
+
+            # Streamed: hold chunks back only until there is enough to be worth compressing
+            chunks = iter(body)
+            buffered = []
+            size = 0
+            for chunk in chunks:
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                self.skipped += 1
+                start_response(status, headers, exc_info)
+                yield from buffered
+                return
+
+            start_response(status, self._compressed_headers(headers, encoding), exc_info)
+            bytes_in = bytes_out = 0
+            cpu = 0.0
+            for chunk in chain([b''.join(buffered)], chunks):
+                started = time.thread_time()
+                out = encoder.compress(chunk) + encoder.flush()
+                cpu += time.thread_time() - started
+                bytes_in += len(chunk)
+                bytes_out += len(out)
+                if out:
+                    yield out
+            started = time.thread_time()
+            out = encoder.finish()
+            cpu += time.thread_time() - started
+            self._record(encoding, bytes_in, bytes_out + len(out), cpu)
+            yield out
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    def snapshot(self):
+        with self._lock:
+            encodings = {
+                encoding: dict(stats, saved_ratio=round(1 - stats['bytes_out'] / stats['bytes_in'], 3)
+                               if stats['bytes_in'] else None, cpu_ms=round(stats['cpu_ms'], 2))
+                for encoding, stats in self.stats.items()
+            }
+        return {'min_size': self.min_size, 'skipped': self.skipped, 'encodings': encodings}
+
+
+def init_compression(app):
+    if not app.config.get('COMPRESSION_ENABLED', True):
+        return
+    middleware = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=app.config.get('COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE),
+        gzip_level=app.config.get('COMPRESSION_GZIP_LEVEL', DEFAULT_GZIP_LEVEL),
+        brotli_quality=app.config.get('COMPRESSION_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY),
+        skip_paths=(app.static_url_path + '/',) if app.static_url_path else ()
+    )
+    app.wsgi_app = middleware
+    app.extensions['compression'] = middleware
+
+
+def compression_metrics():
+    middleware = current_app.extensions.get('compression')
+    return middleware.snapshot() if middleware else {'enabled': False}
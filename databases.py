@@ -0,0 +1,99 @@
+"""SQLite files behind the portal and the tables that live in each.
+
+High-churn tables (notifications today; job queue and metrics rows later)
+use the 'activity' bind. Point ACTIVITY_DATABASE_URI at its own SQLite file
+and their writes take that file's write lock instead of the one shared with
+applications, payments and enrollments. By default the bind points at the
+main database, so nothing moves until it is configured.
+
+Rules for tables on the activity bind:
+- no ForeignKey to tables in the main database; relationships use an
+  explicit primaryjoin with foreign() instead, and are loaded with separate
+  queries (lazy='select'), never with a SQL join
+- a commit that touches both files is two commits, not one, so a crash
+  between them can keep one side only; activity rows must be safe to lose
+  or to outlive the rows they mention
+"""
+import sqlite3
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, insert, select
+from sqlalchemy.engine import Engine
+
+from models import db
+
+ACTIVITY_BIND = 'activity'
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL for every SQLite file, so readers never block that file's writer"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
+
+def init_databases(app):
+    """Share one engine when the activity bind points at the main database
+
+    With two engines on one SQLite file, a unit of work that writes to both
+    binds would wait on its own write lock.
+    """
+    with app.app_context():
+        engines = db.engines
+        if engines[ACTIVITY_BIND].url == engines[None].url:
+            engines[ACTIVITY_BIND].dispose()
+            engines[ACTIVITY_BIND] = engines[None]
+
+
+def engine_for(table):
+    """Engine of the bind a table is declared on"""
+    return db.engines[table.metadata.info.get('bind_key')]
+
+
+def activity_models():
+    return [mapper.class_ for mapper in db.Model.registry.mappers
+            if mapper.local_table.metadata.info.get('bind_key') == ACTIVITY_BIND]
+
+
+@click.command('move-activity-tables')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows copied per batch.')
+@click.option('--drop-source', is_flag=True, help='Drop the copies left in the main database afterwards.')
+@with_appcontext
+def move_activity_tables_command(batch_size, drop_source):
+    """Copy activity-bind tables out of the main database after ACTIVITY_DATABASE_URI is set."""
+    main_engine = db.engines[None]
+    activity_engine = db.engines[ACTIVITY_BIND]
+    if main_engine.url == activity_engine.url:
+        click.echo('ACTIVITY_DATABASE_URI points at the main database; nothing to move.')
+        return
+
+    db.create_all(bind_key=ACTIVITY_BIND)
+    for model in activity_models():
+        table = model.__table__
+        if not db.inspect(main_engine).has_table(table.name):
+            click.echo(f'{table.name}: not in the main database; nothing to move.')
+            continue
+
+        copied = 0
+        last_id = 0
+        with main_engine.connect() as source:
+            while True:
+                rows = source.execute(
+                    select(table).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+                ).mappings().all()
+                if not rows:
+                    break
+                # Rerunnable: rows copied by an earlier run are skipped
+                with activity_engine.begin() as target:
+                    target.execute(insert(table).prefix_with('OR IGNORE'), [dict(row) for row in rows])
+                last_id = rows[-1]['id']
+                copied += len(rows)
+
+        if drop_source:
+            with main_engine.begin() as source:
+                source.execute(db.text(f'DROP TABLE "{table.name}"'))
+        click.echo(f'{table.name}: copied {copied} rows' + (', dropped source table' if drop_source else ''))
@@ -0,0 +1,316 @@
+"""Admin review queue for uploaded documents, with cached previews.
+
+Reviewers page through documents waiting in a status, grouped per student
+and application, oldest upload first. Each document shows a small JPEG
+preview (the image itself, or the first page of a PDF) instead of the
+original file.
+
+Previews are rendered after upload in a process pool, so decoding large
+scans never runs on a request thread, and are cached on disk under
+PREVIEW_CACHE_DIR. The cache key is the stored file path, which is unique
+per upload, so a preview never goes stale. Deleting an upload deletes its
+preview, and gc-uploads sweeps previews whose upload is gone.
+
+Rendering needs the optional Pillow package, plus pypdfium2 for PDFs.
+Without them documents simply have no preview.
+"""
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from models import db, Application, Document
+from schema import create_missing_indexes
+from storage import get_storage
+
+DEFAULT_PREVIEW_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'previews')
+
+REVIEW_STATUSES = ['Uploaded', 'Verified', 'Rejected']
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+# Files whose preview failed are not retried for this long; at most this many are remembered
+FAILED_RETRY_SECONDS = 3600
+MAX_FAILED_PATHS = 10000
+
+
+def _process_context():
+    """Start workers from a clean server process, never by forking this one
+
+    The pool is created from a request thread, and a fork copies locks other
+    threads hold at that moment (logging, the database pool), which the
+    child could then wait on forever.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def preview_kind(path):
+    """'image', 'pdf' or None when the file type has no preview"""
+    extension = os.path.splitext(path or '')[1].lower()
+    if extension == '.pdf':
+        return 'pdf'
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    return None
+
+
+def render_preview(source, destination, kind, size):
+    """Write a JPEG thumbnail of source to destination; runs in a worker process"""
+    from PIL import Image
+
+    if kind == 'pdf':
+        import pypdfium2 as pdfium
+
+        pdf = pdfium.PdfDocument(source)
+        try:
+            page = pdf[0]
+            # Page sizes are in points; render the long side at about `size` pixels
+            image = page.render(scale=size / max(page.get_size())).to_pil()
+        finally:
+            pdf.close()
+    else:
+        image = Image.open(source)
+        # Lets JPEG decoding skip straight to a reduced size
+        image.draft('RGB', (size, size))
+
+    image.thumbnail((size, size))
+    partial = destination + '.part'
+    image.convert('RGB').save(partial, 'JPEG', quality=80, optimize=True)
+    os.replace(partial, destination)
+
+
+class PreviewRenderer:
+    """Renders previews in a process pool, fed by threads that fetch the originals"""
+
+    def __init__(self, app, cache_dir=DEFAULT_PREVIEW_CACHE_DIR, size=480, workers=2,
+                 retry_failed_after=FAILED_RETRY_SECONDS, max_failed=MAX_FAILED_PATHS):
+        self.app = app
+        self.cache_dir = cache_dir
+        self.size = size
+        self.workers = workers
+        self.retry_failed_after = retry_failed_after
+        self.max_failed = max_failed
+        self.kinds = set()
+        if importlib.util.find_spec('PIL'):
+            self.kinds.add('image')
+            if importlib.util.find_spec('pypdfium2'):
+                self.kinds.add('pdf')
+        self.rendered = 0
+        self.failed = 0
+        self._pending = {}
+        # file path -> when its preview failed, oldest first
+        self._failed_paths = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_pools(self):
+        # Started lazily so each forked worker process gets its own pools
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._fetcher = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preview-fetch')
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_process_context())
+                self._pending = {}
+                self._pid = os.getpid()
+
+    def path_for(self, file_path):
+        digest = hashlib.sha1(file_path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.jpg')
+
+    def cached(self, file_path):
+        """Path of the cached preview, or None if it has not been rendered"""
+        path = self.path_for(file_path)
+        return path if os.path.isfile(path) else None
+
+    def _recently_failed(self, file_path):
+        failed_at = self._failed_paths.get(file_path)
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at < self.retry_failed_after:
+            return True
+        with self._lock:
+            self._failed_paths.pop(file_path, None)
+        return False
+
+    def _record_failure(self, file_path):
+        with self._lock:
+            self._failed_paths[file_path] = time.monotonic()
+            self._failed_paths.move_to_end(file_path)
+            while len(self._failed_paths) > self.max_failed:
+                self._failed_paths.popitem(last=False)
+
+    def can_preview(self, file_path):
+        return preview_kind(file_path) in self.kinds and not self._recently_failed(file_path)
+
+    def discard(self, file_path):
+        """Forget the preview of an upload that is being deleted; True if a file was removed"""
+        with self._lock:
+            self._failed_paths.pop(file_path, None)
+        try:
+            os.remove(self.path_for(file_path))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def iter_cached(self):
+        """Yield (path, mtime) of every preview in the cache"""
+        try:
+            shards = [entry.path for entry in os.scandir(self.cache_dir) if entry.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            with os.scandir(shard) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.jpg') and entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False).st_mtime
+
+    def schedule(self, file_path):
+        """Queue a preview unless it exists or is queued; returns its Future or None"""
+        if not self.can_preview(file_path) or self.cached(file_path):
+            return None
+        self._ensure_pools()
+        with self._lock:
+            future = self._pending.get(file_path)
+            if future is None:
+                future = self._pending[file_path] = self._fetcher.submit(self._render, file_path)
+        return future
+
+    def _render(self, file_path):
+        destination = self.path_for(file_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # The worker process reads a local copy, whichever storage backend holds the original
+        fd, source = tempfile.mkstemp(dir=os.path.dirname(destination), suffix=os.path.splitext(file_path)[1])
+        try:
+            with self.app.app_context(), os.fdopen(fd, 'wb') as local:
+                with closing(get_storage().open(file_path)) as original:
+                    shutil.copyfileobj(original, local, 1024 * 1024)
+            self._pool.submit(render_preview, source, destination, preview_kind(file_path), self.size).result()
+            with self._lock:
+                self.rendered += 1
+            return destination
+        except Exception as e:
+            # Unreadable or corrupt files are not retried for a while
+            with self._lock:
+                self.failed += 1
+            self._record_failure(file_path)
+            self.app.logger.warning('Preview failed for %s: %s', file_path, e)
+            return None
+        finally:
+            os.remove(source)
+            with self._lock:
+                self._pending.pop(file_path, None)
+
+    def snapshot(self):
+        return {
+            'formats': sorted(self.kinds),
+            'rendered': self.rendered,
+            'failed': self.failed,
+            'pending': len(self._pending),
+            'failed_paths': len(self._failed_paths),
+        }
+
+
+def init_previews(app):
+    app.extensions['preview_renderer'] = PreviewRenderer(
+        app,
+        cache_dir=app.config.get('PREVIEW_CACHE_DIR', DEFAULT_PREVIEW_CACHE_DIR),
+        size=app.config.get('PREVIEW_SIZE', 480),
+        workers=app.config.get('PREVIEW_WORKERS', 2)
+    )
+
+
+def get_renderer():
+    renderer = current_app.extensions.get('preview_renderer')
+    if renderer is None:
+        init_previews(current_app._get_current_object())
+        renderer = current_app.extensions['preview_renderer']
+    return renderer
+
+
+def schedule_preview(file_path):
+    """Start rendering the preview for a newly stored upload"""
+    return get_renderer().schedule(file_path)
+
+
+def discard_preview(file_path):
+    """Delete the cached preview of an upload being deleted"""
+    return get_renderer().discard(file_path)
+
+
+def preview_metrics():
+    return get_renderer().snapshot()
+
+
+def review_queue(status='Uploaded', page=1, per_page=20):
+    """One page of review groups, oldest waiting first, and whether more follow
+
+    A group is one student's documents for one application (or with no
+    application). Returns ([(application, user, [documents])], has_more).
+    """
+    oldest = func.min(Document.uploaded_at)
+    keys = db.session.query(Document.user_id, Document.application_id).filter(
+        Document.status == status
+    ).group_by(
+        Document.user_id, Document.application_id
+    ).order_by(oldest, Document.user_id, Document.application_id).limit(per_page + 1).offset(
+        (page - 1) * per_page
+    ).all()
+    has_more = len(keys) > per_page
+    keys = keys[:per_page]
+    if not keys:
+        return [], False
+
+    documents = Document.query.options(
+        db.joinedload(Document.user),
+        db.joinedload(Document.application).joinedload(Application.program)
+    ).filter(
+        Document.status == status,
+        Document.user_id.in_({user_id for user_id, _ in keys})
+    ).order_by(Document.uploaded_at).all()
+
+    grouped = {tuple(key): [] for key in keys}
+    for document in documents:
+        group = grouped.get((document.user_id, document.application_id))
+        if group is not None:
+            group.append(document)
+    return [(group[0].application, group[0].user, group) for group in grouped.values() if group], has_more
+
+
+def review_counts():
+    """Number of documents in each review status"""
+    counts = dict(db.session.query(Document.status, func.count(Document.id)).group_by(Document.status))
+    return {status: counts.get(status, 0) for status in REVIEW_STATUSES}
+
+
+@click.command('render-document-previews')
+@click.option('--status', default='Uploaded', show_default=True, help='Only documents in this status.')
+@with_appcontext
+def render_document_previews_command(status):
+    """Add the review queue index and render missing document previews."""
+    created = create_missing_indexes(Document)
+    if created:
+        click.echo(f"Created indexes: {', '.join(created)}")
+
+    renderer = get_renderer()
+    if not renderer.kinds:
+        click.echo('Previews need Pillow (and pypdfium2 for PDFs); nothing rendered.')
+        return
+
+    query = db.session.query(Document.file_path).filter(Document.status == status)
+    futures = [renderer.schedule(path) for (path,) in query.execution_options(stream_results=True).yield_per(500)]
+    rendered = sum(1 for future in futures if future is not None and future.result())
+    click.echo(f'Rendered {rendered} previews ({renderer.failed} failed).')
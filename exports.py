@@ -0,0 +1,233 @@
+import csv
+import io
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+
+from models import db, User, Application, Program, Payment, StudentID
+
+# Rows fetched per round trip from the database cursor
+EXPORT_BATCH_SIZE = 500
+
+
+def application_rows():
+    """Applications joined with their applicant and program"""
+    query = db.session.query(
+        Application.app_id,
+        User.full_name,
+        User.email,
+        User.nationality,
+        Program.name,
+        Application.level,
+        Application.status,
+        Application.payment_status,
+        Application.date_submitted
+    ).join(
+        User, Application.user_id == User.id
+    ).outerjoin(
+        Program, Application.program_id == Program.id
+    ).order_by(Application.id)
+    return query.execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+
+def payment_rows():
+    """Payments with the paying student's name and email"""
+    query = db.session.query(
+        Payment.transaction_id,
+        User.full_name,
+        User.email,
+        Payment.application_id,
+        Payment.certificate_id,
+        Payment.amount,
+        Payment.payment_method,
+        Payment.status,
+        Payment.payment_date
+    ).join(
+        User, Payment.user_id == User.id
+    ).order_by(Payment.id)
+    return query.execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+
+def enrollment_rows():
+    """Issued student IDs with their application and student"""
+    query = db.session.query(
+        StudentID.student_id,
+        Application.app_id,
+        User.full_name,
+        User.email,
+        User.nationality,
+        Program.name,
+        Application.level,
+        StudentID.created_at
+    ).join(
+        Application, StudentID.application_id == Application.id
+    ).join(
+        User, Application.user_id == User.id
+    ).outerjoin(
+        Program, Application.program_id == Program.id
+    ).order_by(StudentID.id)
+    return query.execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+
+EXPORTS = {
+    'applications': (
+        ['Application ID', 'Applicant', 'Email', 'Nationality', 'Program',
+         'Level', 'Status', 'Payment Status', 'Date Submitted'],
+        application_rows
+    ),
+    'payments': (
+        ['Transaction ID', 'Student', 'Email', 'Application', 'Certificate',
+         'Amount', 'Method', 'Status', 'Payment Date'],
+        payment_rows
+    ),
+    'enrollments': (
+        ['Student ID', 'Application ID', 'Student', 'Email', 'Nationality',
+         'Program', 'Level', 'Enrolled At'],
+        enrollment_rows
+    ),
+}
+
+
+def _format_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only file object whose contents are drained by the generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def generate_csv(header, rows):
+    """Yield CSV text one batch of rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens Arabic names as UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(header)
+
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_format_cell(value) for value in row])
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def _xlsx_cell(value):
+    value = _format_cell(value)
+    if isinstance(value, bool):
+        value = str(value)
+    if isinstance(value, (int, float)):
+        return f'<c t="n"><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def generate_xlsx(header, rows, sheet_name='Export'):
+    """Yield a single-sheet XLSX workbook without holding it in memory
+
+    The zip archive is written to an unseekable buffer, so zipfile uses data
+    descriptors and every member can be flushed as soon as it is written.
+    """
+    buffer = _ChunkBuffer()
+    archive = zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED)
+
+    archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+    archive.writestr('_rels/.rels', XLSX_ROOT_RELS)
+    archive.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(name=escape(sheet_name)))
+    archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+    yield buffer.drain()
+
+    with archive.open('xl/worksheets/sheet1.xml', mode='w', force_zip64=True) as sheet:
+        sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        sheet.write(_xlsx_row(header).encode('utf-8'))
+
+        for i, row in enumerate(rows, 1):
+            sheet.write(_xlsx_row(row).encode('utf-8'))
+            if i % EXPORT_BATCH_SIZE == 0:
+                yield buffer.drain()
+
+        sheet.write(b'</sheetData></worksheet>')
+
+    archive.close()
+    yield buffer.drain()
+
+
+def export_response(name, fmt):
+    """Build a streamed download for one of the EXPORTS"""
+    header, rows = EXPORTS[name]
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    if fmt == 'xlsx':
+        body = generate_xlsx(header, rows(), sheet_name=name.title())
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        body = generate_csv(header, rows())
+        mimetype = 'text/csv; charset=utf-8'
+
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}_{timestamp}.{fmt}"'
+    # Keep proxies from buffering the whole export before sending it on
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
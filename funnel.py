@@ -0,0 +1,260 @@
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from models import db, Application, User, Payment, StudentID, AdmissionsDailyRollup
+
+rollup_table = AdmissionsDailyRollup.__table__
+
+FUNNEL_STAGES = ['submitted', 'documents_approved', 'documents_rejected', 'paid', 'enrolled']
+
+# Application.status values that mark a funnel stage
+STATUS_STAGES = {
+    'Documents Approved': 'documents_approved',
+    'Documents Rejected': 'documents_rejected',
+    'Enrolled': 'enrolled',
+}
+
+
+class _Deltas:
+    """Funnel events collected for one flush or one backfill batch"""
+
+    def __init__(self):
+        self.buckets = defaultdict(lambda: [0, 0, 0.0, 0.0])
+
+    def add(self, day, stage, program_id, level, nationality, from_submission=None, from_previous=None):
+        bucket = self.buckets[(day, stage, program_id or 0, level or 'Unknown', nationality or 'Unknown')]
+        bucket[0] += 1
+        if from_submission is not None:
+            bucket[1] += 1
+            bucket[2] += from_submission
+            bucket[3] += from_previous if from_previous is not None else from_submission
+
+    def apply(self, connection):
+        for (day, stage, program_id, level, nationality), (count, timed, since_submit, since_previous) \
+                in self.buckets.items():
+            stmt = insert(rollup_table).values(
+                day=day,
+                stage=stage,
+                program_id=program_id,
+                level=level,
+                nationality=nationality,
+                event_count=count,
+                timed_count=timed,
+                seconds_from_submission=since_submit,
+                seconds_from_previous=since_previous
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['day', 'stage', 'program_id', 'level', 'nationality'],
+                set_={
+                    column: rollup_table.c[column] + stmt.excluded[column]
+                    for column in ('event_count', 'timed_count', 'seconds_from_submission', 'seconds_from_previous')
+                }
+            )
+            connection.execute(stmt)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    """Only registered for active_history"""
+
+
+# Load the old status when it is set on an application a commit expired, so
+# saving an unchanged value is not mistaken for a new funnel event
+for _attribute in (Application.status, Application.payment_status):
+    event.listen(_attribute, 'set', _load_old_value, active_history=True)
+
+
+def _seconds_between(start, end):
+    if start is None or end is None:
+        return None
+    return max((end - start).total_seconds(), 0)
+
+
+def _changed_to(obj, field):
+    """New value of field if this flush changed it, else None"""
+    history = get_history(obj, field)
+    if history.added and history.added[0] != (history.deleted[0] if history.deleted else None):
+        return history.added[0]
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def update_admissions_rollups(session, flush_context):
+    """Count funnel events written in this flush into the daily rollups
+
+    Events are history: later status changes add new events and never
+    remove earlier ones. Runs in the same transaction as the change itself.
+    """
+    events = []  # (application, stage)
+    for obj in session.new:
+        if isinstance(obj, Application):
+            events.append((obj, 'submitted'))
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Application):
+            continue
+        stage = STATUS_STAGES.get(_changed_to(obj, 'status'))
+        if stage:
+            events.append((obj, stage))
+        if _changed_to(obj, 'payment_status') == 'Paid':
+            events.append((obj, 'paid'))
+    if not events:
+        return
+
+    connection = session.connection()
+    user_ids = {application.user_id for application, _ in events}
+    nationalities = dict(connection.execute(
+        select(User.id, User.nationality).where(User.id.in_(user_ids))
+    ).all())
+
+    now = datetime.utcnow()
+    deltas = _Deltas()
+    for application, stage in events:
+        submitted_at = application.date_submitted or now
+        from_previous = None
+        if stage == 'submitted':
+            day, from_submission = submitted_at.date(), 0
+        else:
+            day, from_submission = now.date(), _seconds_between(submitted_at, now)
+        if stage == 'enrolled':
+            paid_at = connection.execute(
+                select(func.min(Payment.payment_date)).where(Payment.application_id == application.id)
+            ).scalar()
+            from_previous = _seconds_between(paid_at, now)
+        deltas.add(day, stage, application.program_id, application.level,
+                   nationalities.get(application.user_id), from_submission, from_previous)
+    deltas.apply(connection)
+
+
+def rebuild_admissions_rollups(batch_size=500):
+    """Recompute the funnel rollups from the current state of every application
+
+    Past status changes were never recorded, so document decisions are
+    dated on the submission day and left untimed. Payments and enrollments
+    use Payment.payment_date and StudentID.created_at.
+    """
+    first_payment = select(
+        Payment.application_id, func.min(Payment.payment_date).label('paid_at')
+    ).where(Payment.application_id.isnot(None)).group_by(Payment.application_id).subquery()
+
+    rows = db.session.execute(
+        select(
+            Application.program_id, Application.level, Application.status, Application.payment_status,
+            Application.date_submitted, User.nationality, first_payment.c.paid_at, StudentID.created_at
+        )
+        .join(User, User.id == Application.user_id)
+        .outerjoin(first_payment, first_payment.c.application_id == Application.id)
+        .outerjoin(StudentID, StudentID.application_id == Application.id)
+        .execution_options(stream_results=True)
+    ).yield_per(batch_size)
+
+    deltas = _Deltas()
+    for program_id, level, status, payment_status, submitted_at, nationality, paid_at, enrolled_at in rows:
+        if submitted_at is None:
+            continue
+        key = (program_id, level, nationality)
+        deltas.add(submitted_at.date(), 'submitted', *key, 0)
+
+        if status in ('Documents Approved', 'Enrolled'):
+            deltas.add(submitted_at.date(), 'documents_approved', *key)
+        elif status == 'Documents Rejected':
+            deltas.add(submitted_at.date(), 'documents_rejected', *key)
+
+        if payment_status == 'Paid' or paid_at is not None:
+            if paid_at is not None:
+                deltas.add(paid_at.date(), 'paid', *key, _seconds_between(submitted_at, paid_at))
+            else:
+                deltas.add(submitted_at.date(), 'paid', *key)
+
+        if status == 'Enrolled' or enrolled_at is not None:
+            if enrolled_at is not None:
+                deltas.add(enrolled_at.date(), 'enrolled', *key,
+                           _seconds_between(submitted_at, enrolled_at), _seconds_between(paid_at, enrolled_at))
+            else:
+                deltas.add(submitted_at.date(), 'enrolled', *key)
+
+    db.session.execute(rollup_table.delete())
+    deltas.apply(db.session.connection())
+    db.session.commit()
+    return AdmissionsDailyRollup.query.count()
+
+
+def _average_days(seconds, count):
+    return round(seconds / count / 86400, 2) if count else None
+
+
+def funnel_report(start, end, program_id=None, level=None, nationality=None, program_names=None):
+    """Funnel counts, conversion and timings between two dates, from the rollups only"""
+    query = AdmissionsDailyRollup.query.filter(
+        AdmissionsDailyRollup.day >= start,
+        AdmissionsDailyRollup.day <= end
+    )
+    if program_id:
+        query = query.filter(AdmissionsDailyRollup.program_id == program_id)
+    if level:
+        query = query.filter(AdmissionsDailyRollup.level == level)
+    if nationality:
+        query = query.filter(AdmissionsDailyRollup.nationality == nationality)
+    rows = query.order_by(AdmissionsDailyRollup.day).all()
+
+    program_names = program_names or {}
+    stages = {stage: {'count': 0, 'timed': 0, 'from_submission': 0.0, 'from_previous': 0.0}
+              for stage in FUNNEL_STAGES}
+    daily = {}
+    breakdowns = {'program': {}, 'level': {}, 'nationality': {}}
+
+    for row in rows:
+        totals = stages.setdefault(row.stage, {'count': 0, 'timed': 0, 'from_submission': 0.0, 'from_previous': 0.0})
+        totals['count'] += row.event_count
+        totals['timed'] += row.timed_count
+        totals['from_submission'] += row.seconds_from_submission
+        totals['from_previous'] += row.seconds_from_previous
+
+        day = daily.setdefault(row.day.isoformat(), dict.fromkeys(FUNNEL_STAGES, 0))
+        day[row.stage] = day.get(row.stage, 0) + row.event_count
+
+        program = program_names.get(row.program_id, f'Program {row.program_id}')
+        for dimension, key in (('program', program), ('level', row.level), ('nationality', row.nationality)):
+            entry = breakdowns[dimension].setdefault(key, dict.fromkeys(FUNNEL_STAGES, 0))
+            entry[row.stage] = entry.get(row.stage, 0) + row.event_count
+
+    submitted = stages['submitted']['count']
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'stages': [{
+            'stage': stage,
+            'count': stages[stage]['count'],
+            'rate': round(stages[stage]['count'] / submitted, 3) if submitted else None,
+            'avg_days_from_submission': _average_days(stages[stage]['from_submission'], stages[stage]['timed']),
+            'avg_days_from_previous': _average_days(stages[stage]['from_previous'], stages[stage]['timed']),
+        } for stage in FUNNEL_STAGES],
+        'daily': [{'day': day, **counts} for day, counts in sorted(daily.items())],
+        'by_program': breakdowns['program'],
+        'by_level': breakdowns['level'],
+        'by_nationality': breakdowns['nationality'],
+    }
+
+
+def funnel_dimensions():
+    """Levels and nationalities that appear in the rollups, for report filters"""
+    def distinct(column):
+        return [value for (value,) in db.session.query(column).distinct().order_by(column)]
+    return {
+        'levels': distinct(AdmissionsDailyRollup.level),
+        'nationalities': distinct(AdmissionsDailyRollup.nationality),
+    }
+
+
+@click.command('backfill-admissions-funnel')
+@with_appcontext
+def backfill_admissions_funnel_command():
+    """Rebuild the admission funnel rollups from existing applications."""
+    db.create_all()
+    buckets = rebuild_admissions_rollups()
+    click.echo(f'Rebuilt admissions funnel rollups: {buckets} buckets.')
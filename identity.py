@@ -0,0 +1,82 @@
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from cache import VersionStamp, get_cache
+from models import db, User
+
+# Seconds a cached identity may be served before it is re-read from the
+# database. Version bumps reach every worker on the host through the user's
+# stamp file, and other hosts through the invalidation bus when
+# CACHE_REDIS_URL is set; the TTL only bounds staleness if a bump is missed.
+DEFAULT_USER_CACHE_TTL = 30
+
+# Users share a fixed set of stamps, so the stamp files and the stamp objects
+# (with their stat cache) stay bounded however many users there are; a bump
+# makes the users of one shard re-read their row once.
+USER_STAMP_SHARDS = 256
+_user_stamps = [VersionStamp(f'user:{shard}') for shard in range(USER_STAMP_SHARDS)]
+
+
+def user_stamp(user_id):
+    return _user_stamps[user_id % USER_STAMP_SHARDS]
+
+
+def user_version(user_id):
+    return user_stamp(user_id).current()
+
+
+def bump_user_version(user_id):
+    """Invalidate the cached identity of one user in every worker"""
+    return user_stamp(user_id).bump()
+
+
+def _columns(user):
+    # Deferred columns (the password hash) stay out of the cache and load on access
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs if not attr.deferred}
+
+
+def load_cached_user(user_id):
+    """Return the User for a session, skipping the query while it is cached
+
+    The cached column values are turned back into a detached User and merged
+    into the current session without a SELECT, so relationships still lazy
+    load and changes made through current_user are flushed as usual.
+    """
+    ttl = current_app.config.get('USER_CACHE_TTL', DEFAULT_USER_CACHE_TTL)
+    stamp = user_stamp(user_id)
+    version = stamp.current()
+    key = f'identity:{user_id}:{version}'
+    cache = get_cache()
+    columns = cache.get(key) if ttl > 0 else None
+
+    if columns is not None:
+        user = User(**columns)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    # Skip caching if the user was changed while we were reading
+    if user is not None and ttl > 0 and stamp.current() == version:
+        cache.set(key, _columns(user), ttl)
+    return user
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    changed = [obj.id for obj in list(session.dirty) + list(session.deleted)
+               if isinstance(obj, User) and obj.id is not None]
+    if changed:
+        session.info.setdefault('changed_users', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_changed_users(session):
+    # Settings updates, password changes and role changes all land here
+    for user_id in session.info.pop('changed_users', ()):
+        bump_user_version(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop('changed_users', None)
@@ -0,0 +1,199 @@
+from datetime import datetime, date, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, case
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from models import db, Payment, PaymentDailyRollup
+
+rollup_table = PaymentDailyRollup.__table__
+
+
+def fee_type_for(application_id, certificate_id):
+    """Classify a payment as an application fee or a certificate fee"""
+    if application_id:
+        return 'application'
+    if certificate_id:
+        return 'certificate'
+    return 'other'
+
+
+def _bucket(payment_date, payment_method, fee_type, status):
+    payment_date = payment_date or datetime.utcnow()
+    return (payment_date.date(), payment_method or 'Unknown', fee_type, status or 'Completed')
+
+
+def _current_bucket(payment):
+    return _bucket(payment.payment_date, payment.payment_method,
+                   fee_type_for(payment.application_id, payment.certificate_id),
+                   payment.status)
+
+
+# Columns that decide a payment's bucket and what it adds to it
+ROLLUP_FIELDS = ('payment_date', 'payment_method', 'application_id', 'certificate_id', 'status', 'amount')
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    """Only registered for active_history"""
+
+
+# get_history only reports the old value if it was loaded before the change.
+# After a commit expires the payment it is not, so load it on set.
+for _field in ROLLUP_FIELDS:
+    event.listen(getattr(Payment, _field), 'set', _load_old_value, active_history=True)
+
+
+def _previous_bucket(payment):
+    """Bucket the payment was counted in before the pending changes"""
+    values = {}
+    for field in ROLLUP_FIELDS:
+        history = get_history(payment, field)
+        if history.deleted:
+            values[field] = history.deleted[0]
+        else:
+            values[field] = getattr(payment, field)
+    bucket = _bucket(values['payment_date'], values['payment_method'],
+                     fee_type_for(values['application_id'], values['certificate_id']),
+                     values['status'])
+    return bucket, values['amount'] or 0
+
+
+def _apply(connection, deltas):
+    for (day, method, fee_type, status), (count, amount) in deltas.items():
+        if not count and not amount:
+            continue
+        stmt = insert(rollup_table).values(
+            day=day,
+            payment_method=method,
+            fee_type=fee_type,
+            status=status,
+            payment_count=count,
+            total_amount=amount
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'payment_method', 'fee_type', 'status'],
+            set_={
+                'payment_count': rollup_table.c.payment_count + stmt.excluded.payment_count,
+                'total_amount': rollup_table.c.total_amount + stmt.excluded.total_amount,
+            }
+        )
+        connection.execute(stmt)
+
+
+@event.listens_for(Session, 'after_flush')
+def update_payment_rollups(session, flush_context):
+    """Fold payments written in this flush into the daily rollups
+
+    Runs inside the same transaction as the payment itself, so the ledger and
+    the rollups commit or roll back together.
+    """
+    deltas = {}
+
+    def add(bucket, count, amount):
+        current = deltas.get(bucket, (0, 0))
+        deltas[bucket] = (current[0] + count, current[1] + amount)
+
+    for obj in session.new:
+        if isinstance(obj, Payment):
+            add(_current_bucket(obj), 1, obj.amount or 0)
+
+    for obj in session.dirty:
+        if isinstance(obj, Payment) and session.is_modified(obj, include_collections=False):
+            old_bucket, old_amount = _previous_bucket(obj)
+            add(old_bucket, -1, -old_amount)
+            add(_current_bucket(obj), 1, obj.amount or 0)
+
+    for obj in session.deleted:
+        if isinstance(obj, Payment):
+            old_bucket, old_amount = _previous_bucket(obj)
+            add(old_bucket, -1, -old_amount)
+
+    if deltas:
+        _apply(session.connection(), deltas)
+
+
+def rebuild_payment_rollups():
+    """Recompute every rollup bucket from the Payment table"""
+    day = func.date(func.coalesce(Payment.payment_date, func.current_timestamp()))
+    fee_type = case(
+        (Payment.application_id.isnot(None), 'application'),
+        (Payment.certificate_id.isnot(None), 'certificate'),
+        else_='other'
+    )
+    method = func.coalesce(Payment.payment_method, 'Unknown')
+    status = func.coalesce(Payment.status, 'Completed')
+
+    grouped = db.select(
+        day, method, fee_type, status,
+        func.count(Payment.id),
+        func.coalesce(func.sum(Payment.amount), 0)
+    ).group_by(day, method, fee_type, status)
+
+    db.session.execute(rollup_table.delete())
+    db.session.execute(rollup_table.insert().from_select(
+        ['day', 'payment_method', 'fee_type', 'status', 'payment_count', 'total_amount'],
+        grouped
+    ))
+    db.session.commit()
+    return PaymentDailyRollup.query.count()
+
+
+def reconciliation_report(start, end):
+    """Summarize payments between two dates using only the rollup table"""
+    rows = PaymentDailyRollup.query.filter(
+        PaymentDailyRollup.day >= start,
+        PaymentDailyRollup.day <= end,
+        PaymentDailyRollup.payment_count != 0
+    ).order_by(
+        PaymentDailyRollup.day.desc(),
+        PaymentDailyRollup.payment_method,
+        PaymentDailyRollup.fee_type
+    ).all()
+
+    by_method = {}
+    by_fee_type = {}
+    by_status = {}
+    for row in rows:
+        for totals, key in ((by_method, row.payment_method),
+                            (by_fee_type, row.fee_type),
+                            (by_status, row.status)):
+            entry = totals.setdefault(key, {'count': 0, 'amount': 0})
+            entry['count'] += row.payment_count
+            entry['amount'] += row.total_amount
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'total_count': sum(row.payment_count for row in rows),
+        'total_amount': sum(row.total_amount for row in rows),
+        'by_method': by_method,
+        'by_fee_type': by_fee_type,
+        'by_status': by_status,
+        'daily': [{
+            'day': row.day.isoformat(),
+            'payment_method': row.payment_method,
+            'fee_type': row.fee_type,
+            'status': row.status,
+            'count': row.payment_count,
+            'amount': row.total_amount
+        } for row in rows]
+    }
+
+
+def parse_report_range(start_arg, end_arg, default_days=30):
+    """Read a YYYY-MM-DD date range, defaulting to the last default_days days"""
+    end = datetime.strptime(end_arg, '%Y-%m-%d').date() if end_arg else date.today()
+    start = datetime.strptime(start_arg, '%Y-%m-%d').date() if start_arg else end - timedelta(days=default_days)
+    return start, end
+
+
+@click.command('backfill-payment-rollups')
+@with_appcontext
+def backfill_payment_rollups_command():
+    """Rebuild the daily payment rollups from existing payments."""
+    db.create_all()
+    buckets = rebuild_payment_rollups()
+    click.echo(f'Rebuilt payment rollups: {buckets} buckets.')
@@ -0,0 +1,352 @@
+"""Maintenance commands for the portal's SQLite files, safe to run while it serves.
+
+    flask backup-db      consistent copy through the SQLite backup API
+    flask vacuum-db      return free pages to the filesystem
+    flask optimize-db    refresh the query planner's statistics
+    flask check-db       integrity and foreign key checks
+    flask db-sizes       size of every table and index
+    flask maintain-db    vacuum, optimize and check in one go, for cron:
+
+        15 3 * * * cd /srv/portal && FLASK_APP=run.py flask maintain-db --backup
+
+Each command covers the main database and, when ACTIVITY_DATABASE_URI points
+at its own file, the activity database too (see --bind).
+"""
+import glob
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from databases import ACTIVITY_BIND
+from models import db
+
+DEFAULT_BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'backups')
+
+# Pages copied (or vacuumed) per step; the write lock is free between steps
+DEFAULT_STEP_PAGES = 256
+DEFAULT_STEP_SLEEP = 0.05
+
+bind_option = click.option('--bind', type=click.Choice(['main', 'activity', 'all']), default='all',
+                           show_default=True, help='Which database file to work on.')
+
+
+def _databases(bind):
+    """[(label, engine)] of the SQLite files selected by --bind, each file once"""
+    selected = []
+    if bind in ('main', 'all'):
+        selected.append(('main', db.engines[None]))
+    if bind in ('activity', 'all'):
+        engine = db.engines[ACTIVITY_BIND]
+        if bind == 'activity' or engine.url != db.engines[None].url:
+            selected.append((ACTIVITY_BIND, engine))
+
+    for label, engine in selected:
+        if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+            raise click.ClickException(f'The {label} database is not an SQLite file: {engine.url}')
+    return selected
+
+
+def _raw(engine):
+    """A pooled DB-API connection (WAL and busy_timeout already set) and its sqlite3 connection"""
+    connection = engine.raw_connection()
+    return connection, connection.driver_connection
+
+
+def _pragma(sqlite_connection, statement):
+    return sqlite_connection.execute(f'PRAGMA {statement}').fetchall()
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+# Backups
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def backup_database(engine, dest, pages=DEFAULT_STEP_PAGES, sleep=DEFAULT_STEP_SLEEP, max_restarts=3):
+    """Copy a live database to dest a few pages at a time and check the copy
+
+    Writers only wait for the step in progress. A write from another
+    connection between steps makes SQLite restart the copy, so on a busy
+    database the copy falls back to a single step after max_restarts. In
+    WAL mode that step reads one snapshot and writers carry on meanwhile.
+    Returns the number of restarts.
+    """
+    partial = dest + '.partial'
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        state['remaining'] = remaining
+
+    connection, source = _raw(engine)
+    try:
+        if os.path.exists(partial):
+            os.remove(partial)
+        target = sqlite3.connect(partial)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=progress, sleep=sleep)
+            except _TooManyRestarts:
+                source.backup(target)
+            # A single self-contained file, with no -wal alongside it
+            _pragma(target, 'journal_mode=DELETE')
+            result = _pragma(target, 'quick_check')
+        finally:
+            target.close()
+        if result != [('ok',)]:
+            raise click.ClickException(f'Backup of {engine.url.database} failed its integrity check: {result[:5]}')
+        os.replace(partial, dest)
+    except BaseException:
+        # dest is untouched; don't leave half a copy next to it
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        connection.close()
+    return state['restarts']
+
+
+def _prune_backups(backup_dir, stem, keep):
+    backups = sorted(glob.glob(os.path.join(backup_dir, f'{stem}-*.db')))
+    # Plus anything left by a backup that was interrupted
+    stale = glob.glob(os.path.join(backup_dir, f'{stem}-*.db.partial*'))
+    for path in (backups[:-keep] if keep else []) + stale:
+        os.remove(path)
+
+
+def _run_backups(bind, backup_dir, keep, pages, sleep):
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    for label, engine in _databases(bind):
+        stem = os.path.splitext(os.path.basename(engine.url.database))[0]
+        dest = os.path.join(backup_dir, f'{stem}-{stamp}.db')
+        started = time.perf_counter()
+        restarts = backup_database(engine, dest, pages=pages, sleep=sleep)
+        _prune_backups(backup_dir, stem, keep)
+        click.echo(f'{label}: backed up to {dest} ({_format_size(os.path.getsize(dest))}) '
+                   f'in {time.perf_counter() - started:.1f}s' + (f', {restarts} restarts' if restarts else ''))
+
+
+@click.command('backup-db')
+@bind_option
+@click.option('--dir', 'backup_dir', type=click.Path(file_okay=False), default=None,
+              help='Where backups are written (default: BACKUP_DIR).')
+@click.option('--keep', default=7, show_default=True, help='Backups kept per database; 0 keeps all.')
+@click.option('--pages', default=DEFAULT_STEP_PAGES, show_default=True, help='Pages copied per step.')
+@click.option('--sleep', default=DEFAULT_STEP_SLEEP, show_default=True, help='Seconds to pause between steps.')
+@with_appcontext
+def backup_db_command(bind, backup_dir, keep, pages, sleep):
+    """Take a consistent online backup of the portal database."""
+    backup_dir = backup_dir or current_app.config.get('BACKUP_DIR', DEFAULT_BACKUP_DIR)
+    _run_backups(bind, backup_dir, keep, pages, sleep)
+
+
+# Vacuum
+
+def incremental_vacuum(engine, step_pages=DEFAULT_STEP_PAGES, sleep=DEFAULT_STEP_SLEEP):
+    """Free pages in steps, releasing the write lock between them
+
+    Returns (pages freed, whether the file is in incremental mode at all).
+    """
+    connection, sqlite_connection = _raw(engine)
+    try:
+        if _pragma(sqlite_connection, 'auto_vacuum')[0][0] != 2:
+            return 0, False
+        start = free = _pragma(sqlite_connection, 'freelist_count')[0][0]
+        while free:
+            # execute() would step the pragma once and free a single page;
+            # executescript() runs it to completion
+            sqlite_connection.executescript(f'PRAGMA incremental_vacuum({step_pages})')
+            remaining = _pragma(sqlite_connection, 'freelist_count')[0][0]
+            if remaining >= free:
+                break
+            free = remaining
+            time.sleep(sleep)
+        return start - free, True
+    finally:
+        connection.close()
+
+
+def full_vacuum(engine):
+    """Rewrite the file in incremental auto_vacuum mode; blocks writers until done"""
+    connection, sqlite_connection = _raw(engine)
+    try:
+        _pragma(sqlite_connection, 'auto_vacuum=INCREMENTAL')
+        sqlite_connection.execute('VACUUM')
+    finally:
+        connection.close()
+
+
+def _run_vacuum(bind, full, pages, sleep):
+    for label, engine in _databases(bind):
+        path = engine.url.database
+        before = os.path.getsize(path)
+        if full:
+            started = time.perf_counter()
+            full_vacuum(engine)
+            click.echo(f'{label}: rebuilt in {time.perf_counter() - started:.1f}s, '
+                       f'{_format_size(before)} -> {_format_size(os.path.getsize(path))}')
+            continue
+        freed, incremental = incremental_vacuum(engine, pages, sleep)
+        if not incremental:
+            click.echo(f'{label}: auto_vacuum is not incremental; run vacuum-db --full once '
+                       f'(blocks writes while it rewrites the file) to enable it.')
+        else:
+            click.echo(f'{label}: freed {freed} pages, {_format_size(before)} -> '
+                       f'{_format_size(os.path.getsize(path))}')
+
+
+@click.command('vacuum-db')
+@bind_option
+@click.option('--full', is_flag=True,
+              help='Rewrite the whole file and switch it to incremental auto_vacuum (blocks writes).')
+@click.option('--pages', default=DEFAULT_STEP_PAGES, show_default=True, help='Pages freed per step.')
+@click.option('--sleep', default=DEFAULT_STEP_SLEEP, show_default=True, help='Seconds to pause between steps.')
+@with_appcontext
+def vacuum_db_command(bind, full, pages, sleep):
+    """Return free pages left by deletions to the filesystem."""
+    _run_vacuum(bind, full, pages, sleep)
+
+
+# Statistics and checks
+
+def optimize_database(engine, full=False):
+    connection, sqlite_connection = _raw(engine)
+    try:
+        if full:
+            sqlite_connection.execute('ANALYZE')
+        else:
+            # Re-analyze only what changed, sampling large indexes
+            _pragma(sqlite_connection, 'analysis_limit=1000')
+            _pragma(sqlite_connection, 'optimize')
+        sqlite_connection.commit()
+    finally:
+        connection.close()
+
+
+def _run_optimize(bind, full):
+    for label, engine in _databases(bind):
+        started = time.perf_counter()
+        optimize_database(engine, full)
+        click.echo(f"{label}: {'ANALYZE' if full else 'PRAGMA optimize'} "
+                   f"took {time.perf_counter() - started:.2f}s")
+
+
+@click.command('optimize-db')
+@bind_option
+@click.option('--full', is_flag=True, help='Run a full ANALYZE instead of PRAGMA optimize.')
+@with_appcontext
+def optimize_db_command(bind, full):
+    """Refresh the statistics the query planner uses to pick indexes."""
+    _run_optimize(bind, full)
+
+
+def check_database(engine, quick=False):
+    """List of problems found; empty when the file is healthy"""
+    connection, sqlite_connection = _raw(engine)
+    try:
+        problems = [row[0] for row in _pragma(sqlite_connection, 'quick_check' if quick else 'integrity_check')
+                    if row[0] != 'ok']
+        orphans = {}
+        for table, _, parent, _ in _pragma(sqlite_connection, 'foreign_key_check'):
+            orphans[(table, parent)] = orphans.get((table, parent), 0) + 1
+        problems += [f'{table}: {count} rows reference a missing {parent}'
+                     for (table, parent), count in orphans.items()]
+        return problems
+    finally:
+        connection.close()
+
+
+def _run_checks(bind, quick):
+    failed = False
+    for label, engine in _databases(bind):
+        problems = check_database(engine, quick)
+        if problems:
+            failed = True
+            for problem in problems[:50]:
+                click.echo(f'{label}: {problem}', err=True)
+        else:
+            click.echo(f'{label}: ok')
+    if failed:
+        raise click.ClickException('Integrity problems found')
+
+
+@click.command('check-db')
+@bind_option
+@click.option('--quick', is_flag=True, help='quick_check: skips verifying index contents.')
+@with_appcontext
+def check_db_command(bind, quick):
+    """Verify the integrity of the portal database."""
+    _run_checks(bind, quick)
+
+
+def object_sizes(engine):
+    """[(name, type, table, bytes, pages)] for every table and index, largest first"""
+    connection, sqlite_connection = _raw(engine)
+    try:
+        types = {name: (kind, table) for kind, name, table in sqlite_connection.execute(
+            'SELECT type, name, tbl_name FROM sqlite_schema'
+        )}
+        return [
+            (name, *types.get(name, ('table', name)), size, pages)
+            for name, size, pages in sqlite_connection.execute(
+                'SELECT name, SUM(pgsize), COUNT(*) FROM dbstat GROUP BY name ORDER BY 2 DESC'
+            )
+        ]
+    finally:
+        connection.close()
+
+
+@click.command('db-sizes')
+@bind_option
+@click.option('--limit', default=0, help='Only show the largest N tables and indexes.')
+@with_appcontext
+def db_sizes_command(bind, limit):
+    """Report the size of each table and index."""
+    for label, engine in _databases(bind):
+        path = engine.url.database
+        connection, sqlite_connection = _raw(engine)
+        try:
+            page_size = _pragma(sqlite_connection, 'page_size')[0][0]
+            free = _pragma(sqlite_connection, 'freelist_count')[0][0]
+        finally:
+            connection.close()
+        wal = os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0
+        click.echo(f'{label}: {path} {_format_size(os.path.getsize(path))} '
+                   f'(free {_format_size(free * page_size)}, WAL {_format_size(wal)})')
+
+        sizes = object_sizes(engine)
+        width = max([len(name) for name, *_ in sizes] + [4])
+        for name, kind, table, size, pages in sizes[:limit or None]:
+            owner = f' on {table}' if kind == 'index' else ''
+            click.echo(f'  {name:<{width}}  {_format_size(size):>10}  {pages:>8} pages  {kind}{owner}')
+
+
+@click.command('maintain-db')
+@bind_option
+@click.option('--backup', is_flag=True, help='Take a backup first.')
+@click.option('--keep', default=7, show_default=True, help='Backups kept per database.')
+@with_appcontext
+def maintain_db_command(bind, backup, keep):
+    """Scheduled maintenance: backup, incremental vacuum, optimize and quick check."""
+    if backup:
+        _run_backups(bind, current_app.config.get('BACKUP_DIR', DEFAULT_BACKUP_DIR), keep,
+                     DEFAULT_STEP_PAGES, DEFAULT_STEP_SLEEP)
+    _run_vacuum(bind, False, DEFAULT_STEP_PAGES, DEFAULT_STEP_SLEEP)
+    _run_optimize(bind, False)
+    _run_checks(bind, True)
@@ -1,7 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hash_password, get_hasher
 
 db = SQLAlchemy()
 
@@ -11,7 +11,9 @@ class User(db.Model, UserMixin):
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    # scrypt hashes exceed 128 chars. Deferred: only login and password changes read it,
+    # and it must never end up in the identity cache (see identity.py)
+    password_hash = db.deferred(db.Column(db.String(255), nullable=False))
     full_name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20), nullable=True)
     nationality = db.Column(db.String(50), nullable=True)
@@ -24,13 +26,15 @@ class User(db.Model, UserMixin):
     documents = db.relationship('Document', backref='user', lazy=True)
     certificates = db.relationship('Certificate', backref='user', lazy=True)
     tickets = db.relationship('Ticket', backref='user', lazy=True)
-    notifications = db.relationship('Notification', backref='user', lazy=True)
+    # Notifications live on the 'activity' bind, so there is no real foreign key
+    notifications = db.relationship('Notification', primaryjoin='User.id == foreign(Notification.user_id)',
+                                    backref='user', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_hasher().verify(self.password_hash, password)
     
     def is_admin(self):
         return self.role == 'admin'
@@ -54,7 +58,11 @@ class Application(db.Model):
 
 class Document(db.Model):
     __tablename__ = 'document'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Admin review queue: documents in a status, grouped per student/application, oldest first
+        db.Index('ix_document_status_user_application_uploaded', 'status', 'user_id', 'application_id', 'uploaded_at'),
+        {'extend_existing': True}
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -80,7 +88,12 @@ class Certificate(db.Model):
 
 class Ticket(db.Model):
     __tablename__ = 'ticket'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        db.Index('ix_ticket_last_message_at', 'last_message_at'),
+        db.Index('ix_ticket_awaiting_reply_last_message_at', 'awaiting_reply', 'last_message_at'),
+        db.Index('ix_ticket_status_last_message_at', 'status', 'last_message_at'),
+        {'extend_existing': True}
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(db.String(20), unique=True, nullable=False)
@@ -89,11 +102,20 @@ class Ticket(db.Model):
     status = db.Column(db.String(20), default='Open')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Inbox summary, kept up to date by tickets.record_message()
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    last_sender = db.Column(db.String(20), nullable=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    awaiting_reply = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    
     messages = db.relationship('TicketMessage', backref='ticket', lazy=True, order_by='TicketMessage.created_at')
 
 class TicketMessage(db.Model):
     __tablename__ = 'ticket_message'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        db.Index('ix_ticket_message_ticket_id_id', 'ticket_id', 'id'),
+        {'extend_existing': True}
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
@@ -103,9 +125,11 @@ class TicketMessage(db.Model):
 
 class Notification(db.Model):
     __tablename__ = 'notification'
+    __bind_key__ = 'activity'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # References user.id in the main database; not enforced across files
+    user_id = db.Column(db.Integer, nullable=False, index=True)
     message = db.Column(db.String(255), nullable=False)
     read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -133,6 +157,20 @@ class Payment(db.Model):
     transaction_id = db.Column(db.String(100), nullable=True)
     payment_date = db.Column(db.DateTime, default=datetime.utcnow)
 
+class StudentSearchKey(db.Model):
+    """Normalized value an admin can find a student by (see search.py)"""
+    __tablename__ = 'student_search_key'
+    __table_args__ = (
+        # Prefix lookups are range scans on value
+        db.Index('ix_student_search_key_value_user_id', 'value', 'user_id'),
+        {'extend_existing': True}
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # email, phone, name, application, student_id
+    value = db.Column(db.String(255), nullable=False)
+
 class Project(db.Model):
     __tablename__ = 'project'
     __table_args__ = {'extend_existing': True}
@@ -158,15 +196,25 @@ class NewsAnnouncement(db.Model):
     image_path = db.Column(db.String(200))
 
 class Program(db.Model):
+    __table_args__ = (
+        # Natural key for catalog imports
+        db.Index('uq_program_name', 'name', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     name_ar = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     category = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    courses = db.relationship('Course', backref='program', lazy=True)
+    courses = db.relationship('Course', back_populates='program', lazy=True)
 
 class Course(db.Model):
+    __table_args__ = (
+        # Natural key for catalog imports; also serves lookups by (program_id, level)
+        db.Index('uq_course_program_level_name', 'program_id', 'level', 'name', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     name_ar = db.Column(db.String(200), nullable=False)
@@ -175,5 +223,46 @@ class Course(db.Model):
     level = db.Column(db.String(20), nullable=False)  # diploma, masters, doctorate
     semester = db.Column(db.Integer, nullable=False)  # 1 or 2
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    program = db.relationship('Program', back_populates='courses')
+
+
+class PaymentDailyRollup(db.Model):
+    __tablename__ = 'payment_daily_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'payment_method', 'fee_type', 'status', name='uq_payment_rollup_bucket'),
+        {'extend_existing': True}
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    payment_method = db.Column(db.String(50), nullable=False)
+    fee_type = db.Column(db.String(20), nullable=False)  # application or certificate
+    status = db.Column(db.String(20), nullable=False)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+
+
+class AdmissionsDailyRollup(db.Model):
+    """Admission funnel events per day, program, level and nationality
+
+    stage is one of submitted, documents_approved, documents_rejected, paid
+    or enrolled. Seconds totals cover only the timed_count events whose
+    timing is known, so averages are total / timed_count.
+    """
+    __tablename__ = 'admissions_daily_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'stage', 'program_id', 'level', 'nationality', name='uq_admissions_rollup_bucket'),
+        {'extend_existing': True}
+    )
     
-    program = db.relationship('Program', backref='courses')
\ No newline at end of file
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    stage = db.Column(db.String(30), nullable=False)
+    program_id = db.Column(db.Integer, nullable=False)
+    level = db.Column(db.String(20), nullable=False)
+    nationality = db.Column(db.String(50), nullable=False)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    timed_count = db.Column(db.Integer, nullable=False, default=0)
+    seconds_from_submission = db.Column(db.Float, nullable=False, default=0)
+    seconds_from_previous = db.Column(db.Float, nullable=False, default=0)  # enrolled: since payment
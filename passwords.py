@@ -0,0 +1,91 @@
+import os
+import threading
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+DEFAULT_HASH_QUEUE_TIMEOUT = 5.0
+
+
+class HashingBusy(Exception):
+    """Raised when no hashing slot frees up within the queue timeout"""
+
+
+class PasswordHasher:
+    """Bounds how many password hashes a worker computes at once
+
+    Hashing runs on the request thread; hashlib's scrypt and pbkdf2 release
+    the GIL while they work, so other requests on the same worker keep
+    running. At most `concurrency` hashes run at once; callers wait up to
+    `queue_timeout` seconds for a slot and get HashingBusy after that.
+    """
+
+    def __init__(self, method=DEFAULT_HASH_METHOD, concurrency=None, queue_timeout=DEFAULT_HASH_QUEUE_TIMEOUT):
+        self.method = method
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        # Stored hashes start with the full method string, e.g. "scrypt:32768:8:1"
+        self.method_prefix = generate_password_hash('', method=method).split('$', 1)[0]
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusy('Password hashing is saturated')
+        try:
+            return fn(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash or password is None:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when the hash was made with different method or parameters"""
+        return password_hash.split('$', 1)[0] != self.method_prefix
+
+
+_default_hasher = None
+
+
+def get_hasher():
+    """Return the hasher configured for the current app"""
+    global _default_hasher
+
+    if has_app_context():
+        hasher = current_app.extensions.get('password_hasher')
+        if hasher is None:
+            hasher = PasswordHasher(
+                method=current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD),
+                concurrency=current_app.config.get('PASSWORD_HASH_CONCURRENCY'),
+                queue_timeout=current_app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', DEFAULT_HASH_QUEUE_TIMEOUT)
+            )
+            current_app.extensions['password_hasher'] = hasher
+        return hasher
+
+    if _default_hasher is None:
+        _default_hasher = PasswordHasher()
+    return _default_hasher
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(user, password):
+    """Check a user's password and upgrade an outdated hash in place
+
+    When the stored hash uses old parameters it is replaced with one using
+    the configured method; the caller commits it with the rest of the request.
+    """
+    hasher = get_hasher()
+    if not hasher.verify(user.password_hash, password):
+        return False
+    if hasher.needs_rehash(user.password_hash):
+        user.password_hash = hasher.hash(password)
+    return True
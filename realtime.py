@@ -0,0 +1,424 @@
+"""Async handlers for long-lived connections, served next to the Flask app.
+
+Under ASGI (see asgi.py) two endpoints run as coroutines on aiosqlite
+instead of occupying a worker thread each:
+
+    GET /notifications/stream               Server-Sent Events of new notifications
+    GET /tickets/<id>/messages/wait?after=N  long poll for replies newer than N
+
+Every other request is passed to the normal sync Flask views, each on a
+thread from a pool of ASGI_SYNC_THREADS, as many as a threaded WSGI
+worker would run. (asgiref's WsgiToAsgi runs every request on one shared
+thread instead, which would serialize the whole worker.) Idle clients
+cost a coroutine, not a thread: one watcher per table checks MAX(id) on a
+shared connection and wakes waiters only when new rows appear, so the
+database sees the same few queries whether ten or ten thousand clients
+are connected.
+
+Requires the optional aiosqlite package.
+"""
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.cookies import SimpleCookie
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+import aiosqlite
+from sqlalchemy.engine import make_url
+
+from databases import ACTIVITY_BIND
+
+# Enough threads for every admission gate's limit (admission.py) to fill up
+DEFAULT_SYNC_THREADS = 64
+
+
+def _sqlite_path(uri):
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite':
+        raise RuntimeError(f'Async endpoints only support SQLite, not {url.get_backend_name()}')
+    return url.database
+
+
+def _display_time(value):
+    # SQLite returns DATETIME columns as 'YYYY-MM-DD HH:MM:SS.ffffff'
+    if not value:
+        return None, ''
+    moment = datetime.fromisoformat(value)
+    return moment.isoformat() + 'Z', moment.strftime('%Y-%m-%d %H:%M')
+
+
+def _serialize(row):
+    created_at, created_display = _display_time(row['created_at'])
+    data = dict(row)
+    data['created_at'] = created_at
+    data['created_display'] = created_display
+    if 'read' in data:
+        data['read'] = bool(data['read'])
+    return data
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class TableWatcher:
+    """Wakes every waiter when a table gets rows with a higher id"""
+
+    def __init__(self, connection, table, interval):
+        self.connection = connection
+        self.table = table
+        self.interval = interval
+        self.max_id = 0
+        self._changed = asyncio.Condition()
+
+    async def run(self):
+        while True:
+            async with self.connection.execute(f'SELECT MAX(id) FROM "{self.table}"') as cursor:
+                (max_id,) = await cursor.fetchone()
+            if (max_id or 0) > self.max_id:
+                self.max_id = max_id or 0
+                async with self._changed:
+                    self._changed.notify_all()
+            await asyncio.sleep(self.interval)
+
+    async def wait(self, seen, timeout):
+        """Wait until max_id passes `seen`; returns False if the timeout passed first"""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.max_id > seen), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+
+def _wsgi_environ(scope, body):
+    """PEP 3333 environ for an ASGI http scope"""
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    headers = {}
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').lower()
+        if name in ('content-type', 'content-length'):
+            key = name.upper().replace('-', '_')
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        headers.setdefault(key, []).append(value.decode('latin-1'))
+    for key, values in headers.items():
+        environ[key] = ('; ' if key == 'HTTP_COOKIE' else ',').join(values)
+    return environ
+
+
+class _WsgiRequest:
+    """One request to the WSGI app, run on a pool thread
+
+    `send` is the ASGI send callable wrapped to be called from that thread.
+    """
+
+    def __init__(self, wsgi_application, send):
+        self.wsgi_application = wsgi_application
+        self.send = send
+        self.response_start = None
+        self.response_started = False
+        self.content_length = None
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info is not None and self.response_started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        if self.response_start is not None and exc_info is None:
+            raise RuntimeError('start_response called a second time without exc_info')
+        self.content_length = next((int(value) for name, value in headers if name.lower() == 'content-length'), None)
+        self.response_start = {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        }
+
+    def _start(self):
+        if not self.response_started:
+            self.response_started = True
+            self.send(self.response_start)
+
+    def run(self, environ):
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            sent = 0
+            for output in response:
+                self._start()
+                if self.content_length is not None:
+                    output = output[:self.content_length - sent]
+                self.send({'type': 'http.response.body', 'body': output, 'more_body': True})
+                sent += len(output)
+                if sent == self.content_length:
+                    break
+        finally:
+            # WSGI servers must call close(); streamed exports end their request context there
+            if hasattr(response, 'close'):
+                response.close()
+        self._start()
+        self.send({'type': 'http.response.body'})
+
+
+class ThreadedWsgiToAsgi:
+    """Serves a WSGI app under ASGI with up to `threads` requests in parallel
+
+    Only uses asyncio: the request body is read on the event loop, the app
+    runs on the thread pool, and each message it sends is handed back to
+    the loop.
+    """
+
+    def __init__(self, wsgi_application, threads=DEFAULT_SYNC_THREADS):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError(f'Cannot serve a {scope["type"]!r} scope with a WSGI app')
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] != 'http.request':
+                    return  # the client went away before sending its body
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            request = _WsgiRequest(self.wsgi_application, send_from_thread)
+            await loop.run_in_executor(self.executor, request.run, _wsgi_environ(scope, body))
+
+
+class RealtimeApp:
+    """ASGI app: async long-lived endpoints, everything else to Flask"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        self.wsgi = ThreadedWsgiToAsgi(flask_app, config.get('ASGI_SYNC_THREADS', DEFAULT_SYNC_THREADS))
+        self.main_path = _sqlite_path(config['SQLALCHEMY_DATABASE_URI'])
+        self.activity_path = _sqlite_path(
+            config.get('SQLALCHEMY_BINDS', {}).get(ACTIVITY_BIND, config['SQLALCHEMY_DATABASE_URI'])
+        )
+        self.poll_interval = config.get('ASYNC_POLL_INTERVAL', 1.0)
+        self.long_poll_timeout = config.get('LONG_POLL_TIMEOUT', 25)
+        self.heartbeat = config.get('SSE_HEARTBEAT', 15)
+        self.serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self._started = None
+        # Templates only point clients at these endpoints when they exist
+        config['ASYNC_ENDPOINTS'] = True
+
+    async def _connect(self, path):
+        connection = await aiosqlite.connect(path)
+        connection.row_factory = aiosqlite.Row
+        return connection
+
+    async def _start(self):
+        self.main_db = await self._connect(self.main_path)
+        self.activity_db = (self.main_db if self.activity_path == self.main_path
+                            else await self._connect(self.activity_path))
+        self.notifications = TableWatcher(self.activity_db, 'notification', self.poll_interval)
+        self.ticket_messages = TableWatcher(self.main_db, 'ticket_message', self.poll_interval)
+        self._tasks = [asyncio.create_task(self._watch(self.notifications)),
+                       asyncio.create_task(self._watch(self.ticket_messages))]
+
+    async def _watch(self, watcher):
+        """Run a watcher for good; if its query fails, log it and start again
+
+        A watcher that died silently would leave every waiter hanging until
+        its timeout.
+        """
+        while True:
+            try:
+                await watcher.run()
+            except Exception:
+                self.flask_app.logger.exception('Watcher for %s failed; restarting', watcher.table)
+                await asyncio.sleep(watcher.interval)
+
+    async def _ensure_started(self):
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await self._started
+
+    async def _stop(self):
+        if self._started is None:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await self.main_db.close()
+        if self.activity_db is not self.main_db:
+            await self.activity_db.close()
+        self.wsgi.executor.shutdown(wait=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            path = scope['path']
+            if path == '/notifications/stream':
+                return await self._notification_stream(scope, receive, send)
+            parts = path.strip('/').split('/')
+            if len(parts) == 4 and parts[0] == 'tickets' and parts[2:] == ['messages', 'wait'] and parts[1].isdigit():
+                return await self._wait_for_messages(scope, send, int(parts[1]))
+
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self._ensure_started()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self._stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Helpers
+
+    def _user_id(self, scope):
+        """User id from the Flask-Login session cookie, or None"""
+        cookies = SimpleCookie()
+        for name, value in scope['headers']:
+            if name == b'cookie':
+                cookies.load(value.decode('latin-1'))
+        cookie = cookies.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        if cookie is None:
+            return None
+        try:
+            session = self.serializer.loads(
+                cookie.value, max_age=int(self.flask_app.permanent_session_lifetime.total_seconds())
+            )
+        except Exception:
+            return None
+        user_id = session.get('_user_id')
+        return int(user_id) if user_id and str(user_id).isdigit() else None
+
+    async def _fetch(self, connection, sql, params=()):
+        async with connection.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    async def _json(self, send, status, data):
+        body = json.dumps(data).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'cache-control', b'no-store')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    # Endpoints
+
+    async def _wait_for_messages(self, scope, send, ticket_id):
+        await self._ensure_started()
+        user_id = self._user_id(scope)
+        if user_id is None:
+            return await self._json(send, 401, {'success': False, 'message': 'Login required'})
+
+        user = await self._fetch(self.main_db, 'SELECT role FROM user WHERE id = ?', (user_id,))
+        ticket = await self._fetch(self.main_db, 'SELECT user_id, status FROM ticket WHERE id = ?', (ticket_id,))
+        if not ticket:
+            return await self._json(send, 404, {'success': False, 'message': 'Ticket not found'})
+        # Admins see every ticket, students only their own
+        if not user or (user[0]['role'] != 'admin' and ticket[0]['user_id'] != user_id):
+            return await self._json(send, 403, {'success': False, 'message': 'Access denied'})
+
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        try:
+            after = int(query.get('after', ['0'])[0])
+        except ValueError:
+            after = 0
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.long_poll_timeout
+        while True:
+            seen = self.ticket_messages.max_id
+            rows = await self._fetch(
+                self.main_db,
+                'SELECT id, sender, message, created_at FROM ticket_message '
+                'WHERE ticket_id = ? AND id > ? ORDER BY id',
+                (ticket_id, after)
+            )
+            remaining = deadline - loop.time()
+            if rows or remaining <= 0 or not await self.ticket_messages.wait(seen, remaining):
+                break
+
+        status = await self._fetch(self.main_db, 'SELECT status FROM ticket WHERE id = ?', (ticket_id,))
+        await self._json(send, 200, {
+            'success': True,
+            'status': status[0]['status'] if status else ticket[0]['status'],
+            'messages': [_serialize(row) for row in rows],
+            'has_older': None
+        })
+
+    async def _notification_stream(self, scope, receive, send):
+        await self._ensure_started()
+        user_id = self._user_id(scope)
+        if user_id is None:
+            return await self._json(send, 401, {'success': False, 'message': 'Login required'})
+
+        # Resume after the last event the browser saw, or start from now
+        headers = dict(scope['headers'])
+        last_id = headers.get(b'last-event-id', b'').decode('latin-1')
+        if last_id.isdigit():
+            last_id = int(last_id)
+        else:
+            rows = await self._fetch(self.activity_db,
+                                     'SELECT MAX(id) AS id FROM notification WHERE user_id = ?', (user_id,))
+            last_id = rows[0]['id'] or 0
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-store'),
+                                (b'x-accel-buffering', b'no')]})
+
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            while not disconnected.done():
+                seen = self.notifications.max_id
+                rows = await self._fetch(
+                    self.activity_db,
+                    'SELECT id, message, read, created_at FROM notification '
+                    'WHERE user_id = ? AND id > ? ORDER BY id',
+                    (user_id, last_id)
+                )
+                chunks = []
+                for row in rows:
+                    last_id = row['id']
+                    chunks.append(f'id: {row["id"]}\nevent: notification\ndata: {json.dumps(_serialize(row))}\n\n')
+                if not chunks and not await self.notifications.wait(seen, self.heartbeat):
+                    chunks.append(': keep-alive\n\n')
+                if chunks:
+                    await send({'type': 'http.response.body', 'body': ''.join(chunks).encode('utf-8'),
+                                'more_body': True})
+        except OSError:
+            pass  # client went away mid-write
+        finally:
+            disconnected.cancel()
@@ -0,0 +1,160 @@
+"""Read-only snapshot of the main database for admin reports and exports.
+
+Views decorated with reads_report_snapshot send their SELECTs on main-bind
+tables to a copy of the database instead of the file students are writing
+to, so long report and export reads never hold back checkpoints or wait on
+write locks. Writes, and reads of activity-bind tables such as
+notifications, still go to the live databases.
+
+The copy is refreshed with the SQLite backup API by
+
+    flask refresh-report-snapshot --every 300
+
+run as a sidecar (or without --every from cron). Each refresh replaces the
+file atomically; connections open it read-only and immutable, one per
+checkout, so the next query sees the new copy. Pages show how old the data
+is, and responses carry an X-Data-As-Of header. Until a snapshot exists the
+views read the live database as before.
+
+Refreshing takes a POSIX file lock (fcntl) so two refreshes never write the
+same copy; on other platforms the views still work, but the refresh command
+refuses to run.
+"""
+import os
+import time
+from datetime import datetime
+from functools import wraps
+
+import click
+from flask import current_app, g, has_app_context, make_response
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from maintenance import DEFAULT_STEP_PAGES, DEFAULT_STEP_SLEEP, backup_database
+from models import db
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'report_snapshot.db')
+
+
+class ReportSnapshot:
+    """The snapshot file, its read-only engine and routing counters"""
+
+    def __init__(self, path):
+        self.path = path
+        self.routed = 0
+        self.refreshes = 0
+        self._engine = None
+
+    def as_of(self):
+        """UTC time the current copy was started, or None if there is none yet"""
+        try:
+            return datetime.utcfromtimestamp(os.stat(self.path).st_mtime)
+        except FileNotFoundError:
+            return None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            # immutable: the file is only ever replaced, never written in place
+            self._engine = create_engine(f'sqlite:///file:{self.path}?mode=ro&immutable=1&uri=true',
+                                         poolclass=NullPool)
+        return self._engine
+
+    def refresh(self, primary, pages=DEFAULT_STEP_PAGES, sleep=DEFAULT_STEP_SLEEP):
+        """Copy the primary database over the snapshot; False if another refresh is running"""
+        if fcntl is None:
+            raise click.ClickException('Refreshing the report snapshot needs POSIX file locking (fcntl).')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            started = time.time()
+            backup_database(primary, self.path, pages=pages, sleep=sleep)
+            # The copy holds data as of (at least) the moment it started
+            os.utime(self.path, (started, started))
+            self.refreshes += 1
+            return True
+
+    def snapshot(self):
+        as_of = self.as_of()
+        return {
+            'path': self.path,
+            'as_of': as_of.isoformat() + 'Z' if as_of else None,
+            'size': os.path.getsize(self.path) if as_of else 0,
+            'routed_queries': self.routed,
+        }
+
+
+def init_reporting(app):
+    app.extensions['report_snapshot'] = ReportSnapshot(app.config.get('REPORT_SNAPSHOT_PATH', DEFAULT_SNAPSHOT_PATH))
+
+
+def get_snapshot():
+    snapshot = current_app.extensions.get('report_snapshot')
+    if snapshot is None:
+        init_reporting(current_app._get_current_object())
+        snapshot = current_app.extensions['report_snapshot']
+    return snapshot
+
+
+def report_snapshot_metrics():
+    return get_snapshot().snapshot()
+
+
+def reads_report_snapshot(view):
+    """Serve a report, export or dashboard view from the snapshot when there is one"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        snapshot = get_snapshot()
+        as_of = snapshot.as_of()
+        if as_of is None:
+            return view(*args, **kwargs)
+        g.report_snapshot = snapshot
+        g.report_as_of = as_of
+        response = make_response(view(*args, **kwargs))
+        response.headers['X-Data-As-Of'] = as_of.isoformat() + 'Z'
+        return response
+    return wrapper
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _route_to_snapshot(state):
+    if not state.is_select or not has_app_context():
+        return
+    snapshot = g.get('report_snapshot')
+    if snapshot is None or state.bind_arguments.get('bind') is not None:
+        return
+    mapper = state.bind_mapper
+    if mapper is not None and mapper.local_table.metadata.info.get('bind_key') is not None:
+        return
+    if state.session.get_bind(mapper=mapper, clause=state.statement) is db.engines[None]:
+        state.bind_arguments['bind'] = snapshot.engine
+        snapshot.routed += 1
+
+
+@click.command('refresh-report-snapshot')
+@click.option('--every', type=float, default=None,
+              help='Keep running and refresh every N seconds instead of once.')
+@click.option('--pages', default=DEFAULT_STEP_PAGES, show_default=True, help='Pages copied per step.')
+@with_appcontext
+def refresh_report_snapshot_command(every, pages):
+    """Copy the main database into the read-only reporting snapshot."""
+    snapshot = get_snapshot()
+    while True:
+        started = time.perf_counter()
+        if snapshot.refresh(db.engines[None], pages=pages):
+            click.echo(f'Snapshot refreshed in {time.perf_counter() - started:.1f}s: {snapshot.path}')
+        else:
+            click.echo('Another refresh is already running; skipped.')
+        if every is None:
+            break
+        time.sleep(max(every - (time.perf_counter() - started), 0))
@@ -1,18 +1,44 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_from_directory
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, session,
+                   send_from_directory, send_file, g)
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_migrate import Migrate
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from markupsafe import Markup, escape
 from datetime import datetime
 import os
 from dotenv import load_dotenv
+import click
+from flask.cli import with_appcontext
 
 # Import models
-from models import db
-from models.user import User
-from models.project import Project
-from models.news import NewsAnnouncement
-# ... import other models as needed
+from models import (db, User, Application, Document, Certificate, Ticket, Notification,
+                    StudentID, Payment, Project, NewsAnnouncement)
+from exports import EXPORTS, export_response
+from ledger import reconciliation_report, parse_report_range, backfill_payment_rollups_command
+from cache import init_cache, cache_metrics
+from compression import init_compression, compression_metrics
+from catalog import all_programs, courses_for
+from identity import load_cached_user
+from passwords import HashingBusy, verify_password
+from admission import init_admission, admission_metrics
+from tickets import (latest_messages, messages_since, page_size, serialize_message,
+                     inbox_query, inbox_counts, backfill_ticket_inbox_command)
+from uploads import save_upload, delete_upload, upload_url, migrate_uploads_command, gc_uploads_command
+from services import (submit_application, application_fee, pay_application, request_certificate,
+                      pay_certificate, certificate_ready_for_pickup, open_ticket, reply_to_ticket,
+                      update_ticket_status, issue_student_id, add_document, review_document,
+                      read_all_notifications, CERTIFICATE_FEE_PER_COPY, init_commit_metrics, commit_metrics)
+from writes import init_write_coordinator, write_metrics
+from databases import init_databases, move_activity_tables_command
+from funnel import funnel_report, funnel_dimensions, backfill_admissions_funnel_command
+from catalog_import import CATALOG_COLUMNS, CatalogImportError, import_catalog, import_catalog_command
+from search import search_students, serialize_match, rebuild_student_search_command
+from reporting import (init_reporting, reads_report_snapshot, report_snapshot_metrics,
+                       refresh_report_snapshot_command)
+from maintenance import (backup_db_command, vacuum_db_command, optimize_db_command, check_db_command,
+                         db_sizes_command, maintain_db_command)
+from documents import (REVIEW_STATUSES, review_queue, review_counts, init_previews, get_renderer,
+                       schedule_preview, preview_metrics, render_document_previews_command)
 
 load_dotenv()
 
@@ -33,12 +59,69 @@ for path in [INSTANCE_PATH, UPLOAD_PATH, PROJECTS_UPLOAD_FOLDER]:
 
 # Configure app
 app.config['SECRET_KEY'] = 'your-secret-key-goes-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(INSTANCE_PATH, "university_portal.db")}'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL', f'sqlite:///{os.path.join(INSTANCE_PATH, "university_portal.db")}'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# High-churn tables (notifications) can get their own SQLite file and write lock
+app.config['SQLALCHEMY_BINDS'] = {
+    'activity': os.environ.get('ACTIVITY_DATABASE_URI', app.config['SQLALCHEMY_DATABASE_URI'])
+}
 app.config['UPLOAD_FOLDER'] = UPLOAD_PATH
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 30))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_CONCURRENCY'] = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', os.cpu_count() or 1))
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+
+# Group commit for small writes (ticket replies, read marks, document records)
+app.config['WRITE_COORDINATOR'] = os.environ.get('WRITE_COORDINATOR', '0') == '1'
+app.config['WRITE_BATCH_WINDOW_MS'] = float(os.environ.get('WRITE_BATCH_WINDOW_MS', 5))
+app.config['WRITE_BATCH_MAX'] = int(os.environ.get('WRITE_BATCH_MAX', 64))
+app.config['WRITE_TIMEOUT'] = float(os.environ.get('WRITE_TIMEOUT', 10))
+
+# Async endpoints, only used when served through asgi.py
+app.config['ASGI_SYNC_THREADS'] = int(os.environ.get('ASGI_SYNC_THREADS', 64))  # sync views in parallel
+app.config['ASYNC_POLL_INTERVAL'] = float(os.environ.get('ASYNC_POLL_INTERVAL', 1))
+app.config['LONG_POLL_TIMEOUT'] = float(os.environ.get('LONG_POLL_TIMEOUT', 25))
+app.config['SSE_HEARTBEAT'] = float(os.environ.get('SSE_HEARTBEAT', 15))
+
+# Upload storage: 'local' (static/ on this server) or 's3' (any S3-compatible store)
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+app.config['S3_REGION'] = os.environ.get('S3_REGION')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+app.config['S3_PRESIGN_EXPIRES'] = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+
+# Document previews for the admin review queue, rendered in a process pool
+app.config['PREVIEW_CACHE_DIR'] = os.environ.get('PREVIEW_CACHE_DIR', os.path.join(INSTANCE_PATH, 'previews'))
+app.config['PREVIEW_SIZE'] = int(os.environ.get('PREVIEW_SIZE', 480))
+app.config['PREVIEW_WORKERS'] = int(os.environ.get('PREVIEW_WORKERS', 2))
+
+# App cache: 'local' (per-process LRU) or 'redis' (shared). Setting
+# CACHE_REDIS_URL also broadcasts cache invalidations to every worker.
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'local')
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')  # e.g. redis://localhost:6379/0
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 4096))
+app.config['CACHE_DEFAULT_TTL'] = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+
+# Where `flask backup-db` writes database copies
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', os.path.join(INSTANCE_PATH, 'backups'))
+
+# Read-only copy of the main database that reports and exports read from,
+# refreshed by `flask refresh-report-snapshot`
+app.config['REPORT_SNAPSHOT_PATH'] = os.environ.get('REPORT_SNAPSHOT_PATH',
+                                                    os.path.join(INSTANCE_PATH, 'report_snapshot.db'))
+
+# gzip/brotli for text responses; brotli needs the optional `brotli` package
+app.config['COMPRESSION_ENABLED'] = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+app.config['COMPRESSION_GZIP_LEVEL'] = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
 
 # Initialize extensions
 db.init_app(app)
+init_databases(app)
 migrate = Migrate(app, db)
 
 # Initialize login manager
@@ -46,6 +129,15 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Cap concurrent requests per route class and shed low-priority traffic
+init_admission(app)
+init_commit_metrics(app)
+init_write_coordinator(app)
+init_previews(app)
+init_cache(app)
+init_reporting(app)
+init_compression(app)
+
 def allowed_file(filename):
     """Check if uploaded file has an allowed extension"""
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
@@ -77,34 +169,26 @@ if __name__ == '__main__':
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Served from the identity cache; any commit that changes the user bumps it
+    return load_cached_user(int(user_id))
+
+def timestamp_html(value, fmt, text):
+    """<time> element the browser formats with static/js/timestamps.js
+
+    Pages carry only the ISO value and a fixed fallback, never the current
+    time, so the same data always renders the same HTML and can be cached.
+    """
+    # Stored datetimes are naive UTC
+    iso = value.isoformat() + 'Z' if isinstance(value, datetime) else value.isoformat()
+    return Markup(f'<time datetime="{iso}" data-format="{fmt}">{escape(text)}</time>')
+
 
 @app.template_filter('time_ago')
 def time_ago_filter(time):
-    """Format a timestamp as 'time ago' (e.g., "3 hours ago")"""
-    now = datetime.utcnow()
-    diff = now - time
-    
-    seconds = diff.total_seconds()
-    
-    if seconds < 60:
-        return "just now"
-    elif seconds < 3600:
-        minutes = int(seconds / 60)
-        return f"{minutes} minute{'s' if minutes > 1 else ''} ago"
-    elif seconds < 86400:
-        hours = int(seconds / 3600)
-        return f"{hours} hour{'s' if hours > 1 else ''} ago"
-    elif seconds < 604800:
-        days = int(seconds / 86400)
-        return f"{days} day{'s' if days > 1 else ''} ago"
-    elif seconds < 2592000:
-        weeks = int(seconds / 604800)
-        return f"{weeks} week{'s' if weeks > 1 else ''} ago"
-    else:
-        return time.strftime("%Y-%m-%d")
-    
-
+    """Format a timestamp as 'time ago' (e.g., "3 hours ago") in the browser"""
+    if time is None:
+        return ''
+    return timestamp_html(time, 'relative', time.strftime('%Y-%m-%d %H:%M'))
     
 @app.template_filter('initials')
 def initials_filter(name):
@@ -177,7 +261,16 @@ def login():
         
         user = User.query.filter_by(email=email).first()
         
-        if user and user.check_password(password):
+        try:
+            authenticated = user is not None and verify_password(user, password)
+        except HashingBusy:
+            flash('Too many sign-in attempts right now, please try again in a moment.', 'danger')
+            return render_template('login.html'), 503, {'Retry-After': '5'}
+        
+        if authenticated:
+            # Persist a hash upgraded to the current parameters
+            if db.session.is_modified(user):
+                db.session.commit()
             login_user(user)
             if user.is_admin():
                 return redirect(url_for('admin_dashboard'))
@@ -220,7 +313,11 @@ def register():
             nationality=nationality,
             education=education
         )
-        new_user.set_password(password)
+        try:
+            new_user.set_password(password)
+        except HashingBusy:
+            flash('The server is busy, please try again in a moment.', 'danger')
+            return render_template('register.html'), 503, {'Retry-After': '5'}
         
         db.session.add(new_user)
         db.session.commit()
@@ -247,7 +344,10 @@ def logout():
 @login_required
 
 def admin_applications():
-    applications = Application.query.all()
+    applications = Application.query.options(
+        db.joinedload(Application.user),
+        db.joinedload(Application.program)
+    ).all()
     return render_template('admin/applications.html', applications=applications)
 
 @app.route('/admin/application/<int:application_id>/<action>', methods=['POST'])
@@ -268,6 +368,113 @@ def admin_application_action(application_id, action):
 
 
 
+@app.route('/admin/documents')
+@login_required
+def admin_documents():
+    if not current_user.is_admin():
+        return redirect(url_for('student_dashboard'))
+    
+    status = request.args.get('status', 'Uploaded')
+    if status not in REVIEW_STATUSES:
+        status = 'Uploaded'
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    groups, has_more = review_queue(status, page)
+    return render_template('admin/documents.html',
+                          groups=groups,
+                          has_more=has_more,
+                          status=status,
+                          page=page,
+                          counts=review_counts(),
+                          can_preview=get_renderer().can_preview)
+
+@app.route('/admin/documents/<int:doc_id>/preview')
+@login_required
+def admin_document_preview(doc_id):
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    document = Document.query.get_or_404(doc_id)
+    renderer = get_renderer()
+    path = renderer.cached(document.file_path)
+    if path is None:
+        # Not rendered yet (or uploaded before previews existed); the page retries
+        renderer.schedule(document.file_path)
+        return '', 202, {'Retry-After': '2', 'Cache-Control': 'no-store'}
+    
+    # A stored path never changes, so its preview can be cached by the browser
+    response = send_file(path, mimetype='image/jpeg', max_age=86400)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@app.route('/admin/documents/<int:doc_id>/<action>', methods=['POST'])
+@login_required
+def admin_document_action(doc_id, action):
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    statuses = {'verify': 'Verified', 'reject': 'Rejected'}
+    if action not in statuses:
+        return jsonify({'success': False, 'message': 'Invalid action'})
+    
+    document = Document.query.get_or_404(doc_id)
+    review_document(document, statuses[action])
+    return jsonify({'success': True, 'status': statuses[action]})
+
+@app.route('/admin/catalog/import', methods=['GET', 'POST'])
+@login_required
+def admin_catalog_import():
+    if not current_user.is_admin():
+        return redirect(url_for('student_dashboard'))
+    
+    report = None
+    if request.method == 'POST':
+        file = request.files.get('catalog')
+        if not file or file.filename == '':
+            flash('No selected file', 'danger')
+            return redirect(request.url)
+        
+        try:
+            report = import_catalog(file.stream, file.filename, dry_run=request.form.get('dry_run') == '1')
+        except CatalogImportError as e:
+            flash(str(e), 'danger')
+            return redirect(request.url)
+        
+        if not report.dry_run:
+            flash(f'Imported {len(report.programs)} programs and {report.courses} courses', 'success')
+    
+    return render_template('admin/catalog_import.html', report=report, columns=CATALOG_COLUMNS)
+
+@app.route('/admin/api/students/search')
+@login_required
+def admin_student_search():
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    matches = search_students(request.args.get('q', ''), limit)
+    return jsonify({'success': True, 'results': [serialize_match(user, kind) for user, kind in matches]})
+
+@app.route('/admin/students/<int:user_id>')
+@login_required
+def admin_student_detail(user_id):
+    if not current_user.is_admin():
+        return redirect(url_for('student_dashboard'))
+    
+    student = User.query.get_or_404(user_id)
+    applications = Application.query.options(
+        db.joinedload(Application.program),
+        db.joinedload(Application.student_id)
+    ).filter_by(user_id=student.id).order_by(Application.date_submitted.desc()).all()
+    tickets = Ticket.query.filter_by(user_id=student.id).order_by(Ticket.created_at.desc()).all()
+    payments = Payment.query.filter_by(user_id=student.id).order_by(Payment.payment_date.desc()).all()
+    return render_template('admin/student_detail.html',
+                          student=student,
+                          applications=applications,
+                          tickets=tickets,
+                          payments=payments)
+
 @app.route('/admin/enrollments')
 @login_required
 def admin_enrollments():
@@ -275,7 +482,10 @@ def admin_enrollments():
         return redirect(url_for('student_dashboard'))
     
     # Get applications with paid status that need student IDs
-    enrollments = db.session.query(Application).filter_by(
+    enrollments = db.session.query(Application).options(
+        db.joinedload(Application.user),
+        db.joinedload(Application.program)
+    ).filter_by(
         status='Documents Approved', 
         payment_status='Paid'
     ).outerjoin(
@@ -286,7 +496,10 @@ def admin_enrollments():
     ).all()
     
     # Get applications with student IDs
-    enrolled_students = db.session.query(Application, StudentID).join(
+    enrolled_students = db.session.query(Application, StudentID).options(
+        db.joinedload(Application.user),
+        db.joinedload(Application.program)
+    ).join(
         StudentID, 
         Application.id == StudentID.application_id
     ).all()
@@ -295,6 +508,20 @@ def admin_enrollments():
                           enrollments=enrollments,
                           enrolled_students=enrolled_students)
 
+@app.route('/admin/export/<name>.<fmt>')
+@login_required
+@reads_report_snapshot
+def admin_export(name, fmt):
+    if not current_user.is_admin():
+        return redirect(url_for('student_dashboard'))
+    
+    if name not in EXPORTS or fmt not in ('csv', 'xlsx'):
+        flash('Unknown export requested', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    
+    # Rows are streamed from the database in batches, never loaded with .all()
+    return export_response(name, fmt)
+
 @app.route('/admin/generate_student_id/<int:app_id>', methods=['POST'])
 @login_required
 def generate_student_id(app_id):
@@ -304,48 +531,8 @@ def generate_student_id(app_id):
     application = Application.query.get_or_404(app_id)
     
     try:
-        # Generate student ID based on nationality and program
-        year = datetime.utcnow().year
-        # Determine if student is local or international
-        is_international = application.user.nationality != 'Egyptian'
-        prefix = 'INT-' if is_international else 'LOC-'
-        
-        # Get program code from first letters of each word
-        program_code = ''.join(word[0].upper() for word in application.program.split())
-        
-        # Find latest ID for this year, type and program
-        latest_student = StudentID.query.filter(
-            StudentID.student_id.like(f'{year}-{prefix}{program_code}%')
-        ).order_by(StudentID.student_id.desc()).first()
-        
-        if latest_student:
-            last_number = int(latest_student.student_id.split('-')[-1])
-            new_number = str(last_number + 1).zfill(4)
-        else:
-            new_number = '0001'
-        
-        # Format: YYYY-TYPE-PROG-XXXX (e.g., 2025-INT-MBA-0001)
-        student_id = f"{year}-{prefix}{program_code}-{new_number}"
-        
-        # Create new StudentID record
-        new_student_id = StudentID(
-            student_id=student_id,
-            application_id=application.id
-        )
-        
-        # Create notification for student with Arabic message
-        notification = Notification(
-            user_id=application.user_id,
-            message=f'🎓 تم إنشاء رقم الطالب الخاص بك: {student_id}',
-            read=False
-        )
-        
-        # Update application status
-        application.status = 'Enrolled'
-        
-        db.session.add(new_student_id)
-        db.session.add(notification)
-        db.session.commit()
+        new_student_id, is_international = issue_student_id(application)
+        student_id = new_student_id.student_id
         
         return jsonify({
             'success': True,
@@ -363,6 +550,7 @@ def generate_student_id(app_id):
 
 @app.route('/admin/dashboard')
 @login_required
+@reads_report_snapshot
 def admin_dashboard():
     if not current_user.is_admin():
         flash('Access denied: Admin privileges required', 'danger')
@@ -374,12 +562,19 @@ def admin_dashboard():
     certificate_requests = Certificate.query.count()
     open_tickets = Ticket.query.filter_by(status='Open').count()
     
-    # Get recent applications and tickets
-    recent_applications = Application.query.order_by(Application.date_submitted.desc()).limit(3).all()
-    recent_tickets = Ticket.query.order_by(Ticket.created_at.desc()).limit(3).all()
+    # Get recent applications and tickets, with the rows the template shows next to them
+    recent_applications = Application.query.options(
+        db.joinedload(Application.user),
+        db.joinedload(Application.program)
+    ).order_by(Application.date_submitted.desc()).limit(3).all()
+    recent_tickets = Ticket.query.options(
+        db.joinedload(Ticket.user)
+    ).order_by(Ticket.created_at.desc()).limit(3).all()
     
     # Get recent certificate requests
-    recent_certificates = Certificate.query.order_by(Certificate.request_date.desc()).limit(3).all()
+    recent_certificates = Certificate.query.options(
+        db.joinedload(Certificate.user)
+    ).order_by(Certificate.request_date.desc()).limit(3).all()
     
     return render_template('admin/dashboard.html', 
                           applications_count=applications_count,
@@ -406,23 +601,8 @@ def admin_update_certificate(cert_id):
     action = request.form.get('action')
     
     if action == 'process':
-        # Update certificate status
-        certificate.status = 'Ready for Pickup'
-        
-        # Add processing notes if provided
-        notes = request.form.get('notes', '')
-        if notes:
-            certificate.processing_notes = notes
-        
-        # Create notification for student
-        notification = Notification(
-            user_id=certificate.user_id,
-            message=f'🎉 شهادتك "{certificate.type}" جاهزة للاستلام!',
-            read=False
-        )
-        
-        db.session.add(notification)
-        db.session.commit()
+        # Mark ready, keep any processing notes and notify the student
+        certificate_ready_for_pickup(certificate, request.form.get('notes', ''))
         
         return jsonify({
             'success': True,
@@ -442,7 +622,12 @@ def admin_certificates():
         return redirect(url_for('student_dashboard'))
     
     # Get all certificates including pending payment ones
-    certificates = Certificate.query.order_by(Certificate.request_date.desc()).all()
+    # The template walks each user's applications for a student ID
+    certificates = Certificate.query.options(
+        db.joinedload(Certificate.user)
+        .selectinload(User.applications)
+        .joinedload(Application.student_id)
+    ).order_by(Certificate.request_date.desc()).all()
     
     return render_template('admin/certificates.html', certificates=certificates)
 
@@ -453,8 +638,18 @@ def admin_tickets():
     if not current_user.is_admin():
         return redirect(url_for('student_dashboard'))
     
-    tickets = Ticket.query.order_by(Ticket.created_at.desc()).all()
-    return render_template('admin/tickets.html', tickets=tickets)
+    sort = request.args.get('sort', 'activity')
+    status = request.args.get('status') or None
+    awaiting = request.args.get('awaiting') == '1'
+    
+    # Single indexed query over the denormalized inbox columns
+    tickets = inbox_query(sort=sort, status=status, awaiting=awaiting).all()
+    return render_template('admin/tickets.html',
+                          tickets=tickets,
+                          counts=inbox_counts(),
+                          sort=sort,
+                          status=status,
+                          awaiting=awaiting)
 
 @app.route('/admin/tickets/<int:ticket_id>')
 @login_required
@@ -463,7 +658,9 @@ def admin_ticket_detail(ticket_id):
         return redirect(url_for('student_dashboard'))
         
     ticket = Ticket.query.get_or_404(ticket_id)
-    return render_template('admin/ticket_detail.html', ticket=ticket)
+    # Only the latest page of the thread; older messages load on demand
+    messages, has_older = latest_messages(ticket.id)
+    return render_template('admin/ticket_detail.html', ticket=ticket, messages=messages, has_older=has_older)
 
 @app.route('/admin/tickets/reply/<int:ticket_id>', methods=['POST'])
 @login_required
@@ -477,28 +674,10 @@ def admin_ticket_reply(ticket_id):
     if not message_text:
         return jsonify({'success': False, 'message': 'Message cannot be empty'})
 
-    # Create a new message
-    new_message = TicketMessage(
-        ticket_id=ticket.id,
-        sender='Admin',
-        message=message_text
-    )
-    
-    # Update ticket status to In Progress if it's Open
-    if ticket.status == 'Open':
-        ticket.status = 'In Progress'
-    
-    # Create notification for student
-    notification = Notification(
-        user_id=ticket.user_id,
-        message=f'New reply to your ticket: {ticket.subject}'
-    )
-    
-    db.session.add(new_message)
-    db.session.add(notification)
-    db.session.commit()
+    # Reply, move Open tickets to In Progress and notify the student
+    message_id = reply_to_ticket(ticket, 'Admin', message_text)
     
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'message_id': message_id})
 
 @app.route('/admin/tickets/update_status/<int:ticket_id>', methods=['POST'])
 @login_required
@@ -510,15 +689,7 @@ def admin_update_ticket_status(ticket_id):
     new_status = request.form.get('status')
     
     if new_status in ['Open', 'In Progress', 'Closed']:
-        ticket.status = new_status
-        
-        # Notify student of status change
-        notification = Notification(
-            user_id=ticket.user_id,
-            message=f'Your ticket {ticket.ticket_id} status has been updated to {new_status}.'
-        )
-        db.session.add(notification)
-        db.session.commit()
+        update_ticket_status(ticket, new_status)
         
         return jsonify({'success': True})
     
@@ -542,6 +713,94 @@ def admin_settings():
     
     return render_template('admin/settings.html', settings=settings)
 
+@app.route('/admin/reconciliation')
+@login_required
+@reads_report_snapshot
+def admin_reconciliation():
+    if not current_user.is_admin():
+        return redirect(url_for('student_dashboard'))
+    
+    try:
+        start, end = parse_report_range(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        flash('Invalid date range', 'danger')
+        start, end = parse_report_range(None, None)
+    
+    report = reconciliation_report(start, end)
+    return render_template('admin/reconciliation.html', report=report)
+
+@app.route('/admin/api/reconciliation')
+@login_required
+@reads_report_snapshot
+def admin_reconciliation_api():
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    try:
+        start, end = parse_report_range(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+    
+    return jsonify({'success': True, 'report': reconciliation_report(start, end)})
+
+def _funnel_report_from_args():
+    start, end = parse_report_range(request.args.get('start'), request.args.get('end'))
+    return funnel_report(
+        start, end,
+        program_id=request.args.get('program_id', type=int),
+        level=request.args.get('level') or None,
+        nationality=request.args.get('nationality') or None,
+        program_names={program.id: program.name for program in all_programs()}
+    )
+
+@app.route('/admin/reports/admissions')
+@login_required
+@reads_report_snapshot
+def admin_admissions_report():
+    if not current_user.is_admin():
+        return redirect(url_for('student_dashboard'))
+    
+    try:
+        report = _funnel_report_from_args()
+    except ValueError:
+        flash('Invalid date range', 'danger')
+        start, end = parse_report_range(None, None)
+        report = funnel_report(start, end)
+    
+    return render_template('admin/admissions_report.html', report=report, programs=all_programs(),
+                          dimensions=funnel_dimensions(), filters=request.args)
+
+@app.route('/admin/api/reports/admissions')
+@login_required
+@reads_report_snapshot
+def admin_admissions_report_api():
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    try:
+        report = _funnel_report_from_args()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+    
+    return jsonify({'success': True, 'report': report})
+
+@app.route('/admin/metrics')
+@login_required
+def admin_metrics():
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    return jsonify({
+        'success': True,
+        'admission': admission_metrics(),
+        'commits': commit_metrics(),
+        'writes': write_metrics(),
+        'previews': preview_metrics(),
+        'cache': cache_metrics(),
+        'report_snapshot': report_snapshot_metrics(),
+        'compression': compression_metrics()
+    })
+
 # Student Routes
 @app.route('/student/dashboard')
 @login_required
@@ -592,35 +851,9 @@ def student_new_application():
         program_id = request.form.get('program')
         level = request.form.get('level')
 
-        # Generate a unique application ID
-        app_count = Application.query.count() + 1
-        app_id = f"APP-{app_count:03d}"
-
-        # Create new application
-        new_application = Application(
-            app_id=app_id,
-            user_id=current_user.id,
-            program_id=program_id,
-            level=level,
-            status='Pending Review',
-            payment_status='Pending',
-            date_submitted=datetime.utcnow()
-        )
-
         try:
-            db.session.add(new_application)
-            db.session.commit()
-
-            # Create notification for admin users
-            admins = User.query.filter_by(role='admin').all()
-            for admin in admins:
-                notification = Notification(
-                    user_id=admin.id,
-                    message=f'New application received from {current_user.full_name}',
-                    read=False
-                )
-                db.session.add(notification)
-            db.session.commit()
+            # The application and the admin notifications commit together
+            new_application = submit_application(current_user, program_id, level)
 
             flash('Application submitted successfully!', 'success')
             return redirect(url_for('student_documents', app_id=new_application.id))
@@ -631,7 +864,7 @@ def student_new_application():
             return redirect(url_for('student_new_application'))
 
     # GET request - show application form
-    programs = Program.query.all()
+    programs = all_programs()
     return render_template('student/new_application.html', programs=programs)
 
 @app.route('/student/documents')
@@ -669,19 +902,13 @@ def student_upload_document():
             # Create a unique filename with timestamp
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
             new_filename = f"{current_user.id}_{timestamp}_{filename}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], new_filename))
+            file_path = save_upload(file, 'documents', new_filename)
             
             # Create document record
-            new_document = Document(
-                user_id=current_user.id,
-                application_id=application_id if application_id else None,
-                name=document_type,
-                file_path=f"uploads/{new_filename}",
-                status='Uploaded'
-            )
-            
-            db.session.add(new_document)
-            db.session.commit()
+            add_document(current_user, application_id if application_id else None,
+                         document_type, file_path)
+            # Render the reviewers' preview in the background
+            schedule_preview(file_path)
             
             flash('Document uploaded successfully!', 'success')
             return redirect(url_for('student_documents'))
@@ -702,20 +929,15 @@ def student_delete_document(doc_id):
         flash('Access denied', 'danger')
         return redirect(url_for('student_documents'))
     
-    # Get the file path to remove it from storage
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], document.file_path.replace('uploads/', ''))
+    # Keep the stored path to remove the file from storage
+    file_path = document.file_path
     
     # Delete the document from the database
     db.session.delete(document)
     db.session.commit()
     
-    # Try to remove the file (if it exists)
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    except Exception as e:
-        # Log the error but continue (document is already deleted from database)
-        print(f"Error removing file: {e}")
+    # Remove the file (the document is already deleted from the database)
+    delete_upload(file_path)
     
     flash('Document deleted successfully', 'success')
     return redirect(url_for('student_documents'))
@@ -738,19 +960,13 @@ def student_request_certificate():
     
     if request.method == 'POST':
         # Create new certificate request
-        certificate = Certificate(
-            user_id=current_user.id,
-            type=request.form.get('certificate_type'),
-            purpose=request.form.get('purpose'),
-            copies=int(request.form.get('copies', 1)),
-            status='Pending Payment',
-            cert_id=f"CERT-{datetime.now().strftime('%Y%m%d%H%M%S')}",
-            request_date=datetime.now()
+        request_certificate(
+            current_user,
+            request.form.get('certificate_type'),
+            request.form.get('purpose'),
+            int(request.form.get('copies', 1))
         )
         
-        db.session.add(certificate)
-        db.session.commit()
-        
         flash('Certificate request submitted successfully!', 'success')
         return redirect(url_for('student_certificates'))
     
@@ -779,30 +995,8 @@ def student_new_ticket():
             flash('Please fill out all fields', 'danger')
             return redirect(request.url)
         
-        # Generate a unique ticket ID
-        ticket_count = Ticket.query.count() + 1
-        ticket_id = f"TKT-{ticket_count:03d}"
-        
-        # Create new ticket
-        new_ticket = Ticket(
-            ticket_id=ticket_id,
-            user_id=current_user.id,
-            subject=subject,
-            status='Open'
-        )
-        
-        db.session.add(new_ticket)
-        db.session.commit()
-        
-        # Add the first message
-        first_message = TicketMessage(
-            ticket_id=new_ticket.id,
-            sender='Student',
-            message=message
-        )
-        
-        db.session.add(first_message)
-        db.session.commit()
+        # The ticket and its first message are written in one commit
+        open_ticket(current_user, subject, message)
         
         flash('Support ticket submitted successfully!', 'success')
         return redirect(url_for('student_support'))
@@ -822,7 +1016,35 @@ def student_ticket_detail(ticket_id):
         flash('Access denied', 'danger')
         return redirect(url_for('student_support'))
     
-    return render_template('student/ticket_detail.html', ticket=ticket)
+    messages, has_older = latest_messages(ticket.id)
+    return render_template('student/ticket_detail.html', ticket=ticket, messages=messages, has_older=has_older)
+
+@app.route('/tickets/<int:ticket_id>/messages')
+@login_required
+def ticket_messages(ticket_id):
+    ticket = Ticket.query.get_or_404(ticket_id)
+    
+    # Admins see every ticket, students only their own
+    if not current_user.is_admin() and ticket.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    limit = page_size(request.args.get('limit'))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    
+    if after is not None:
+        # Polling: only replies newer than what the page already shows
+        messages = messages_since(ticket.id, after)
+        has_older = None
+    else:
+        messages, has_older = latest_messages(ticket.id, limit, before_id=before)
+    
+    return jsonify({
+        'success': True,
+        'status': ticket.status,
+        'messages': [serialize_message(message) for message in messages],
+        'has_older': has_older
+    })
     
 @app.route('/student/support/reply/<int:ticket_id>', methods=['POST'])
 @login_required
@@ -841,17 +1063,9 @@ def student_ticket_reply(ticket_id):
     if not message_text:
         return jsonify({'success': False, 'message': 'Message cannot be empty'})
 
-    # Create a new message
-    new_message = TicketMessage(
-        ticket_id=ticket.id,
-        sender='Student',
-        message=message_text
-    )
-    
-    db.session.add(new_message)
-    db.session.commit()
+    message_id = reply_to_ticket(ticket, 'Student', message_text)
     
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'message_id': message_id})
     
 @app.route('/student/payments/<int:app_id>', methods=['GET', 'POST'])
 @login_required
@@ -867,40 +1081,14 @@ def student_payment(app_id):
         return redirect(url_for('student_applications'))
     
     if request.method == 'POST':
-        payment_method = request.form.get('payment_method')
-        
-        # Calculate fee based on nationality
-        fee = 1500 if current_user.nationality == 'International' else 600
-        
-        # Create payment record
-        new_payment = Payment(
-            user_id=current_user.id,
-            application_id=application.id,
-            amount=fee,
-            payment_method=payment_method,
-            transaction_id=f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        )
-        
-        # Update application payment status
-        application.payment_status = 'Paid'
-        
-        # Create notification without type
-        notification = Notification(
-            user_id=current_user.id,
-            message='🎉 تم تأكيد الدفع بنجاح! سيتم مراجعة طلبك قريباً.',
-            read=False,
-            created_at=datetime.utcnow()
-        )
-        
-        db.session.add(new_payment)
-        db.session.add(notification)
-        db.session.commit()
+        # Payment, application status and receipt notification in one commit
+        pay_application(current_user, application, request.form.get('payment_method'))
         
         flash('Payment processed successfully!', 'success')
         return redirect(url_for('student_applications'))
     
     # Calculate fee based on nationality
-    fee = 1500 if current_user.nationality == 'International' else 600
+    fee = application_fee(current_user)
     
     return render_template('student/payment.html', application=application, fee=fee)
     
@@ -918,44 +1106,11 @@ def student_certificate_payment(cert_id):
         return redirect(url_for('student_certificates'))
     
     # Calculate fee based on number of copies
-    fee = 200 * certificate.copies  # 200 EGP per copy
+    fee = CERTIFICATE_FEE_PER_COPY * certificate.copies
     
     if request.method == 'POST':
-        # Create payment record
-        payment = Payment(
-            user_id=current_user.id,
-            certificate_id=certificate.id,
-            amount=fee,
-            payment_method='Online',
-            status='Completed',
-            transaction_id=f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}",
-            payment_date=datetime.utcnow()
-        )
-        
-        # Update certificate status
-        certificate.status = 'Processing'
-        certificate.payment_status = 'Paid'
-        
-        # Create notification
-        notification = Notification(
-            user_id=current_user.id,
-            message=f'تم تأكيد دفع طلب الشهادة {certificate.type}. سيتم معالجة طلبك قريباً.',
-            read=False
-        )
-        
-        # Notify admins
-        admins = User.query.filter_by(role='admin').all()
-        for admin in admins:
-            admin_notification = Notification(
-                user_id=admin.id,
-                message=f'New certificate payment received: {certificate.type} by {current_user.full_name}',
-                read=False
-            )
-            db.session.add(admin_notification)
-        
-        db.session.add(payment)
-        db.session.add(notification)
-        db.session.commit()
+        # Payment, certificate status and student/admin notifications in one commit
+        pay_certificate(current_user, certificate)
         
         flash('Payment confirmed successfully!', 'success')
         return redirect(url_for('student_certificates'))
@@ -996,15 +1151,20 @@ def student_change_password():
     new_password = request.form.get('new_password')
     confirm_password = request.form.get('confirm_password')
     
-    if not current_user.check_password(current_password):
-        flash('Current password is incorrect', 'danger')
-        return redirect(url_for('student_settings'))
-    
     if new_password != confirm_password:
         flash('New passwords do not match', 'danger')
         return redirect(url_for('student_settings'))
     
-    current_user.set_password(new_password)
+    try:
+        if not current_user.check_password(current_password):
+            flash('Current password is incorrect', 'danger')
+            return redirect(url_for('student_settings'))
+        
+        current_user.set_password(new_password)
+    except HashingBusy:
+        flash('The server is busy, please try again in a moment.', 'danger')
+        return redirect(url_for('student_settings'))
+    
     db.session.commit()
     
     flash('Password changed successfully!', 'success')
@@ -1013,10 +1173,7 @@ def student_change_password():
 @app.route('/mark_notifications_read', methods=['POST'])
 @login_required
 def mark_notifications_read():
-    notifications = Notification.query.filter_by(user_id=current_user.id, read=False).all()
-    for notification in notifications:
-        notification.read = True
-    db.session.commit()
+    read_all_notifications(current_user)
     return jsonify({'success': True})
 
 @app.route('/student/close_ticket/<int:ticket_id>', methods=['POST'])
@@ -1108,12 +1265,8 @@ def admin_new_project():
                         original_filename = secure_filename(file.filename)
                         new_filename = f"project_{timestamp}_{original_filename}"
                         
-                        # Save file with correct path
-                        file_path = os.path.join(PROJECTS_UPLOAD_FOLDER, new_filename)
-                        file.save(file_path)
-                        
-                        # Store relative path in database
-                        image_path = f'uploads/projects/{new_filename}'
+                        # Save file and store its static-relative path in database
+                        image_path = save_upload(file, 'projects', new_filename)
             
             new_project = Project(
                 title=title,
@@ -1154,6 +1307,7 @@ def admin_edit_project(project_id):
             project.url = request.form.get('url')
             project.is_popular = 'is_popular' in request.form
             project.is_active = 'is_active' in request.form
+            old_image_path = None
             
             # Handle file upload if there's a new image
             if 'image' in request.files:
@@ -1164,20 +1318,14 @@ def admin_edit_project(project_id):
                     filename = secure_filename(file.filename)
                     new_filename = f"project_{timestamp}_{filename}"
                     
-                    # Delete old image if exists
-                    if project.image_path:
-                        old_file_path = os.path.join('static', project.image_path)
-                        if os.path.exists(old_file_path):
-                            os.remove(old_file_path)
-                    
-                    # Save new image
-                    file_path = os.path.join(PROJECTS_UPLOAD_FOLDER, new_filename)
-                    file.save(file_path)
-                    
-                    # Update database path
-                    project.image_path = f'uploads/projects/{new_filename}'
+                    # Save new image and update database path
+                    old_image_path = project.image_path
+                    project.image_path = save_upload(file, 'projects', new_filename)
             
             db.session.commit()
+            
+            # Delete the replaced image only once nothing points at it
+            delete_upload(old_image_path)
             flash('Project updated successfully!', 'success')
             return redirect(url_for('admin_projects'))
         except Exception as e:
@@ -1196,22 +1344,12 @@ def admin_delete_project(project_id):
     project = Project.query.get_or_404(project_id)
     
     # Delete image file if it exists
-    if project.image_path:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                               project.image_path.replace('uploads/', ''))
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Error removing file: {e}")
+    delete_upload(project.image_path)
     
     db.session.delete(project)
     db.session.commit()
     return jsonify({'success': True})
     
-@app.route('/admin/projects/toggle-status/<int:project_id>', methods=['POST'])
-@login_required
-    
 @app.route('/admin/projects/toggle-status/<int:project_id>', methods=['POST'])
 @login_required
 def admin_toggle_project_status(project_id):
@@ -1253,18 +1391,7 @@ def mark_certificate_ready(cert_id):
     certificate = Certificate.query.get_or_404(cert_id)
     
     try:
-        # Update certificate status
-        certificate.status = 'Ready for Pickup'
-        
-        # Create notification for student
-        notification = Notification(
-            user_id=certificate.user_id,
-            message=f'🎉 شهادتك "{certificate.type}" جاهزة للاستلام!',
-            read=False
-        )
-        
-        db.session.add(notification)
-        db.session.commit()
+        certificate_ready_for_pickup(certificate)
         
         return jsonify({
             'success': True,
@@ -1314,12 +1441,8 @@ def admin_news_add():
                 timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
                 new_filename = f"news_{timestamp}_{filename}"
                 
-                # Save file with full path
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                image.save(file_path)
-                
-                # Store relative path in database
-                image_path = f'uploads/news/{new_filename}'
+                # Save file and store its static-relative path in database
+                image_path = save_upload(image, 'news', new_filename)
             
             news_item = NewsAnnouncement(
                 title=title,
@@ -1355,27 +1478,22 @@ def admin_news_edit(id):
             news_item.description = request.form.get('description')
             news_item.type = request.form.get('type')
             news_item.date = datetime.strptime(request.form.get('date'), '%Y-%m-%d')
+            old_image_path = None
             
             # Handle image upload
             image = request.files.get('image')
             if image and image.filename and allowed_file(image.filename):
-                # Delete old image if exists
-                if news_item.image_path:
-                    old_image_path = os.path.join(BASE_DIR, 'static', news_item.image_path)
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
-                
-                # Save new image
+                # Save new image and update database path
                 filename = secure_filename(image.filename)
                 timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
                 new_filename = f"news_{timestamp}_{filename}"
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                image.save(file_path)
-                
-                # Update database path
-                news_item.image_path = f'uploads/news/{new_filename}'
+                old_image_path = news_item.image_path
+                news_item.image_path = save_upload(image, 'news', new_filename)
             
             db.session.commit()
+            
+            # Delete the replaced image only once nothing points at it
+            delete_upload(old_image_path)
             flash('News/Announcement updated successfully!', 'success')
             return redirect(url_for('admin_news'))
         except Exception as e:
@@ -1396,14 +1514,13 @@ def admin_news_delete(id):
     try:
         news_item = NewsAnnouncement.query.get_or_404(id)
         
-        # Delete associated image if exists
-        if news_item.image_path:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(news_item.image_path))
-            if os.path.exists(image_path):
-                os.remove(image_path)
+        image_path = news_item.image_path
         
         db.session.delete(news_item)
         db.session.commit()
+        
+        # Delete associated image once the row is gone
+        delete_upload(image_path)
         return jsonify({'success': True, 'message': 'Item deleted successfully'})
     except Exception as e:
         db.session.rollback()
@@ -1424,10 +1541,31 @@ def news():
 
 # Register the command with Flask CLI
 app.cli.add_command(init_db_command)
-
-@app.context_processor
-def inject_now():
-    return {'now': datetime.utcnow()}
+app.cli.add_command(backfill_payment_rollups_command)
+app.cli.add_command(backfill_ticket_inbox_command)
+app.cli.add_command(migrate_uploads_command)
+app.cli.add_command(gc_uploads_command)
+app.cli.add_command(move_activity_tables_command)
+app.cli.add_command(backfill_admissions_funnel_command)
+app.cli.add_command(render_document_previews_command)
+app.cli.add_command(import_catalog_command)
+app.cli.add_command(rebuild_student_search_command)
+app.cli.add_command(backup_db_command)
+app.cli.add_command(vacuum_db_command)
+app.cli.add_command(optimize_db_command)
+app.cli.add_command(check_db_command)
+app.cli.add_command(db_sizes_command)
+app.cli.add_command(maintain_db_command)
+app.cli.add_command(refresh_report_snapshot_command)
+
+@app.after_request
+def conditional_html(response):
+    """Answer repeat GETs of an unchanged page with 304 Not Modified"""
+    if (request.method == 'GET' and response.status_code == 200
+            and response.mimetype == 'text/html' and not response.is_streamed):
+        response.add_etag()
+        response.make_conditional(request)
+    return response
 
 @app.context_processor
 def inject_notifications():
@@ -1461,13 +1599,23 @@ def format_date_arabic(date):
     day = date.day
     month = arabic_months[date.month]
     year = date.year
-    return f"{day} {month} {year}"
+    return timestamp_html(date, 'arabic-date', f"{day} {month} {year}")
     
 # Add this context processor to make the function available in templates
 @app.context_processor
 def utility_processor():
     return dict(format_date_arabic=format_date_arabic)
 
+@app.context_processor
+def report_snapshot_processor():
+    # Set by reads_report_snapshot when the page was read from the snapshot
+    return dict(report_as_of=g.get('report_as_of'))
+
+@app.context_processor
+def storage_processor():
+    # Uploads may live on another host, so templates never build static URLs for them
+    return dict(upload_url=upload_url)
+
 @app.route('/test-image/<path:filename>')
 def test_image(filename):
     try:
@@ -1485,20 +1633,18 @@ def project_details(project_id):
 @login_required
 def student_courses():
     # Get student's active applications
-    active_applications = Application.query.filter_by(
-        user_id=current_user.id,
-        status='approved',
-        payment_status='paid'
+    active_applications = Application.query.options(
+        db.joinedload(Application.program)
+    ).filter(
+        Application.user_id == current_user.id,
+        Application.status.in_(('Documents Approved', 'Enrolled')),
+        Application.payment_status == 'Paid'
     ).all()
     
-    # Get courses based on program and level
-    courses = []
-    for application in active_applications:
-        program_courses = Course.query.filter_by(
-            program_id=application.program_id,
-            level=application.level  # diploma, masters, doctorate
-        ).order_by(Course.semester).all()
-        courses.extend(program_courses)
+    # Get courses based on program and level (diploma, masters, doctorate)
+    # for all applications at once, served from the catalog cache when possible
+    catalog = courses_for((application.program_id, application.level) for application in active_applications)
+    courses = [course for program_courses in catalog.values() for course in program_courses]
         
     return render_template('student/courses.html', 
                          courses=courses,
@@ -0,0 +1,48 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from databases import engine_for
+
+
+def add_missing_columns(model):
+    """Add columns declared on `model` that an older database lacks
+
+    The portal creates its tables with db.create_all(), which never alters
+    an existing table, so new nullable or defaulted columns are added here
+    with ALTER TABLE. Returns the names of the columns that were added.
+    """
+    table = model.__table__
+    engine = engine_for(table)
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    added = []
+
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=engine.dialect)
+        ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+        if column.server_default is not None:
+            ddl += f" DEFAULT {column.server_default.arg}"
+        if not column.nullable and column.server_default is not None:
+            ddl += ' NOT NULL'
+        with engine.begin() as connection:
+            connection.execute(text(ddl))
+        added.append(column.name)
+
+    return added
+
+
+def create_missing_indexes(model):
+    """Create indexes declared on `model` that do not exist yet"""
+    table = model.__table__
+    engine = engine_for(table)
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+    created = []
+
+    for index in table.indexes:
+        if index.name not in existing:
+            with engine.begin() as connection:
+                connection.execute(CreateIndex(index))
+            created.append(index.name)
+
+    return created
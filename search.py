@@ -0,0 +1,312 @@
+"""Search-as-you-type lookup of students for admins.
+
+Every student has a few normalized search keys in student_search_key: their
+email, phone digits, application and student IDs, and each word-suffix of
+their name (so "ali" finds "Mohamed Ali Hassan"). A lookup is an index range
+scan for keys starting with what was typed, so it stays fast however many
+students there are.
+
+Names are also kept in an SQLite FTS5 table with the trigram tokenizer,
+which finds text in the middle of a name and near misses ("mohamad" for
+"mohamed"). Arabic names are normalized first (diacritics and tatweel
+removed, alef/yeh/kaf/teh marbuta forms unified) so spelling variants
+match.
+
+Both are kept up to date by a flush listener; rebuild-student-search fills
+them for existing databases and creates the trigram table.
+"""
+import re
+import unicodedata
+
+import click
+from flask import url_for
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, event, select, text
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import get_history
+
+from models import db, User, Application, StudentID, StudentSearchKey
+
+key_table = StudentSearchKey.__table__
+
+TRIGRAM_TABLE = 'student_name_trigram'
+
+# Better kinds of match sort first when several students match
+KIND_ORDER = {'student_id': 0, 'application': 1, 'email': 2, 'phone': 3, 'name': 4, 'similar_name': 5}
+
+ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+# Persian yeh and keheh are folded too: names typed on a Persian keyboard use them
+ARABIC_LETTERS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ئ': 'ي', 'ی': 'ي', 'ؤ': 'و',
+                                'ة': 'ه', 'ک': 'ك'})
+
+# Fuzzy name matches must share at least this share of their trigrams
+MIN_SIMILARITY = 0.3
+
+# Phone numbers with this country code are keyed in their local 0-prefixed
+# form, so "+20 10 1234 5678", "00201012345678" and "01012345678" all match
+LOCAL_COUNTRY_CODE = '20'
+
+
+def normalize(value):
+    """Lowercase, accent- and Arabic-variant-insensitive form of value"""
+    value = unicodedata.normalize('NFKC', value or '').casefold()
+    value = ARABIC_MARKS.sub('', value).translate(ARABIC_LETTERS)
+    return ' '.join(value.split())
+
+
+def phone_digits(value):
+    """Digits of a phone number (Arabic-Indic digits converted), local numbers in 0-prefixed form"""
+    digits = ''.join(str(unicodedata.digit(char)) for char in value or '' if char.isdigit())
+    # After + or 00 the country code is certain, even in a number still being typed
+    international = (value or '').lstrip().startswith('+') or digits.startswith('00')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    if digits.startswith(LOCAL_COUNTRY_CODE) and (international or len(digits) > len(LOCAL_COUNTRY_CODE) + 6):
+        digits = '0' + digits[len(LOCAL_COUNTRY_CODE):]
+    return digits
+
+
+def _trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _similarity(a, b):
+    a, b = _trigrams(a), _trigrams(b)
+    return len(a & b) / len(a | b) if a and b else 0
+
+
+def _name_similarity(value, name):
+    """Best similarity of value to a run of as many words of name"""
+    size = len(value.split())
+    words = name.split()
+    return max((_similarity(value, ' '.join(words[i:i + size]))
+                for i in range(max(len(words) - size + 1, 1))), default=0)
+
+
+_trigram_ready_for = set()
+
+
+def trigram_ready(connection):
+    """True once the trigram table exists in this database"""
+    if connection.dialect.name != 'sqlite':
+        return False
+    key = str(connection.engine.url)
+    if key in _trigram_ready_for:
+        return True
+    found = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': TRIGRAM_TABLE}
+    ).first()
+    if found:
+        _trigram_ready_for.add(key)
+    return found is not None
+
+
+def create_trigram_table(connection):
+    """Needs SQLite 3.34+ for the trigram tokenizer"""
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_TABLE} USING fts5(name, tokenize='trigram')"
+    ))
+
+
+def reindex_students(connection, user_ids):
+    """Replace the search keys of these users; non-students end up with none"""
+    user_ids = list(user_ids)
+    users = connection.execute(
+        select(User.id, User.email, User.full_name, User.phone)
+        .where(User.id.in_(user_ids), User.role == 'student')
+    ).all()
+    identifiers = connection.execute(
+        select(Application.user_id, Application.app_id, StudentID.student_id)
+        .outerjoin(StudentID, StudentID.application_id == Application.id)
+        .where(Application.user_id.in_(user_ids))
+    ).all()
+
+    keys = []
+    names = []
+    for user_id, email, full_name, phone in users:
+        values = {('email', normalize(email))}
+        if phone_digits(phone):
+            values.add(('phone', phone_digits(phone)))
+        words = normalize(full_name).split()
+        values.update(('name', ' '.join(words[i:])) for i in range(len(words)))
+        keys.extend({'user_id': user_id, 'kind': kind, 'value': value} for kind, value in values if value)
+        names.append({'rowid': user_id, 'name': normalize(full_name)})
+
+    student_ids = {user_id for user_id, *_ in users}
+    for user_id, app_id, student_id in identifiers:
+        if user_id not in student_ids:
+            continue
+        if app_id:
+            keys.append({'user_id': user_id, 'kind': 'application', 'value': normalize(app_id)})
+        if student_id:
+            keys.append({'user_id': user_id, 'kind': 'student_id', 'value': normalize(student_id)})
+
+    connection.execute(key_table.delete().where(key_table.c.user_id.in_(user_ids)))
+    if keys:
+        connection.execute(key_table.insert(), keys)
+
+    if trigram_ready(connection):
+        connection.execute(
+            text(f'DELETE FROM {TRIGRAM_TABLE} WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)),
+            {'ids': user_ids}
+        )
+        if names:
+            connection.execute(text(f'INSERT INTO {TRIGRAM_TABLE} (rowid, name) VALUES (:rowid, :name)'), names)
+
+
+@event.listens_for(Session, 'after_flush')
+def update_search_keys(session, flush_context):
+    """Reindex students whose searchable fields changed in this flush"""
+    user_ids = set()
+    application_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed = obj in session.new or obj in session.deleted
+        if isinstance(obj, User):
+            if changed or any(get_history(obj, field).has_changes()
+                              for field in ('email', 'full_name', 'phone', 'role')):
+                user_ids.add(obj.id)
+        elif isinstance(obj, Application):
+            if changed or get_history(obj, 'app_id').has_changes():
+                user_ids.add(obj.user_id)
+        elif isinstance(obj, StudentID):
+            if changed or get_history(obj, 'student_id').has_changes():
+                application_ids.add(obj.application_id)
+    if not user_ids and not application_ids:
+        return
+
+    connection = session.connection()
+    if application_ids:
+        user_ids.update(connection.execute(
+            select(Application.user_id).where(Application.id.in_(application_ids))
+        ).scalars())
+    user_ids.discard(None)
+    if user_ids:
+        reindex_students(connection, user_ids)
+
+
+def _prefix_matches(value, limit, kind=None):
+    stmt = (
+        select(key_table.c.user_id, key_table.c.kind, key_table.c.value)
+        .where(key_table.c.value >= value, key_table.c.value < value + '\U0010ffff')
+        .order_by(key_table.c.value)
+        .limit(limit)
+    )
+    if kind:
+        stmt = stmt.where(key_table.c.kind == kind)
+    return db.session.execute(stmt).all()
+
+
+def _similar_names(value, limit):
+    """(user_id, similarity) for names containing or resembling value"""
+    connection = db.session.connection()
+    if len(value) < 3 or not trigram_ready(connection):
+        return []
+    match = text(f'SELECT rowid, name FROM {TRIGRAM_TABLE} WHERE {TRIGRAM_TABLE} MATCH :query '
+                 f'ORDER BY rank LIMIT :limit')
+    quoted = '"' + value.replace('"', '""') + '"'
+    # The whole string first (a substring match), then any of its trigrams for near misses
+    rows = connection.execute(match, {'query': quoted, 'limit': limit}).all()
+    if len(rows) < limit and len(value) > 3:
+        any_trigram = ' OR '.join('"' + gram.replace('"', '""') + '"' for gram in sorted(_trigrams(value)))
+        rows += connection.execute(match, {'query': any_trigram, 'limit': limit * 5}).all()
+
+    scores = {}
+    for user_id, name in rows:
+        score = 1.0 if value in name else _name_similarity(value, name)
+        if score >= MIN_SIMILARITY:
+            scores[user_id] = max(score, scores.get(user_id, 0))
+    return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+
+def search_students(query, limit=10):
+    """Best matching students for what an admin typed, as [(User, matched kind)]"""
+    value = normalize(query)
+    if not value:
+        return []
+
+    best = {}  # user_id -> (sort key, kind)
+
+    def consider(user_id, kind, sort_key):
+        if user_id not in best or sort_key < best[user_id][0]:
+            best[user_id] = (sort_key, kind)
+
+    searches = [(value, None)]
+    digits = phone_digits(query)
+    if len(digits) >= 3 and digits != value:
+        # Typed with spaces, dashes or a country code: look for it as a phone number only
+        searches.append((digits, 'phone'))
+    for prefix, only_kind in searches:
+        for user_id, kind, matched in _prefix_matches(prefix, limit * 5, only_kind):
+            consider(user_id, kind, (0, matched != prefix, KIND_ORDER[kind], len(matched)))
+
+    if len(best) < limit:
+        for user_id, similarity in _similar_names(value, limit):
+            consider(user_id, 'similar_name', (1, -similarity))
+
+    ranked = sorted(best, key=lambda user_id: best[user_id][0])[:limit]
+    users = {user.id: user for user in User.query.options(
+        selectinload(User.applications).selectinload(Application.student_id)
+    ).filter(User.id.in_(ranked))}
+    return [(users[user_id], best[user_id][1]) for user_id in ranked if user_id in users]
+
+
+def serialize_match(user, kind):
+    detail = url_for('admin_student_detail', user_id=user.id)
+    return {
+        'id': user.id,
+        'full_name': user.full_name,
+        'email': user.email,
+        'phone': user.phone,
+        'nationality': user.nationality,
+        'matched': kind,
+        'applications': [{
+            'app_id': application.app_id,
+            'status': application.status,
+            'student_id': application.student_id.student_id if application.student_id else None,
+        } for application in user.applications],
+        'links': {
+            'student': detail,
+            'applications': detail + '#applications',
+            'tickets': detail + '#tickets',
+            'payments': detail + '#payments',
+        },
+    }
+
+
+@click.command('rebuild-student-search')
+@click.option('--batch-size', default=1000, show_default=True, help='Students reindexed per commit.')
+@with_appcontext
+def rebuild_student_search_command(batch_size):
+    """Create the student search tables and index every student."""
+    db.create_all()
+    connection = db.session.connection()
+    try:
+        create_trigram_table(connection)
+    except Exception as e:
+        db.session.rollback()
+        click.echo(f'Trigram name matching unavailable ({e}); prefix search only.')
+    db.session.commit()
+
+    last_id = 0
+    indexed = 0
+    while True:
+        ids = db.session.execute(
+            select(User.id).where(User.id > last_id, User.role == 'student').order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        reindex_students(db.session.connection(), ids)
+        db.session.commit()
+        indexed += len(ids)
+        last_id = ids[-1]
+
+    # Keys left behind by deleted users or users who are no longer students
+    students = select(User.id).where(User.role == 'student')
+    db.session.execute(key_table.delete().where(key_table.c.user_id.not_in(students)))
+    connection = db.session.connection()
+    if trigram_ready(connection):
+        connection.execute(text(
+            f"DELETE FROM {TRIGRAM_TABLE} WHERE rowid NOT IN (SELECT id FROM user WHERE role = 'student')"
+        ))
+    db.session.commit()
+    click.echo(f'Indexed {indexed} students for search.')
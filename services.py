@@ -0,0 +1,312 @@
+"""Use cases that change several rows, each committed as one unit of work.
+
+Routes call these instead of adding and committing rows themselves. Every
+function stages all of its writes in the session and commits exactly once,
+so its writes to the main database either all happen or none do.
+
+Notifications live on the 'activity' bind. While ACTIVITY_DATABASE_URI
+points at the main database they share that single transaction. Once it
+is a separate file, a use case that also notifies commits to each file in
+turn, so a crash in between can keep one file's writes without the other's
+(see databases.py).
+
+Small single-purpose writes (replies, read marks, document records) go
+through writes.perform_write instead, so they can share a group commit when
+the write coordinator is enabled.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import (db, User, Application, Certificate, Ticket, TicketMessage,
+                    Notification, StudentID, Payment, Document)
+from tickets import record_message
+from writes import perform_write
+
+
+@contextmanager
+def unit_of_work():
+    """Commit everything staged inside the block once, or roll it all back"""
+    try:
+        yield db.session
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _notify_admins(message):
+    admin_ids = [admin_id for (admin_id,) in db.session.query(User.id).filter_by(role='admin')]
+    for admin_id in admin_ids:
+        db.session.add(Notification(user_id=admin_id, message=message, read=False))
+
+
+# Applications
+
+def submit_application(user, program_id, level):
+    with unit_of_work():
+        # Generate a unique application ID
+        app_count = Application.query.count() + 1
+        application = Application(
+            app_id=f"APP-{app_count:03d}",
+            user_id=user.id,
+            program_id=program_id,
+            level=level,
+            status='Pending Review',
+            payment_status='Pending',
+            date_submitted=datetime.utcnow()
+        )
+        db.session.add(application)
+        _notify_admins(f'New application received from {user.full_name}')
+    return application
+
+
+def application_fee(user):
+    """Fee based on nationality"""
+    return 1500 if user.nationality == 'International' else 600
+
+
+def pay_application(user, application, payment_method):
+    with unit_of_work():
+        payment = Payment(
+            user_id=user.id,
+            application_id=application.id,
+            amount=application_fee(user),
+            payment_method=payment_method,
+            transaction_id=f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        )
+        application.payment_status = 'Paid'
+        db.session.add(payment)
+        db.session.add(Notification(
+            user_id=user.id,
+            message='🎉 تم تأكيد الدفع بنجاح! سيتم مراجعة طلبك قريباً.',
+            read=False,
+            created_at=datetime.utcnow()
+        ))
+    return payment
+
+
+# Certificates
+
+CERTIFICATE_FEE_PER_COPY = 200  # EGP
+
+
+def request_certificate(user, certificate_type, purpose, copies):
+    with unit_of_work():
+        certificate = Certificate(
+            user_id=user.id,
+            type=certificate_type,
+            purpose=purpose,
+            copies=copies,
+            status='Pending Payment',
+            cert_id=f"CERT-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            request_date=datetime.now()
+        )
+        db.session.add(certificate)
+    return certificate
+
+
+def pay_certificate(user, certificate):
+    with unit_of_work():
+        payment = Payment(
+            user_id=user.id,
+            certificate_id=certificate.id,
+            amount=CERTIFICATE_FEE_PER_COPY * certificate.copies,
+            payment_method='Online',
+            status='Completed',
+            transaction_id=f"TXN-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            payment_date=datetime.utcnow()
+        )
+        certificate.status = 'Processing'
+        certificate.payment_status = 'Paid'
+        db.session.add(payment)
+        db.session.add(Notification(
+            user_id=user.id,
+            message=f'تم تأكيد دفع طلب الشهادة {certificate.type}. سيتم معالجة طلبك قريباً.',
+            read=False
+        ))
+        _notify_admins(f'New certificate payment received: {certificate.type} by {user.full_name}')
+    return payment
+
+
+def certificate_ready_for_pickup(certificate, notes=''):
+    with unit_of_work():
+        certificate.status = 'Ready for Pickup'
+        if notes:
+            certificate.processing_notes = notes
+        db.session.add(Notification(
+            user_id=certificate.user_id,
+            message=f'🎉 شهادتك "{certificate.type}" جاهزة للاستلام!',
+            read=False
+        ))
+
+
+# Tickets
+
+def open_ticket(user, subject, message):
+    with unit_of_work():
+        # Generate a unique ticket ID
+        ticket_count = Ticket.query.count() + 1
+        ticket = Ticket(
+            ticket_id=f"TKT-{ticket_count:03d}",
+            user_id=user.id,
+            subject=subject,
+            status='Open'
+        )
+        # The first message rides along with the ticket in the same flush
+        first_message = TicketMessage(sender='Student', message=message)
+        record_message(ticket, first_message)
+        ticket.messages.append(first_message)
+        db.session.add(ticket)
+    return ticket
+
+
+def _add_reply(ticket_id, sender, message):
+    ticket = db.session.get(Ticket, ticket_id)
+    new_message = TicketMessage(ticket_id=ticket.id, sender=sender, message=message)
+    record_message(ticket, new_message)
+    db.session.add(new_message)
+
+    if sender == 'Admin':
+        # Update ticket status to In Progress if it's Open
+        if ticket.status == 'Open':
+            ticket.status = 'In Progress'
+        db.session.add(Notification(
+            user_id=ticket.user_id,
+            message=f'New reply to your ticket: {ticket.subject}'
+        ))
+    db.session.flush()
+    return new_message.id
+
+
+def reply_to_ticket(ticket, sender, message):
+    """Add a reply to the ticket and return the new message's id"""
+    return perform_write(_add_reply, ticket.id, sender, message)
+
+
+def update_ticket_status(ticket, status):
+    with unit_of_work():
+        ticket.status = status
+        db.session.add(Notification(
+            user_id=ticket.user_id,
+            message=f'Your ticket {ticket.ticket_id} status has been updated to {status}.'
+        ))
+
+
+# Documents and notifications
+
+def _add_document(user_id, application_id, name, file_path):
+    document = Document(
+        user_id=user_id,
+        application_id=application_id,
+        name=name,
+        file_path=file_path,
+        status='Uploaded'
+    )
+    db.session.add(document)
+    db.session.flush()
+    return document.id
+
+
+def add_document(user, application_id, name, file_path):
+    return perform_write(_add_document, user.id, application_id, name, file_path)
+
+
+def review_document(document, status):
+    with unit_of_work():
+        document.status = status
+        db.session.add(Notification(
+            user_id=document.user_id,
+            message=f'Your document "{document.name}" has been {status.lower()}.'
+        ))
+
+
+def _mark_notifications_read(user_id):
+    return Notification.query.filter_by(user_id=user_id, read=False).update(
+        {'read': True}, synchronize_session=False
+    )
+
+
+def read_all_notifications(user):
+    return perform_write(_mark_notifications_read, user.id)
+
+
+# Enrollments
+
+def issue_student_id(application):
+    """Create the StudentID for a paid application and mark it enrolled"""
+    with unit_of_work():
+        # Generate student ID based on nationality and program
+        year = datetime.utcnow().year
+        is_international = application.user.nationality != 'Egyptian'
+        prefix = 'INT-' if is_international else 'LOC-'
+
+        # Get program code from first letters of each word
+        program_name = application.program.name if application.program else ''
+        program_code = ''.join(word[0].upper() for word in program_name.split())
+
+        # Find latest ID for this year, type and program
+        latest_student = StudentID.query.filter(
+            StudentID.student_id.like(f'{year}-{prefix}{program_code}%')
+        ).order_by(StudentID.student_id.desc()).first()
+
+        if latest_student:
+            new_number = str(int(latest_student.student_id.split('-')[-1]) + 1).zfill(4)
+        else:
+            new_number = '0001'
+
+        # Format: YYYY-TYPE-PROG-XXXX (e.g., 2025-INT-MBA-0001)
+        student_id = StudentID(
+            student_id=f"{year}-{prefix}{program_code}-{new_number}",
+            application_id=application.id
+        )
+        application.status = 'Enrolled'
+        db.session.add(student_id)
+        db.session.add(Notification(
+            user_id=application.user_id,
+            message=f'🎓 تم إنشاء رقم الطالب الخاص بك: {student_id.student_id}',
+            read=False
+        ))
+    return student_id, is_international
+
+
+# Commits per request
+
+_commit_stats = {}  # endpoint -> [requests, commits]
+_commit_stats_lock = threading.Lock()
+
+
+@event.listens_for(Session, 'after_commit')
+def _count_commit(session):
+    if has_request_context():
+        g.commit_count = g.get('commit_count', 0) + 1
+
+
+def _record_commits(response):
+    if request.endpoint and request.endpoint != 'static':
+        with _commit_stats_lock:
+            stats = _commit_stats.setdefault(request.endpoint, [0, 0])
+            stats[0] += 1
+            stats[1] += g.get('commit_count', 0)
+    return response
+
+
+def init_commit_metrics(app):
+    """Track how many commits each endpoint issues per request"""
+    app.after_request(_record_commits)
+
+
+def commit_metrics():
+    with _commit_stats_lock:
+        return {
+            endpoint: {
+                'requests': requests,
+                'commits': commits,
+                'commits_per_request': round(commits / requests, 2) if requests else 0
+            }
+            for endpoint, (requests, commits) in sorted(_commit_stats.items())
+        }
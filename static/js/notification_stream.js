@@ -0,0 +1,58 @@
+// Live notifications over Server-Sent Events, only loaded when the app runs
+// under ASGI. New notifications are added to the top of the panel and the
+// unread badge is updated; EventSource reconnects on its own after errors.
+(function() {
+    const script = document.currentScript;
+    if (!window.EventSource || !script) {
+        return;
+    }
+
+    function updateBadge() {
+        const button = document.getElementById('notification-btn');
+        let badge = document.getElementById('notification-badge');
+        const unreadCount = document.querySelectorAll('.notification-item.unread').length;
+        if (!badge && button) {
+            badge = document.createElement('span');
+            badge.id = 'notification-badge';
+            badge.className = 'notification-badge';
+            button.appendChild(badge);
+        }
+        if (badge) {
+            badge.textContent = unreadCount;
+            badge.classList.toggle('hidden', unreadCount === 0);
+        }
+    }
+
+    function addNotification(notification) {
+        const list = document.querySelector('.notifications-list');
+        if (!list) {
+            return;
+        }
+        // Drop the "No notifications" placeholder
+        list.querySelectorAll('.notification-item:not([data-notification-id])').forEach(item => {
+            if (!item.classList.contains('unread') && item.textContent.trim() === 'No notifications') {
+                item.remove();
+            }
+        });
+
+        const item = document.createElement('div');
+        item.className = 'notification-item' + (notification.read ? '' : ' unread');
+        item.dataset.notificationId = notification.id;
+
+        const text = document.createElement('p');
+        text.textContent = notification.message;
+        const time = document.createElement('p');
+        time.className = 'notification-time';
+        time.textContent = notification.created_display;
+
+        item.appendChild(text);
+        item.appendChild(time);
+        list.insertBefore(item, list.firstChild);
+        updateBadge();
+    }
+
+    const source = new EventSource(script.dataset.streamUrl);
+    source.addEventListener('notification', function(event) {
+        addNotification(JSON.parse(event.data));
+    });
+})();
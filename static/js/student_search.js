@@ -0,0 +1,81 @@
+// Search-as-you-type student lookup in the admin header. Requests are
+// debounced and only the response to the latest keystroke is shown.
+(function() {
+    const container = document.getElementById('student-search');
+    if (!container) {
+        return;
+    }
+    const input = container.querySelector('input');
+    const results = container.querySelector('.student-search-results');
+    const searchUrl = container.dataset.searchUrl;
+    const matchLabels = {
+        student_id: 'Student ID',
+        application: 'Application',
+        email: 'Email',
+        phone: 'Phone',
+        name: 'Name',
+        similar_name: 'Similar name'
+    };
+    let timer = null;
+    let latest = 0;
+
+    function escapeHtml(value) {
+        const div = document.createElement('div');
+        div.textContent = value == null ? '' : value;
+        return div.innerHTML;
+    }
+
+    function render(students) {
+        if (!students.length) {
+            results.innerHTML = '<div class="student-search-empty">No students found</div>';
+        } else {
+            results.innerHTML = students.map(student => `
+                <div class="student-search-item">
+                    <a href="${student.links.student}" class="student-search-name">${escapeHtml(student.full_name)}</a>
+                    <span class="text-muted">${escapeHtml(student.email)}${student.phone ? ' · ' + escapeHtml(student.phone) : ''}</span>
+                    <span class="text-muted">
+                        ${student.applications.map(app => escapeHtml(app.student_id || app.app_id)).join(', ')}
+                        <span class="status-badge blue">${matchLabels[student.matched] || ''}</span>
+                    </span>
+                    <span class="student-search-links">
+                        <a href="${student.links.applications}">Applications</a>
+                        <a href="${student.links.tickets}">Tickets</a>
+                        <a href="${student.links.payments}">Payments</a>
+                    </span>
+                </div>`).join('');
+        }
+        results.classList.remove('hidden');
+    }
+
+    function search() {
+        const query = input.value.trim();
+        const request = ++latest;
+        if (!query) {
+            results.classList.add('hidden');
+            return;
+        }
+        fetch(`${searchUrl}?q=${encodeURIComponent(query)}`, { credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(data => {
+                if (request === latest && data.success) {
+                    render(data.results);
+                }
+            })
+            .catch(error => console.error('Student search failed:', error));
+    }
+
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(search, 150);
+    });
+    input.addEventListener('keydown', event => {
+        if (event.key === 'Escape') {
+            results.classList.add('hidden');
+        }
+    });
+    document.addEventListener('click', event => {
+        if (!container.contains(event.target)) {
+            results.classList.add('hidden');
+        }
+    });
+})();
@@ -0,0 +1,138 @@
+// Incremental loading of ticket conversations: older pages on demand and
+// polling for replies newer than the last message on the page. When the
+// app runs under ASGI the page gets a data-wait-url and long polls instead.
+function initTicketMessages(options) {
+    const container = document.querySelector('.chat-messages');
+    if (!container) {
+        return null;
+    }
+
+    const url = container.dataset.messagesUrl;
+    const waitUrl = container.dataset.waitUrl;
+    const ownSender = options.ownSender;
+    const pollInterval = options.pollInterval || 10000;
+    const loadOlderBtn = document.getElementById('load-older-messages');
+
+    function messageIds() {
+        return Array.from(container.querySelectorAll('[data-message-id]'))
+            .map(el => parseInt(el.dataset.messageId, 10));
+    }
+
+    function renderMessage(message) {
+        const wrapper = document.createElement('div');
+        wrapper.className = 'chat-message ' + (message.sender === ownSender ? 'outgoing' : 'incoming');
+        wrapper.dataset.messageId = message.id;
+
+        const content = document.createElement('div');
+        content.className = 'message-content';
+
+        const text = document.createElement('p');
+        text.textContent = message.message;
+
+        const time = document.createElement('p');
+        time.className = 'message-time';
+        time.textContent = `${message.created_display} - ${message.sender}`;
+
+        content.appendChild(text);
+        content.appendChild(time);
+        wrapper.appendChild(content);
+        return wrapper;
+    }
+
+    function lastMessageId() {
+        const ids = messageIds();
+        return ids.length ? Math.max(...ids) : 0;
+    }
+
+    function appendMessages(data) {
+        if (!data.success || !data.messages.length) {
+            return;
+        }
+        const atBottom = container.scrollHeight - container.scrollTop - container.clientHeight < 40;
+        const known = new Set(messageIds());
+        data.messages.forEach(message => {
+            if (!known.has(message.id)) {
+                container.appendChild(renderMessage(message));
+            }
+        });
+        if (atBottom) {
+            container.scrollTop = container.scrollHeight;
+        }
+    }
+
+    function appendNew() {
+        return fetch(`${url}?after=${lastMessageId()}`)
+            .then(response => response.json())
+            .then(appendMessages);
+    }
+
+    function loadOlder() {
+        const ids = messageIds();
+        if (!ids.length) {
+            return;
+        }
+
+        fetch(`${url}?before=${Math.min(...ids)}`)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    return;
+                }
+                const previousHeight = container.scrollHeight;
+                const anchor = loadOlderBtn ? loadOlderBtn.nextSibling : container.firstChild;
+                data.messages.forEach(message => {
+                    container.insertBefore(renderMessage(message), anchor);
+                });
+                // Keep the message the reader was looking at in place
+                container.scrollTop += container.scrollHeight - previousHeight;
+                if (!data.has_older && loadOlderBtn) {
+                    loadOlderBtn.remove();
+                }
+            });
+    }
+
+    if (loadOlderBtn) {
+        loadOlderBtn.addEventListener('click', loadOlder);
+    }
+
+    if (waitUrl) {
+        // Long poll: the server holds each request until a reply arrives
+        let waiting = false;
+        const waitForReplies = function() {
+            if (waiting || document.hidden) {
+                return;
+            }
+            waiting = true;
+            fetch(`${waitUrl}?after=${lastMessageId()}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(response.status);
+                    }
+                    return response.json();
+                })
+                .then(data => {
+                    appendMessages(data);
+                    return 0;
+                })
+                .catch(() => pollInterval)
+                .then(delay => {
+                    waiting = false;
+                    setTimeout(waitForReplies, delay);
+                });
+        };
+        waitForReplies();
+        document.addEventListener('visibilitychange', waitForReplies);
+    } else {
+        // Stop polling while the tab is hidden
+        let timer = setInterval(appendNew, pollInterval);
+        document.addEventListener('visibilitychange', function() {
+            clearInterval(timer);
+            if (!document.hidden) {
+                appendNew();
+                timer = setInterval(appendNew, pollInterval);
+            }
+        });
+    }
+
+    return { refresh: appendNew };
+}
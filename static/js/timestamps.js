@@ -0,0 +1,66 @@
+// Formats <time data-format="..."> elements in the browser so rendered pages
+// never depend on the current time and can be cached. The server only emits
+// the ISO value in the datetime attribute plus a fixed fallback text.
+//   relative     "3 hours ago", full date after a month (the old time_ago filter)
+//   arabic-date  "5 مارس 2025" (format_date_arabic)
+//   year         the current year, e.g. for copyright footers
+(function() {
+    const ARABIC_MONTHS = ['يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو',
+                           'يوليو', 'أغسطس', 'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر'];
+
+    function plural(count, unit) {
+        return `${count} ${unit}${count > 1 ? 's' : ''} ago`;
+    }
+
+    function timeAgo(date) {
+        const seconds = (Date.now() - date.getTime()) / 1000;
+        if (seconds < 60) {
+            return 'just now';
+        } else if (seconds < 3600) {
+            return plural(Math.floor(seconds / 60), 'minute');
+        } else if (seconds < 86400) {
+            return plural(Math.floor(seconds / 3600), 'hour');
+        } else if (seconds < 604800) {
+            return plural(Math.floor(seconds / 86400), 'day');
+        } else if (seconds < 2592000) {
+            return plural(Math.floor(seconds / 604800), 'week');
+        }
+        return date.toISOString().slice(0, 10);
+    }
+
+    function formatArabicDate(date) {
+        // Stored dates are UTC; use UTC parts so the day never shifts
+        return `${date.getUTCDate()} ${ARABIC_MONTHS[date.getUTCMonth()]} ${date.getUTCFullYear()}`;
+    }
+
+    const FORMATS = {
+        'relative': timeAgo,
+        'arabic-date': formatArabicDate,
+        'year': () => String(new Date().getFullYear()),
+    };
+
+    function formatTimestamps(root) {
+        (root || document).querySelectorAll('time[data-format]').forEach(el => {
+            const format = FORMATS[el.dataset.format];
+            const value = el.getAttribute('datetime');
+            const date = value ? new Date(value) : new Date();
+            if (format && !isNaN(date)) {
+                el.textContent = format(date);
+                if (value) {
+                    el.title = date.toLocaleString();
+                }
+            }
+        });
+    }
+
+    window.formatTimestamps = formatTimestamps;
+    window.formatArabicDate = formatArabicDate;
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', () => formatTimestamps());
+    } else {
+        formatTimestamps();
+    }
+    // Keep "5 minutes ago" current on pages left open
+    setInterval(() => formatTimestamps(), 60000);
+})();
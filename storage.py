@@ -0,0 +1,160 @@
+import os
+import shutil
+from collections import namedtuple
+
+from flask import current_app, url_for
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+StoredFile = namedtuple('StoredFile', ['path', 'size', 'modified'])
+
+
+def _check_path(path):
+    """Stored paths are static-relative and must stay inside uploads/"""
+    normalized = os.path.normpath(path).replace(os.sep, '/')
+    if normalized != 'uploads' and not normalized.startswith('uploads/'):
+        raise ValueError(f'Not an upload path: {path}')
+    return normalized
+
+
+class LocalStorage:
+    """Uploads kept on this server's disk under static/ and served by Flask"""
+
+    def __init__(self, root=STATIC_ROOT):
+        self.root = root
+
+    def _full_path(self, path):
+        return os.path.join(self.root, _check_path(path))
+
+    def save(self, path, fileobj, content_type=None):
+        full_path = self._full_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+
+    def put_local_file(self, local_path, path):
+        """Move a file already on this disk into storage"""
+        full_path = self._full_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(local_path, full_path)
+
+    def open(self, path):
+        return open(self._full_path(path), 'rb')
+
+    def exists(self, path):
+        return os.path.isfile(self._full_path(path))
+
+    def delete(self, path):
+        try:
+            os.remove(self._full_path(path))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def url(self, path):
+        return url_for('static', filename=path)
+
+    def iter_files(self, prefix):
+        """Yield StoredFile for everything under prefix, one directory at a time"""
+        stack = [self._full_path(prefix)]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        path = os.path.relpath(entry.path, self.root).replace(os.sep, '/')
+                        yield StoredFile(path, stat.st_size, stat.st_mtime)
+
+
+class S3Storage:
+    """Uploads kept in an S3-compatible bucket (AWS S3, MinIO, ...)
+
+    Files are streamed to the bucket with multipart uploads and served with
+    short-lived presigned URLs, so no app server keeps upload state on disk.
+    """
+
+    def __init__(self, bucket, endpoint_url=None, region=None, prefix='',
+                 presign_expires=3600, chunk_size=8 * 1024 * 1024):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix else ''
+        self.presign_expires = presign_expires
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size)
+
+    def _key(self, path):
+        return self.prefix + _check_path(path)
+
+    def save(self, path, fileobj, content_type=None):
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(fileobj, self.bucket, self._key(path),
+                                   ExtraArgs=extra_args, Config=self.transfer_config)
+
+    def put_local_file(self, local_path, path):
+        self.client.upload_file(local_path, self.bucket, self._key(path), Config=self.transfer_config)
+        os.remove(local_path)
+
+    def open(self, path):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(path))['Body']
+
+    def exists(self, path):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(path))
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, path):
+        # S3 deletes are idempotent and do not report whether the key existed
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(path))
+        return True
+
+    def url(self, path):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._key(path)},
+            ExpiresIn=self.presign_expires
+        )
+
+    def iter_files(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                yield StoredFile(item['Key'][len(self.prefix):], item['Size'],
+                                 item['LastModified'].timestamp())
+
+
+def create_storage(config):
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(config.get('STORAGE_LOCAL_ROOT', STATIC_ROOT))
+    if backend == 's3':
+        return S3Storage(
+            bucket=config['S3_BUCKET'],
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region=config.get('S3_REGION'),
+            prefix=config.get('S3_PREFIX', ''),
+            presign_expires=config.get('S3_PRESIGN_EXPIRES', 3600),
+            chunk_size=config.get('S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024)
+        )
+    raise ValueError(f'Unknown STORAGE_BACKEND: {backend}')
+
+
+def get_storage():
+    """Storage backend configured for the current app"""
+    storage = current_app.extensions.get('storage')
+    if storage is None:
+        storage = current_app.extensions['storage'] = create_storage(current_app.config)
+    return storage
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The portal is a set of top-level modules run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# run.py reads its configuration at import time, so point everything at a
+# throwaway directory before any test imports it
+_instance = tempfile.mkdtemp(prefix='portal-tests-')
+for name, value in (
+        ('DATABASE_URL', f'sqlite:///{os.path.join(_instance, "portal.db")}'),
+        ('PREVIEW_CACHE_DIR', os.path.join(_instance, 'previews')),
+        ('BACKUP_DIR', os.path.join(_instance, 'backups')),
+        ('REPORT_SNAPSHOT_PATH', os.path.join(_instance, 'report_snapshot.db')),
+        ('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000'),
+        ('PASSWORD_HASH_CONCURRENCY', '1'),
+        ('COMPRESSION_ENABLED', '0')):
+    os.environ[name] = value
+os.environ['ACTIVITY_DATABASE_URI'] = os.environ['DATABASE_URL']
+
+import cache  # noqa: E402
+
+# Stamp files are not configurable through the environment; keep them out of instance/
+cache.VERSION_PATH = os.path.join(_instance, 'cache_versions')
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The portal app on an empty database, with its own version stamps and cache"""
+    from run import app
+    from models import db
+
+    monkeypatch.setattr(cache, 'VERSION_PATH', str(tmp_path / 'cache_versions'))
+    monkeypatch.setitem(app.extensions, 'cache', cache.create_cache(app.config))
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    from routes import ROUTE_TIMINGS
+
+    slower = config.stash.get(ROUTE_TIMINGS, [])
+    if slower:
+        terminalreporter.section('route wall time over baseline (not enforced)')
+        for key, ms, baseline_ms in slower:
+            terminalreporter.write_line(f'{key:<62} {ms:>8.1f} ms  baseline {baseline_ms:.1f} ms')
@@ -0,0 +1,237 @@
+"""Seed data and request every route in run.py, counting SQL statements.
+
+Shared by tests/test_route_queries.py and benchmarks/compression.py.
+"""
+import io
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'route_baseline.json')
+
+# pytest stash key for (route, ms, baseline ms) of routes slower than their baseline
+ROUTE_TIMINGS = pytest.StashKey()
+
+
+def _catalog_upload():
+    # A dry run touching existing and new programs and courses; writes nothing
+    rows = ['program,program_ar,category,course,course_ar,level,semester',
+            'Program 0,برنامج 0,Statistics,Course 0.0,مقرر 0.0,masters,1',
+            'Program 0,برنامج 0,Statistics,Course 0.9,مقرر 0.9,masters,2',
+            'Program 9,برنامج 9,Statistics,Course 9.0,مقرر 9.0,diploma,1']
+    return {'catalog': (io.BytesIO('\n'.join(rows).encode('utf-8')), 'catalog.csv'), 'dry_run': '1'}
+
+
+# POSTs that are safe to repeat; every other POST/DELETE route is skipped.
+# A callable form is called for each request, for uploads that are consumed.
+POST_CASES = [
+    ('admin', 'admin_ticket_reply', {'message': 'Following up'}),
+    ('admin', 'admin_update_ticket_status', {'status': 'In Progress'}),
+    ('admin', 'admin_application_action', {}),
+    ('admin', 'admin_document_action', {}),
+    ('admin', 'admin_catalog_import', _catalog_upload),
+    ('student', 'student_ticket_reply', {'message': 'Any news?'}),
+    ('student', 'mark_notifications_read', {}),
+]
+
+# URL values for routes that do nothing useful with the shared ones
+URL_OVERRIDES = {
+    'admin_document_action': {'action': 'verify'},
+}
+
+# Query strings for routes that do nothing useful without one. The search
+# matches one student at every seed size, so the fuzzy fallback runs both times
+QUERY_ARGS = {
+    'admin_student_search': {'q': 'Student 0'},
+}
+
+
+def seed(db, models, start, count):
+    """Add `count` students, each with a full set of portal activity"""
+    (User, Program, Course, Application, Document, Payment, StudentID,
+     Certificate, Ticket, TicketMessage, Notification, Project, NewsAnnouncement) = models
+
+    if start == 0:
+        db.session.add(User(email='admin@example.com', full_name='Admin User', role='admin', password_hash='x'))
+        for p in range(5):
+            program = Program(name=f'Program {p}', name_ar=f'برنامج {p}', category='Statistics')
+            db.session.add(program)
+            for c in range(4):
+                program.courses.append(Course(name=f'Course {p}.{c}', name_ar=f'مقرر {p}.{c}',
+                                              level='masters', semester=c % 2 + 1))
+        db.session.flush()
+
+    admin = User.query.filter_by(role='admin').first()
+    programs = Program.query.order_by(Program.id).all()
+    now = datetime.utcnow()
+    for i in range(start, start + count):
+        user = User(email=f'student{i}@example.com', full_name=f'Student {i}', role='student',
+                    nationality='Egyptian' if i % 3 else 'International', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+
+        application = Application(app_id=f'APP-{i:05d}', user_id=user.id, program_id=programs[i % 5].id,
+                                  level='masters', status='Documents Approved' if i % 2 else 'Pending Review',
+                                  payment_status='Paid' if i % 2 else 'Pending',
+                                  date_submitted=now - timedelta(days=i % 30))
+        db.session.add(application)
+        db.session.flush()
+        for name in ('National ID', 'Transcript'):
+            db.session.add(Document(user_id=user.id, application_id=application.id, name=name,
+                                    file_path=f'uploads/documents/00/00/{i}_{name}.pdf'))
+        if i % 2:
+            db.session.add(Payment(user_id=user.id, application_id=application.id, amount=600,
+                                   payment_method='Card', transaction_id=f'TXN-{i}'))
+        if i % 4 == 1:
+            db.session.add(StudentID(student_id=f'2025-LOC-P-{i:04d}', application_id=application.id))
+
+        db.session.add(Certificate(cert_id=f'CERT-{i:05d}', user_id=user.id, type='Enrollment', copies=1))
+
+        ticket = Ticket(ticket_id=f'TKT-{i:05d}', user_id=user.id, subject=f'Question {i}')
+        db.session.add(ticket)
+        for sender in ('Student', 'Admin', 'Student'):
+            ticket.messages.append(TicketMessage(sender=sender, message='Hello'))
+        ticket.message_count = 3
+        ticket.last_message_at = now
+        ticket.last_sender = 'Student'
+        ticket.awaiting_reply = True
+
+        for n in range(5):
+            db.session.add(Notification(user_id=user.id, message=f'Notification {n}', read=n > 2))
+            db.session.add(Notification(user_id=admin.id, message=f'Student {i} event {n}'))
+
+        if i % 2 == 0:
+            db.session.add(Project(title=f'Project {i}', description='...', category='Research',
+                                   user_id=admin.id, is_active=True))
+            db.session.add(NewsAnnouncement(title=f'News {i}', description='...',
+                                            type='news' if i % 4 else 'announcement'))
+    db.session.commit()
+
+
+def url_values(app_models, role):
+    """Concrete values for URL parameters, owned by the student where it matters"""
+    User, Application, Certificate, Ticket, Document, Project, NewsAnnouncement = app_models
+    student = User.query.filter_by(email='student0@example.com').first()
+    return {
+        'ticket_id': Ticket.query.filter_by(user_id=student.id).first().id,
+        'app_id': Application.query.filter_by(user_id=student.id).first().id,
+        'application_id': Application.query.filter_by(user_id=student.id).first().id,
+        'cert_id': Certificate.query.filter_by(user_id=student.id).first().id,
+        'doc_id': Document.query.filter_by(user_id=student.id).first().id,
+        'project_id': Project.query.first().id,
+        'id': NewsAnnouncement.query.first().id,
+        'name': 'applications',
+        'fmt': 'csv',
+        'action': 'approve',
+        'filename': 'missing.png',
+        'user_id': student.id,
+    }
+
+
+URL_PARAMS = ('ticket_id', 'app_id', 'application_id', 'cert_id', 'doc_id', 'project_id', 'id', 'name', 'fmt',
+              'action', 'filename', 'user_id')
+
+
+def role_for(rule):
+    if rule.rule.startswith('/admin'):
+        return ['admin']
+    if rule.rule.startswith(('/student', '/tickets', '/mark_notifications_read')):
+        return ['student']
+    return ['anonymous', 'student']
+
+
+
+
+def route_cases(app, values):
+    """[(key, role, method, url, form)] for every route that can be requested with `values`"""
+    from flask import url_for
+
+    found = []
+    post_cases = {endpoint: (role, form) for role, endpoint, form in POST_CASES}
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+            if rule.endpoint in ('static', 'logout'):
+                continue
+            params = {arg: values[arg] for arg in rule.arguments if arg in values}
+            if len(params) != len(rule.arguments):
+                continue
+            params.update(URL_OVERRIDES.get(rule.endpoint, {}))
+            url = url_for(rule.endpoint, **params, **QUERY_ARGS.get(rule.endpoint, {}))
+            if 'GET' in rule.methods:
+                for role in role_for(rule):
+                    found.append((f'{role} GET {rule.rule}', role, 'GET', url, None))
+            if rule.endpoint in post_cases:
+                role, form = post_cases[rule.endpoint]
+                found.append((f'{role} POST {rule.rule}', role, 'POST', url, form))
+    return found
+
+
+def logged_in_clients(app):
+    """Test clients for the seeded admin, the first student and an anonymous visitor"""
+    from models import User
+
+    clients = {'anonymous': app.test_client()}
+    for role, email in (('admin', 'admin@example.com'), ('student', 'student0@example.com')):
+        with app.app_context():
+            user_id = User.query.filter_by(email=email).first().id
+        client = clients[role] = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return clients
+
+
+class StatementCounter:
+    """Counts SQL statements sent by any engine while active"""
+
+    def __init__(self):
+        self.active = False
+        self.statements = 0
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.listen(Engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.remove(Engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        if self.active:
+            self.statements += 1
+
+
+def _form_data(form):
+    return form() if callable(form) else form
+
+
+def measure(clients, cases, repeat):
+    """{key: {'status', 'queries', 'ms'}} with the most statements and median wall time of `repeat` runs"""
+    results = {}
+    with StatementCounter() as counter:
+        for key, role, method, url, form in cases:
+            client = clients[role]
+            # Warm caches (identity, catalog) so every measured run does the same work
+            client.open(url, method=method, data=_form_data(form)).close()
+            counts, timings, status = [], [], None
+            for _ in range(repeat):
+                counter.statements = 0
+                counter.active = True
+                start = time.perf_counter()
+                response = client.open(url, method=method, data=_form_data(form))
+                response.get_data()
+                timings.append((time.perf_counter() - start) * 1000)
+                counter.active = False
+                counts.append(counter.statements)
+                status = response.status_code
+                response.close()
+            results[key] = {'status': status, 'queries': max(counts), 'ms': round(statistics.median(timings), 2)}
+    return results
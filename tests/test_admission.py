@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, Response, stream_with_context
+
+import admission
+from admission import AdmissionGate, init_admission, route_class
+
+
+@pytest.mark.parametrize('path, name', [
+    ('/student/payments/3', 'payment'),
+    ('/student/certificate/payment/CERT-1', 'payment'),
+    ('/student/dashboard', 'student'),
+    ('/admin/applications', 'admin'),
+    ('/tickets/7/messages', 'student'),
+    ('/register', 'student'),
+    ('/login', 'student'),
+    ('/mark_notifications_read', 'student'),
+    ('/', 'public'),
+    ('/programs', 'public'),
+    ('/admin/export/payments.csv', None),
+    ('/tickets/7/messages/wait', None),
+    ('/notifications/stream', None),
+])
+def test_route_class(path, name):
+    assert route_class(path) == name
+
+
+def test_gate_queues_until_a_slot_frees():
+    gate = AdmissionGate('test', limit=1, queue_timeout=5, retry_after=1)
+    assert gate.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+    waiter.start()
+    deadline = time.monotonic() + 5
+    while gate.waiting == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert gate.snapshot()['queued'] == 1
+
+    gate.release()
+    waiter.join(5)
+    assert admitted == [True]
+    assert gate.snapshot() == {'limit': 1, 'queue_timeout': 5, 'in_flight': 1, 'queued': 0,
+                               'admitted': 2, 'shed': 0}
+
+
+def test_gate_sheds_after_queue_timeout():
+    gate = AdmissionGate('test', limit=1, queue_timeout=0.05, retry_after=1)
+    assert gate.acquire()
+    started = time.monotonic()
+
+    assert not gate.acquire()
+    assert time.monotonic() - started >= 0.05
+    assert (gate.in_flight, gate.waiting, gate.admitted, gate.shed) == (1, 0, 1, 1)
+
+
+@pytest.fixture
+def gated_app(monkeypatch):
+    # init_admission fills the module's gates, which the portal app shares
+    monkeypatch.setattr(admission, 'gates', {})
+    app = Flask(__name__)
+    app.config['ADMISSION_LIMITS'] = {'public': (1, 0.01, 30), 'admin': (1, 0.01, 5)}
+    init_admission(app)
+
+    @app.route('/', methods=['GET', 'POST'])
+    def index():
+        return 'home'
+
+    @app.route('/admin/export/<name>')
+    def export(name):
+        return Response(stream_with_context(iter(['a,b\n', '1,2\n'])), mimetype='text/csv')
+
+    @app.route('/notifications/stream')
+    def stream():
+        return 'events'
+
+    return app
+
+
+def test_full_gate_answers_503(gated_app):
+    client = gated_app.test_client()
+    assert client.get('/').status_code == 200
+    assert admission.gates['public'].in_flight == 0
+
+    admission.gates['public'].acquire()
+    response = client.get('/')
+    assert (response.status_code, response.headers['Retry-After']) == (503, '30')
+    assert response.get_data(as_text=True).startswith('The portal is very busy')
+
+    for response in (client.post('/'), client.get('/', headers={'Accept': 'application/json'})):
+        assert response.status_code == 503
+        assert response.get_json()['success'] is False
+    assert admission.gates['public'].shed == 3
+
+
+def test_streams_are_not_gated(gated_app):
+    client = gated_app.test_client()
+    admission.gates['public'].acquire()
+    admission.gates['admin'].acquire()
+
+    assert client.get('/notifications/stream').status_code == 200
+    response = client.get('/admin/export/payments')
+    assert (response.status_code, response.get_data(as_text=True)) == (200, 'a,b\n1,2\n')
+    assert admission.gates['admin'].admitted == 1
+    assert admission.gates['public'].admitted == 1
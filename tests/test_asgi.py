@@ -0,0 +1,277 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from flask import Flask, Response, stream_with_context
+
+pytest.importorskip('aiosqlite')
+
+from realtime import RealtimeApp  # noqa: E402
+
+SLEEP = 0.5
+
+
+@pytest.fixture
+def application(tmp_path):
+    flask_app = Flask(__name__)
+    flask_app.config.update(SECRET_KEY='test', SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "portal.db"}',
+                            ASGI_SYNC_THREADS=8)
+    flask_app.closed = []
+
+    @flask_app.route('/slow')
+    def slow():
+        time.sleep(SLEEP)
+        return threading.current_thread().name
+
+    @flask_app.route('/export')
+    def export():
+        def rows():
+            yield 'id\n'
+            for i in range(3):
+                yield f'{i}\n'
+        response = Response(stream_with_context(rows()), mimetype='text/csv')
+        response.call_on_close(lambda: flask_app.closed.append('export'))
+        return response
+
+    return RealtimeApp(flask_app)
+
+
+def http_scope(path, query_string=b'', headers=()):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string, 'headers': list(headers),
+            'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'root_path': ''}
+
+
+async def request(application, path, query_string=b'', headers=()):
+    messages = []
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        messages.append(message)
+
+    await application(http_scope(path, query_string, headers), receive, send)
+    status = messages[0]['status']
+    return status, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def test_sync_views_run_in_parallel(application):
+    async def main():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(request(application, '/slow') for _ in range(4)))
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(main())
+
+    assert [status for status, _ in results] == [200] * 4
+    # One shared thread would take 4 x SLEEP
+    assert elapsed < 2 * SLEEP, f'4 concurrent requests took {elapsed:.2f}s'
+    assert len({body for _, body in results}) == 4
+
+
+def test_streamed_responses_are_sent_and_closed(application):
+    status, body = asyncio.run(request(application, '/export'))
+    assert (status, body) == (200, b'id\n0\n1\n2\n')
+    assert application.flask_app.closed == ['export']
+
+
+# Async endpoints, against the portal's database
+
+@pytest.fixture
+def portal(app, monkeypatch):
+    from models import db, Notification, Ticket, TicketMessage, User
+
+    for name, value in (('ASYNC_POLL_INTERVAL', 0.05), ('LONG_POLL_TIMEOUT', 5), ('SSE_HEARTBEAT', 0.1),
+                        ('ASYNC_ENDPOINTS', False)):
+        monkeypatch.setitem(app.config, name, value)
+    with app.app_context():
+        users = [User(email=f'{role}@example.com', full_name=role.title(), role=role.rstrip('2'),
+                      password_hash='x') for role in ('admin', 'student', 'student2')]
+        db.session.add_all(users)
+        db.session.flush()
+        ticket = Ticket(ticket_id='TKT-1', user_id=users[1].id, subject='Fees')
+        ticket.messages.append(TicketMessage(sender='Student', message='Hello'))
+        db.session.add(ticket)
+        db.session.add(Notification(user_id=users[1].id, message='Before connecting'))
+        db.session.commit()
+        ids = {'admin': users[0].id, 'student': users[1].id, 'other': users[2].id, 'ticket': ticket.id,
+               'message': ticket.messages[0].id}
+
+    def add(model, **values):
+        with app.app_context():
+            db.session.add(model(**values))
+            db.session.commit()
+
+    return RealtimeApp(app), ids, {'notification': lambda **values: add(Notification, **values),
+                                   'message': lambda **values: add(TicketMessage, **values)}
+
+
+def session_cookie(application, user_id):
+    flask_app = application.flask_app
+    value = flask_app.session_interface.get_signing_serializer(flask_app).dumps({'_user_id': str(user_id)})
+    return (b'cookie', f'{flask_app.config["SESSION_COOKIE_NAME"]}={value}'.encode('latin-1'))
+
+
+async def wait_for_messages(application, ticket_id, user_id=None, after=0):
+    headers = [session_cookie(application, user_id)] if user_id else []
+    status, body = await request(application, f'/tickets/{ticket_id}/messages/wait',
+                                 f'after={after}'.encode(), headers)
+    return status, json.loads(body)
+
+
+def run(application, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await application._stop()
+    return asyncio.run(main())
+
+
+def test_long_poll_requires_a_session(portal):
+    application, ids, _ = portal
+    # A cookie that was not signed by the app is no session either
+    forged = (b'cookie', f'{application.flask_app.config["SESSION_COOKIE_NAME"]}=forged'.encode())
+
+    async def main():
+        return (await wait_for_messages(application, ids['ticket']),
+                await request(application, f'/tickets/{ids["ticket"]}/messages/wait', b'', [forged]))
+
+    (status, body), (forged_status, _) = run(application, main())
+    assert (status, body['success']) == (401, False)
+    assert forged_status == 401
+
+
+def test_long_poll_rejects_other_students(portal):
+    application, ids, _ = portal
+
+    async def main():
+        return (await wait_for_messages(application, ids['ticket'], ids['other']),
+                await wait_for_messages(application, 999, ids['student']))
+
+    (status, body), (missing, _) = run(application, main())
+    assert (status, body['message']) == (403, 'Access denied')
+    assert missing == 404
+
+
+def test_long_poll_returns_existing_replies_at_once(portal):
+    application, ids, _ = portal
+
+    async def main():
+        return [await wait_for_messages(application, ids['ticket'], ids[user]) for user in ('student', 'admin')]
+
+    for status, body in run(application, main()):
+        assert status == 200
+        assert [message['message'] for message in body['messages']] == ['Hello']
+
+
+def test_long_poll_waits_for_a_reply(portal):
+    application, ids, add = portal
+
+    async def main():
+        poll = asyncio.ensure_future(wait_for_messages(application, ids['ticket'], ids['student'], ids['message']))
+        await asyncio.sleep(0.3)
+        assert not poll.done()
+        await asyncio.to_thread(add['message'], ticket_id=ids['ticket'], sender='Admin', message='Paid?')
+        return await asyncio.wait_for(poll, 5)
+
+    status, body = run(application, main())
+    assert status == 200
+    assert [(m['sender'], m['message']) for m in body['messages']] == [('Admin', 'Paid?')]
+
+
+def test_long_poll_times_out_empty(portal):
+    application, ids, _ = portal
+    application.long_poll_timeout = 0.2
+    status, body = run(application, wait_for_messages(application, ids['ticket'], ids['student'], ids['message']))
+    assert (status, body['messages'], body['status']) == (200, [], 'Open')
+
+
+async def read_stream(application, headers, until):
+    """Chunks of an SSE response, disconnecting once until(body) is true"""
+    chunks = []
+    disconnected = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b''}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        chunks.append(message)
+        if until(b''.join(chunk.get('body', b'') for chunk in chunks[1:]).decode()):
+            disconnected.set()
+
+    await asyncio.wait_for(application(http_scope('/notifications/stream', headers=headers), receive, send), 10)
+    return chunks[0], b''.join(chunk.get('body', b'') for chunk in chunks[1:]).decode()
+
+
+def test_notification_stream_requires_a_session(portal):
+    application, _, _ = portal
+    start, body = run(application, read_stream(application, [], lambda body: True))
+    assert start['status'] == 401
+
+
+def test_notification_stream_sends_only_new_own_notifications(portal):
+    application, ids, add = portal
+
+    async def main():
+        stream = asyncio.ensure_future(read_stream(application, [session_cookie(application, ids['student'])],
+                                                   lambda body: 'event: notification' in body))
+        await asyncio.sleep(0.3)
+        await asyncio.to_thread(add['notification'], user_id=ids['other'], message='Not yours')
+        await asyncio.to_thread(add['notification'], user_id=ids['student'], message='Ticket answered')
+        return await stream
+
+    start, body = run(application, main())
+    assert start['status'] == 200
+    assert (b'content-type', b'text/event-stream') in start['headers']
+    assert ': keep-alive' in body
+    assert 'Ticket answered' in body
+    assert 'Not yours' not in body and 'Before connecting' not in body
+
+
+def test_notification_stream_resumes_after_last_event_id(portal):
+    application, ids, _ = portal
+    headers = [session_cookie(application, ids['student']), (b'last-event-id', b'0')]
+    start, body = run(application, read_stream(application, headers, lambda body: 'event: notification' in body))
+    event = body.split('event: notification\n', 1)[1]
+    assert json.loads(event.split('data: ', 1)[1].split('\n', 1)[0])['message'] == 'Before connecting'
+
+
+def test_failed_watcher_is_logged_and_restarted(tmp_path, caplog):
+    import aiosqlite
+    from realtime import TableWatcher
+
+    flask_app = Flask(__name__)
+    flask_app.config.update(SECRET_KEY='test', SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "portal.db"}')
+    application = RealtimeApp(flask_app)
+
+    async def main():
+        connection = await aiosqlite.connect(tmp_path / 'portal.db')
+        watcher = TableWatcher(connection, 'notification', 0.05)
+        task = asyncio.create_task(application._watch(watcher))
+        try:
+            # The table does not exist yet, so every check fails until it does
+            await asyncio.sleep(0.2)
+            await connection.execute('CREATE TABLE notification (id INTEGER PRIMARY KEY)')
+            await connection.execute('INSERT INTO notification DEFAULT VALUES')
+            await connection.commit()
+            return await watcher.wait(0, 5)
+        finally:
+            task.cancel()
+            await connection.close()
+
+    assert asyncio.run(main())
+    assert 'Watcher for notification failed; restarting' in caplog.text
@@ -0,0 +1,230 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import cache
+from cache import (INVALIDATE_ALL, InvalidationBus, LRUCache, RedisCache, VersionStamp, VersionedCache,
+                   create_cache)
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture(autouse=True)
+def stamp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'VERSION_PATH', str(tmp_path / 'cache_versions'))
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_cache(server):
+    return RedisCache(client=fakeredis.FakeRedis(server=server), prefix='test:', default_ttl=60)
+
+
+def app_with(backend):
+    app = Flask(__name__)
+    app.extensions['cache'] = backend
+    return app
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+# LRUCache
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(max_entries=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1  # a is now the most recent
+    lru.set('c', 3)
+
+    assert lru.get('b') is None
+    assert lru.get_many(['a', 'c', 'b']) == ({'a': 1, 'c': 3}, ['b'])
+    stats = lru.stats()
+    assert (stats['entries'], stats['evictions'], stats['hits'], stats['misses']) == (2, 1, 3, 2)
+
+
+def test_lru_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    lru = LRUCache(default_ttl=10)
+    lru.set('default', 1)
+    lru.set('short', 2, ttl=1)
+    lru.set('forever', 3, ttl=0)
+
+    now[0] += 5
+    assert lru.get_many(['default', 'short', 'forever']) == ({'default': 1, 'forever': 3}, ['short'])
+    now[0] += 10
+    assert lru.get_many(['default', 'forever']) == ({'forever': 3}, ['default'])
+    assert lru.stats()['expirations'] == 2
+
+
+def test_lru_delete_and_clear():
+    lru = LRUCache()
+    lru.set_many({'a': 1, 'b': 2})
+    assert lru.delete('a') and not lru.delete('a')
+    lru.clear()
+    assert lru.stats()['entries'] == 0
+
+
+# RedisCache
+
+def test_redis_round_trip_and_ttl(redis_cache):
+    redis_cache.set_many({'a': {'role': 'admin'}, ('program', 1): (1, 2)})
+    redis_cache.set('short', 'x', ttl=5)
+
+    assert redis_cache.get_many(['a', ('program', 1), 'missing']) == (
+        {'a': {'role': 'admin'}, ('program', 1): (1, 2)}, ['missing'])
+    assert 0 < redis_cache.client.ttl('test:cache:a') <= 60
+    assert 0 < redis_cache.client.ttl('test:cache:short') <= 5
+    assert redis_cache.delete('a') and redis_cache.get('a') is None
+    stats = redis_cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 2)
+
+
+def test_redis_clear_only_touches_its_prefix(redis_cache):
+    redis_cache.client.set('other-app:key', 'kept')
+    redis_cache.set_many({f'k{i}': i for i in range(2500)})
+    redis_cache.clear()
+    assert redis_cache.client.keys('test:cache:*') == []
+    assert redis_cache.client.get('other-app:key') == b'kept'
+
+
+def test_redis_errors_miss_instead_of_failing(server, redis_cache):
+    redis_cache.set('a', 1)
+    server.connected = False
+
+    assert redis_cache.get('a') is None
+    redis_cache.set('b', 2)
+    assert redis_cache.delete('a') is False
+    assert redis_cache.stats()['errors'] == 3
+
+
+def test_create_cache():
+    assert isinstance(create_cache({}), LRUCache)
+    with pytest.raises(ValueError):
+        create_cache({'CACHE_BACKEND': 'memcached'})
+
+
+# VersionStamp and VersionedCache
+
+def test_version_stamp_is_shared_through_its_file():
+    writer, reader = VersionStamp('catalog'), VersionStamp('catalog')
+    assert reader.current() == '0'
+    token = writer.bump()
+    assert reader.current() == token == writer.current()
+    assert writer.bump() != token
+
+
+def test_versioned_cache_misses_after_a_bump():
+    stamp = VersionStamp('catalog')
+    with app_with(LRUCache()).app_context():
+        catalog = VersionedCache(stamp)
+        catalog.set_many({'all': ('p1',), ('p', 1): ()}, catalog.version())
+        assert catalog.get_many(['all', ('p', 1)]) == ({'all': ('p1',), ('p', 1): ()}, [])
+
+        stamp.bump()
+        assert catalog.get('all') is None
+
+
+def test_versioned_cache_drops_values_read_before_a_bump():
+    stamp = VersionStamp('catalog')
+    with app_with(LRUCache()).app_context():
+        catalog = VersionedCache(stamp)
+        version = catalog.version()
+        stamp.bump()  # another worker commits while this one is reading
+        catalog.set('all', ('stale',), version)
+        assert catalog.get('all') is None
+
+
+def test_versioned_cache_entries_are_shared_through_redis(server):
+    # Two workers: their own stamp objects and cache clients, one Redis
+    first = app_with(RedisCache(client=fakeredis.FakeRedis(server=server)))
+    second = app_with(RedisCache(client=fakeredis.FakeRedis(server=server)))
+    first_catalog = VersionedCache(VersionStamp('catalog'))
+    second_catalog = VersionedCache(VersionStamp('catalog'))
+
+    with first.app_context():
+        first_catalog.set('all', ('p1',), first_catalog.version())
+    with second.app_context():
+        assert second_catalog.get('all') == ('p1',)
+        second_catalog.stamp.bump()
+    with first.app_context():
+        assert first_catalog.get('all') is None
+
+
+# InvalidationBus
+
+def test_bus_writes_remote_tokens_and_notifies(server):
+    bus = InvalidationBus()
+    received = []
+    bus.subscribe(received.append)
+    bus.configure(fakeredis.FakeRedis(server=server), 'test:invalidate')
+    bus.ensure_listening()
+    wait_for(lambda: bus.connected)
+    assert received == [INVALIDATE_ALL]
+
+    # A bump on another host
+    fakeredis.FakeRedis(server=server).publish('test:invalidate', 'otherhost catalog 5f3a')
+    wait_for(lambda: 'catalog' in received)
+    assert VersionStamp('catalog').current() == '5f3a'
+
+    # Messages from this process are not delivered back to it
+    bus.publish('programs', 'abcd')
+    fakeredis.FakeRedis(server=server).publish('test:invalidate', 'otherhost user:7')
+    wait_for(lambda: 'user:7' in received)
+    assert 'programs' not in received and bus.published == 1
+    bus._pid = None
+
+
+def test_bus_closes_the_old_pubsub_when_reconnecting():
+    from redis.exceptions import ConnectionError
+
+    opened = []
+    blocked = threading.Event()
+
+    class PubSub:
+        def __init__(self):
+            self.closed = False
+            opened.append(self)
+
+        def subscribe(self, channel):
+            pass
+
+        def listen(self):
+            if len(opened) == 1:
+                raise ConnectionError('connection lost')
+            blocked.wait()
+            return iter(())
+
+        def close(self):
+            self.closed = True
+
+    class Client:
+        def pubsub(self, ignore_subscribe_messages=False):
+            return PubSub()
+
+    bus = InvalidationBus()
+    received = []
+    bus.subscribe(received.append)
+    bus.configure(Client(), 'test:invalidate')
+    bus.ensure_listening()
+    wait_for(lambda: len(opened) == 2)
+
+    assert opened[0].closed and not opened[1].closed
+    assert bus.errors == 1
+    # Reconnecting drops everything, since messages may have been missed
+    assert received == [INVALIDATE_ALL, INVALIDATE_ALL]
+    bus._pid = None
+    blocked.set()
@@ -0,0 +1,101 @@
+import pytest
+
+from catalog import courses_for
+from models import db, Application, Course, Program, User
+from routes import StatementCounter
+
+
+@pytest.fixture
+def programs(app):
+    """Two programs with courses at two levels, added out of semester order"""
+    with app.app_context():
+        ids = []
+        for name in ('Statistics', 'Economics'):
+            program = Program(name=name, name_ar=name)
+            for level, semester in (('masters', 2), ('masters', 1), ('diploma', 1)):
+                program.courses.append(Course(name=f'{name} {level} {semester}', name_ar='-',
+                                              level=level, semester=semester))
+            db.session.add(program)
+            db.session.flush()
+            ids.append(program.id)
+        db.session.commit()
+        return ids
+
+
+def names(catalog):
+    return {pair: [course.name for course in courses] for pair, courses in catalog.items()}
+
+
+def test_courses_for_fetches_every_pair_in_one_query(app, programs):
+    statistics, economics = programs
+    pairs = [(statistics, 'masters'), (economics, 'diploma'), (statistics, 'doctorate')]
+    with app.app_context(), StatementCounter() as counter:
+        counter.active = True
+        catalog = courses_for(pairs)
+
+    assert counter.statements == 1
+    assert list(catalog) == pairs
+    assert names(catalog) == {
+        (statistics, 'masters'): ['Statistics masters 1', 'Statistics masters 2'],
+        (economics, 'diploma'): ['Economics diploma 1'],
+        (statistics, 'doctorate'): [],
+    }
+
+
+def test_courses_for_is_served_from_cache(app, programs):
+    statistics, economics = programs
+    pairs = [(statistics, 'masters'), (economics, 'masters')]
+    with app.app_context(), StatementCounter() as counter:
+        first = courses_for(pairs)
+        counter.active = True
+        second = courses_for(pairs)
+        assert counter.statements == 0
+
+        # Only the pair that was never looked up goes to the database
+        third = courses_for(pairs + [(economics, 'diploma')])
+        assert counter.statements == 1
+
+    assert second == first
+    assert names(third)[(economics, 'diploma')] == ['Economics diploma 1']
+
+
+def test_course_change_invalidates_the_cache(app, programs):
+    statistics, _ = programs
+    with app.app_context():
+        courses_for([(statistics, 'masters')])
+        db.session.add(Course(name='Statistics masters 3', name_ar='-', program_id=statistics,
+                              level='masters', semester=1))
+        db.session.commit()
+
+        assert names(courses_for([(statistics, 'masters')]))[(statistics, 'masters')] == [
+            'Statistics masters 1', 'Statistics masters 3', 'Statistics masters 2']
+
+
+def test_student_courses_lists_courses_of_paid_applications(app, programs):
+    statistics, economics = programs
+    with app.app_context():
+        student = User(email='student@example.com', full_name='Student', role='student', password_hash='x')
+        db.session.add(student)
+        db.session.flush()
+        for app_id, program_id, level, status, payment in (
+                ('APP-1', statistics, 'masters', 'Enrolled', 'Paid'),
+                ('APP-2', economics, 'diploma', 'Documents Approved', 'Paid'),
+                ('APP-3', economics, 'masters', 'Documents Approved', 'Pending')):
+            db.session.add(Application(app_id=app_id, user_id=student.id, program_id=program_id,
+                                       level=level, status=status, payment_status=payment))
+        db.session.commit()
+        student_id = student.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(student_id)
+        session['_fresh'] = True
+    response = client.get('/student/courses')
+    html = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert 'Statistics masters 1' in html and 'Statistics masters 2' in html
+    assert 'Economics diploma 1' in html
+    # Unpaid, and a diploma application does not show the program's masters courses
+    assert 'Economics masters' not in html
+    assert 'Statistics diploma' not in html
@@ -0,0 +1,205 @@
+import io
+import zipfile
+
+import pytest
+
+from catalog_import import CatalogImportError, import_catalog, read_xlsx
+from models import db, Course, Program
+
+HEADER = 'program,program_ar,category,program_description,course,course_ar,level,semester,description\n'
+
+
+def csv_file(*lines, header=HEADER):
+    return io.BytesIO((header + ''.join(line + '\n' for line in lines)).encode())
+
+
+def run_import(app, fileobj, filename='catalog.csv', **kwargs):
+    with app.app_context():
+        return import_catalog(fileobj, filename, **kwargs)
+
+
+def stored_courses(app):
+    with app.app_context():
+        return sorted((course.program.name, course.level, course.name, course.name_ar, course.semester)
+                      for course in Course.query.all())
+
+
+def test_imports_programs_and_courses(app):
+    report = run_import(app, csv_file(
+        'CS,علوم,Science,About CS,Algo,خوارزميات,masters,1,',
+        'CS,,,,Data,بيانات,Masters,2,Tables',
+        'Math,رياضيات,Science,,,,,,',
+    ))
+
+    assert report.to_dict() == {'dry_run': False, 'rows': 3, 'programs': 2, 'courses': 2,
+                                'error_count': 0, 'errors': []}
+    assert stored_courses(app) == [('CS', 'masters', 'Algo', 'خوارزميات', 1),
+                                   ('CS', 'masters', 'Data', 'بيانات', 2)]
+    with app.app_context():
+        cs = Program.query.filter_by(name='CS').one()
+        # Blank program columns on later rows keep the first row's values
+        assert (cs.name_ar, cs.category, cs.description) == ('علوم', 'Science', 'About CS')
+        assert Program.query.count() == 2
+
+
+@pytest.mark.parametrize('content, filename, message', [
+    (b'', 'catalog.csv', 'The file is empty'),
+    (b'\n,,\n', 'catalog.csv', 'The file is empty'),
+    (b'name,course\nCS,Algo\n', 'catalog.csv', "Header must include a 'program' column"),
+    (b'program\nCS\n', 'catalog.txt', 'Catalog files must be .csv or .xlsx'),
+    (b'program\nCS\n', 'catalog.xlsx', 'Not a valid XLSX file'),
+    (b'program,program_ar\n\xff\xfe,x\n', 'catalog.csv', 'CSV files must be UTF-8 encoded'),
+])
+def test_rejects_unreadable_files(app, content, filename, message):
+    with pytest.raises(CatalogImportError, match=message):
+        run_import(app, io.BytesIO(content), filename)
+
+
+def test_reports_invalid_rows_by_line(app):
+    report = run_import(app, csv_file(
+        ',علوم,,,Algo,خوارزميات,masters,1,',
+        'CS,,,,Algo,خوارزميات,masters,1,',
+        'CS,علوم,,,Algo,خوارزميات,bachelor,1,',
+        'CS,علوم,,,Algo,خوارزميات,masters,3,',
+        'CS,علوم,,,Algo,خوارزميات,masters,first,',
+        'CS,علوم,,,Algo,,masters,1,',
+        'CS,علوم,' + 'x' * 101 + ',,,,,,',
+        'CS,علوم,,,Algo,خوارزميات,masters,1,',
+    ))
+
+    assert report.errors == [
+        (2, 'program is required'),
+        (3, 'program_ar is required the first time a program appears'),
+        (4, 'level must be one of diploma, masters, doctorate'),
+        (5, 'semester must be 1 or 2'),
+        (6, 'semester must be 1 or 2'),
+        (7, 'course_ar is required'),
+        (8, 'category is longer than 100 characters'),
+    ]
+    assert (report.rows, report.error_count, report.courses) == (8, 7, 1)
+    assert stored_courses(app) == [('CS', 'masters', 'Algo', 'خوارزميات', 1)]
+
+
+@pytest.mark.parametrize('batch_size', [1, 100])
+def test_repeated_course_is_an_error(app, batch_size):
+    report = run_import(app, csv_file(
+        'CS,علوم,,,Algo,خوارزميات,masters,1,',
+        'CS,علوم,,,Data,بيانات,masters,1,',
+        'CS,علوم,,,Algo,خوارزميات 2,masters,2,',
+        # Same course name at another level is a different course
+        'CS,علوم,,,Algo,خوارزميات,doctorate,1,',
+    ), batch_size=batch_size)
+
+    assert report.errors == [(4, 'duplicate of line 2')]
+    assert report.courses == 3
+    assert stored_courses(app) == [('CS', 'doctorate', 'Algo', 'خوارزميات', 1),
+                                   ('CS', 'masters', 'Algo', 'خوارزميات', 1),
+                                   ('CS', 'masters', 'Data', 'بيانات', 1)]
+
+
+def test_dry_run_validates_without_writing(app):
+    report = run_import(app, csv_file(
+        'CS,علوم,,,Algo,خوارزميات,masters,1,',
+        'CS,علوم,,,Algo,خوارزميات,masters,1,',
+    ), dry_run=True)
+
+    assert (report.dry_run, report.courses, report.errors) == (True, 1, [(3, 'duplicate of line 2')])
+    assert stored_courses(app) == []
+
+
+def test_reimport_updates_in_place(app):
+    lines = ('CS,علوم,Science,,Algo,خوارزميات,masters,1,',
+             'CS,علوم,,,Data,بيانات,masters,2,')
+    run_import(app, csv_file(*lines))
+    first = stored_courses(app)
+    report = run_import(app, csv_file(*lines))
+
+    assert (report.courses, report.error_count) == (2, 0)
+    assert stored_courses(app) == first
+
+    run_import(app, csv_file('CS,علوم الحاسب,,,Algo,خوارزميات متقدمة,masters,2,'))
+    assert stored_courses(app) == [('CS', 'masters', 'Algo', 'خوارزميات متقدمة', 2),
+                                   ('CS', 'masters', 'Data', 'بيانات', 2)]
+    with app.app_context():
+        cs = Program.query.one()
+        # A blank category does not clear the one already stored
+        assert (cs.name_ar, cs.category) == ('علوم الحاسب', 'Science')
+
+
+def test_import_invalidates_the_catalog_cache(app):
+    from catalog import all_programs
+
+    with app.app_context():
+        assert all_programs() == ()
+    run_import(app, csv_file('CS,علوم,,,,,,,'))
+    with app.app_context():
+        assert [program.name for program in all_programs()] == ['CS']
+
+
+# XLSX
+
+WORKBOOK = ('<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            '<sheets><sheet name="Catalog" sheetId="1" r:id="rId1"/></sheets></workbook>')
+RELS = ('<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>')
+SHARED_STRINGS = ('<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                  '<si><t>program</t></si><si><t>program_ar</t></si><si><t>course</t></si>'
+                  '<si><t>course_ar</t></si><si><t>level</t></si><si><t>semester</t></si>'
+                  '<si><t>CS</t></si>'
+                  # Rich text: the runs are joined
+                  '<si><r><t>علوم </t></r><r><t>الحاسب</t></r></si>'
+                  '<si><t>masters</t></si></sst>')
+
+
+def xlsx_file(rows, shared_strings=SHARED_STRINGS):
+    sheet = ''.join(f'<row{row}</row>' for row in rows)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('xl/workbook.xml', WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', RELS)
+        if shared_strings:
+            archive.writestr('xl/sharedStrings.xml', shared_strings)
+        archive.writestr('xl/worksheets/sheet1.xml',
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         f'<sheetData>{sheet}</sheetData></worksheet>')
+    buffer.seek(0)
+    return buffer
+
+
+XLSX_ROWS = [
+    ' r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c>'
+    '<c r="D1" t="s"><v>3</v></c><c r="E1" t="s"><v>4</v></c><c r="F1" t="s"><v>5</v></c>',
+    # Row 2 is empty and left out of the sheet, as spreadsheet apps do
+    ' r="3"><c r="A3" t="s"><v>6</v></c><c r="B3" t="s"><v>7</v></c>'
+    '<c r="C3" t="inlineStr"><is><t>Algo</t></is></c><c r="D3" t="inlineStr"><is><t>خوارزميات</t></is></c>'
+    '<c r="E3" t="s"><v>8</v></c><c r="F3"><v>2.0</v></c>',
+    # Sparse: only A and F, the cells in between are blank
+    ' r="4"><c r="A4" t="s"><v>6</v></c><c r="F4" t="n"><v>1</v></c>',
+]
+
+
+def test_read_xlsx_rows():
+    rows = list(read_xlsx(xlsx_file(XLSX_ROWS)))
+
+    assert rows == [
+        (1, ['program', 'program_ar', 'course', 'course_ar', 'level', 'semester']),
+        (3, ['CS', 'علوم الحاسب', 'Algo', 'خوارزميات', 'masters', '2']),
+        (4, ['CS', '', '', '', '', '1']),
+    ]
+
+
+def test_imports_xlsx(app):
+    report = run_import(app, xlsx_file(XLSX_ROWS), 'catalog.xlsx')
+
+    assert (report.rows, report.programs, report.courses, report.errors) == (2, {'CS'}, 1, [])
+    assert stored_courses(app) == [('CS', 'masters', 'Algo', 'خوارزميات', 2)]
+
+
+def test_read_xlsx_without_shared_strings():
+    rows = [' r="1"><c r="A1" t="inlineStr"><is><t>program</t></is></c>'
+            '<c r="C1" t="b"><v>1</v></c><c r="D1"><v>2.5</v></c>']
+
+    assert list(read_xlsx(xlsx_file(rows, shared_strings=None))) == [(1, ['program', '', 'TRUE', '2.5'])]
@@ -0,0 +1,122 @@
+import gzip
+import zlib
+
+import pytest
+from flask import Flask, Response, request, stream_with_context
+
+from compression import CompressionMiddleware, init_compression
+
+brotli = pytest.importorskip('brotli')
+
+PAGE = '<p>' + 'Student portal ' * 200 + '</p>'
+
+
+@pytest.fixture
+def client(tmp_path):
+    static = tmp_path / 'static'
+    static.mkdir()
+    (static / 'site.css').write_text('body { color: black; }\n' * 200)
+
+    app = Flask(__name__, static_folder=str(static))
+    app.config['COMPRESSION_MIN_SIZE'] = 1024
+
+    @app.route('/page')
+    def page():
+        return PAGE
+
+    @app.route('/small')
+    def small():
+        return 'ok'
+
+    @app.route('/tagged')
+    def tagged():
+        response = Response(PAGE)
+        response.set_etag('v1')
+        return response.make_conditional(request)
+
+    @app.route('/no-transform')
+    def no_transform():
+        return Response(PAGE, headers={'Cache-Control': 'no-transform'})
+
+    @app.route('/partial')
+    def partial():
+        return Response(PAGE[:2000], status=206, headers={'Content-Range': f'bytes 0-1999/{len(PAGE)}'})
+
+    @app.route('/events')
+    def events():
+        return Response(iter(['data: ' + 'x' * 2000 + '\n\n']), mimetype='text/event-stream')
+
+    @app.route('/export')
+    def export():
+        rows = (f'{i},' + 'payment ' * 50 + '\n' for i in range(20))
+        return Response(stream_with_context(rows), mimetype='text/csv')
+
+    init_compression(app)
+    return app.test_client()
+
+
+def get(client, path, encoding='gzip, br', **headers):
+    return client.get(path, headers={'Accept-Encoding': encoding, **headers})
+
+
+@pytest.mark.parametrize('accept, expected', [
+    ('gzip, br', 'br'),
+    ('gzip', 'gzip'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('br;q=0, gzip;q=0', None),
+    ('*', 'br'),
+    ('identity', None),
+    ('', None),
+])
+def test_negotiation(accept, expected):
+    assert CompressionMiddleware(None).negotiate(accept) == expected
+
+
+def test_compresses_pages_with_an_exact_length(client):
+    response = get(client, '/page')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert brotli.decompress(response.data).decode() == PAGE
+
+    response = get(client, '/page', 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data).decode() == PAGE
+
+    response = get(client, '/page', 'br;q=0, gzip;q=0')
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == PAGE
+
+
+@pytest.mark.parametrize('path', ['/small', '/no-transform', '/partial', '/events', '/static/site.css'])
+def test_passes_through_untouched(client, path):
+    plain = client.get(path)
+    response = get(client, path)
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == plain.data
+
+
+def test_weak_etag_still_revalidates(client):
+    response = get(client, '/tagged')
+    assert response.headers['ETag'] == 'W/"v1"'
+
+    revalidated = get(client, '/tagged', **{'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert 'Content-Encoding' not in revalidated.headers
+
+
+def test_streamed_export_is_flushed_chunk_by_chunk(client):
+    response = get(client, '/export', 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+
+    # Every compressed chunk decodes on its own as soon as it arrives
+    decoder = zlib.decompressobj(31)
+    chunks = [decoder.decompress(chunk) for chunk in response.response]
+    assert len(chunks) > 2
+    assert all(chunks[:-1])
+    assert b''.join(chunks).decode() == ''.join(f'{i},' + 'payment ' * 50 + '\n' for i in range(20))
+
+    middleware = client.application.extensions['compression']
+    assert middleware.snapshot()['encodings']['gzip']['responses'] == 1
@@ -0,0 +1,117 @@
+import io
+import os
+import threading
+
+import pytest
+from flask import Flask
+
+from documents import PreviewRenderer
+from models import db, User, Document
+from storage import LocalStorage
+from uploads import delete_upload, gc_uploads_command
+
+
+def make_preview(renderer, file_path):
+    path = renderer.path_for(file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'jpeg')
+    return path
+
+
+def test_failed_paths_expire(tmp_path):
+    renderer = PreviewRenderer(Flask(__name__), cache_dir=str(tmp_path), retry_failed_after=60)
+    renderer.kinds = {'image'}
+    renderer._record_failure('uploads/documents/aa/bb/scan.png')
+    assert not renderer.can_preview('uploads/documents/aa/bb/scan.png')
+
+    renderer.retry_failed_after = 0
+    assert renderer.can_preview('uploads/documents/aa/bb/scan.png')
+    assert not renderer._failed_paths
+
+
+def test_failed_paths_are_capped_oldest_first(tmp_path):
+    renderer = PreviewRenderer(Flask(__name__), cache_dir=str(tmp_path), max_failed=3)
+    for i in range(10):
+        renderer._record_failure(f'uploads/documents/aa/bb/{i}.png')
+    assert list(renderer._failed_paths) == [f'uploads/documents/aa/bb/{i}.png' for i in (7, 8, 9)]
+
+
+def test_delete_upload_removes_the_preview(tmp_path):
+    app = Flask(__name__)
+    storage = app.extensions['storage'] = LocalStorage(str(tmp_path / 'static'))
+    renderer = app.extensions['preview_renderer'] = PreviewRenderer(app, cache_dir=str(tmp_path / 'previews'))
+    file_path = 'uploads/documents/aa/bb/1_transcript.pdf'
+    renderer._record_failure(file_path)
+
+    with app.app_context():
+        storage.save(file_path, io.BytesIO(b'%PDF'))
+        preview = make_preview(renderer, file_path)
+        assert delete_upload(file_path)
+
+    assert not storage.exists(file_path)
+    assert not os.path.exists(preview)
+    assert file_path not in renderer._failed_paths
+
+
+def test_gc_uploads_removes_orphaned_previews(app, tmp_path, monkeypatch):
+    storage = LocalStorage(str(tmp_path / 'static'))
+    renderer = PreviewRenderer(app, cache_dir=str(tmp_path / 'previews'))
+    monkeypatch.setitem(app.extensions, 'storage', storage)
+    monkeypatch.setitem(app.extensions, 'preview_renderer', renderer)
+    kept, orphan = 'uploads/documents/aa/bb/kept.pdf', 'uploads/documents/cc/dd/orphan.pdf'
+    with app.app_context():
+        user = User(email='student@example.com', full_name='Student', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Document(user_id=user.id, name='Transcript', file_path=kept))
+        db.session.commit()
+        for path in (kept, orphan):
+            storage.save(path, io.BytesIO(b'%PDF'))
+        kept_preview = make_preview(renderer, kept)
+        orphan_preview = make_preview(renderer, orphan)
+        # Left behind by an upload deleted before previews were cleaned up
+        stale_preview = make_preview(renderer, 'uploads/documents/ee/ff/gone.pdf')
+
+    result = app.test_cli_runner().invoke(gc_uploads_command, ['--min-age-hours', '0'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Removed 1 orphaned files' in result.output
+    assert 'Removed 1 orphaned previews' in result.output
+    assert not storage.exists(orphan) and storage.exists(kept)
+    assert os.path.exists(kept_preview)
+    assert not os.path.exists(orphan_preview) and not os.path.exists(stale_preview)
+
+
+def test_previews_render_in_worker_processes(tmp_path):
+    pytest.importorskip('PIL')
+    from PIL import Image
+
+    app = Flask(__name__)
+    storage = app.extensions['storage'] = LocalStorage(str(tmp_path / 'static'))
+    renderer = PreviewRenderer(app, cache_dir=str(tmp_path / 'previews'), size=32)
+    scan = io.BytesIO()
+    Image.new('RGB', (400, 200), 'navy').save(scan, 'PNG')
+    paths = [f'uploads/documents/aa/bb/{i}_scan.png' for i in range(6)] + ['uploads/documents/aa/bb/bad.png']
+    with app.app_context():
+        for path in paths[:-1]:
+            storage.save(path, io.BytesIO(scan.getvalue()))
+        storage.save(paths[-1], io.BytesIO(b'not an image'))
+
+    # Scheduled from several request threads at once
+    futures = []
+    threads = [threading.Thread(target=lambda path=path: futures.append(renderer.schedule(path))) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results = [future.result(timeout=60) for future in futures]
+
+    assert renderer._pool._mp_context.get_start_method() in ('forkserver', 'spawn')
+    assert sum(result is not None for result in results) == 6
+    assert (renderer.rendered, renderer.failed) == (6, 1)
+    with Image.open(renderer.cached(paths[0])) as preview:
+        assert preview.size == (32, 16)
+    assert renderer.cached(paths[-1]) is None and not renderer.can_preview(paths[-1])
+    renderer._pool.shutdown()
+    renderer._fetcher.shutdown()
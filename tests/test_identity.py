@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+import cache
+from cache import get_cache
+from identity import USER_STAMP_SHARDS, bump_user_version, load_cached_user, user_stamp, user_version
+from models import db, User
+
+
+@pytest.fixture
+def student(app):
+    with app.app_context():
+        user = User(email='student@example.com', full_name='Student', role='student', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def count_queries(app, fn):
+    from sqlalchemy import event
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    engine = db.engines[None]
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        return fn(), len(statements)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_cached_user_skips_the_query(app, student):
+    with app.app_context():
+        load_cached_user(student)
+        db.session.remove()
+        user, queries = count_queries(app, lambda: load_cached_user(student))
+        assert (user.id, user.role, queries) == (student, 'student', 0)
+
+
+def test_commit_bumps_the_version(app, student):
+    with app.app_context():
+        before = user_version(student)
+        load_cached_user(student).role = 'admin'
+        db.session.commit()
+        db.session.remove()
+        assert user_version(student) != before
+        user, queries = count_queries(app, lambda: load_cached_user(student))
+        assert user.role == 'admin' and queries == 1
+
+
+def test_bump_in_another_worker_process_is_seen(app, student):
+    with app.app_context():
+        assert load_cached_user(student).role == 'student'
+        # Another worker demotes the user: it commits and bumps the version
+        # in its own memory; this process only shares the database and disk
+        with db.engines[None].begin() as connection:
+            connection.execute(User.__table__.update().where(User.id == student).values(role='suspended'))
+        pid = os.fork()
+        if pid == 0:
+            try:
+                bump_user_version(student)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        db.session.remove()
+        assert load_cached_user(student).role == 'suspended'
+
+
+def test_password_hash_is_not_cached(app, student):
+    with app.app_context():
+        user = load_cached_user(student)
+        user.set_password('secret')
+        db.session.commit()
+        db.session.remove()
+
+        load_cached_user(student)
+        cached = [value for key, value in get_cache()._entries.items() if key.startswith(f'identity:{student}:')]
+        assert cached and all('password_hash' not in columns for _, columns in cached)
+
+        db.session.remove()
+        user, queries = count_queries(app, lambda: load_cached_user(student))
+        assert queries == 0
+        # Read on demand from the database
+        checked, queries = count_queries(app, lambda: user.check_password('secret'))
+        assert checked and queries == 1
+
+
+def test_stamp_is_only_statted_once_cached(app, student, monkeypatch):
+    reads = []
+    read_stamp = cache._read_stamp
+    monkeypatch.setattr(cache, '_read_stamp', lambda path: reads.append(path) or read_stamp(path))
+    with app.app_context():
+        bump_user_version(student)
+        load_cached_user(student)
+        reads.clear()
+        db.session.remove()
+        load_cached_user(student)
+
+    assert user_stamp(student) is user_stamp(student)
+    assert reads == []
+
+
+def test_stamp_files_are_bounded(app):
+    with app.app_context():
+        for user_id in range(1, 3 * USER_STAMP_SHARDS):
+            bump_user_version(user_id)
+
+    assert len(os.listdir(os.path.join(cache.VERSION_PATH, 'user'))) == USER_STAMP_SHARDS
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+import click
+import pytest
+
+import maintenance
+from maintenance import backup_database
+from models import db, Program
+
+
+@pytest.fixture
+def backups(tmp_path):
+    path = tmp_path / 'backups'
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def programs(app):
+    with app.app_context():
+        db.session.add_all([Program(name=f'Program {i}', name_ar='برنامج', description='x' * 2000)
+                            for i in range(50)])
+        db.session.commit()
+        yield db.engines[None]
+
+
+def test_backup_is_a_complete_standalone_copy(programs, backups):
+    dest = str(backups / 'backup.db')
+    # One page per step, so the copy takes many steps
+    assert backup_database(programs, dest, pages=1, sleep=0) == 0
+
+    copy = sqlite3.connect(dest)
+    try:
+        assert copy.execute('SELECT COUNT(*) FROM program').fetchone() == (50,)
+        assert copy.execute('PRAGMA journal_mode').fetchone() == ('delete',)
+        assert copy.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    finally:
+        copy.close()
+    assert sorted(os.listdir(backups)) == ['backup.db']
+
+
+def test_failed_backup_leaves_no_partial_file(programs, backups, monkeypatch):
+    dest = backups / 'backup.db'
+    dest.write_bytes(b'previous backup')
+    pragma = maintenance._pragma
+
+    def failing_pragma(connection, statement):
+        if statement == 'quick_check':
+            raise sqlite3.OperationalError('disk I/O error')
+        return pragma(connection, statement)
+
+    monkeypatch.setattr(maintenance, '_pragma', failing_pragma)
+    with pytest.raises(sqlite3.OperationalError):
+        backup_database(programs, str(dest), pages=1, sleep=0)
+
+    assert sorted(os.listdir(backups)) == ['backup.db']
+    assert dest.read_bytes() == b'previous backup'
+
+
+def test_backup_failing_its_check_is_discarded(programs, backups, monkeypatch):
+    pragma = maintenance._pragma
+    monkeypatch.setattr(maintenance, '_pragma', lambda connection, statement: (
+        [('row 3 missing from index',)] if statement == 'quick_check' else pragma(connection, statement)))
+
+    with pytest.raises(click.ClickException, match='failed its integrity check'):
+        backup_database(programs, str(backups / 'backup.db'))
+    assert os.listdir(backups) == []
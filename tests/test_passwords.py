@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from passwords import HashingBusy, PasswordHasher
+
+FAST_METHOD = 'pbkdf2:sha256:1000'
+
+
+def test_hash_and_verify():
+    hasher = PasswordHasher(method=FAST_METHOD, concurrency=2)
+    password_hash = hasher.hash('s3cret')
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert hasher.verify(password_hash, 's3cret')
+    assert not hasher.verify(password_hash, 'wrong')
+    assert not hasher.verify(None, 's3cret')
+
+
+def test_needs_rehash_on_other_parameters():
+    old = PasswordHasher(method='pbkdf2:sha256:500').hash('s3cret')
+    hasher = PasswordHasher(method=FAST_METHOD)
+    assert hasher.needs_rehash(old)
+    assert not hasher.needs_rehash(hasher.hash('s3cret'))
+
+
+def test_hashes_on_the_calling_thread_and_sheds_when_saturated():
+    hasher = PasswordHasher(method=FAST_METHOD, concurrency=1, queue_timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+    threads = []
+
+    def slow(*args):
+        threads.append(threading.current_thread())
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    holder = threading.Thread(target=lambda: hasher._run(slow))
+    holder.start()
+    assert started.wait(5)
+    try:
+        began = time.perf_counter()
+        with pytest.raises(HashingBusy):
+            hasher._run(slow)
+        assert time.perf_counter() - began < 1
+    finally:
+        release.set()
+        holder.join()
+
+    assert threads == [holder]
+    # The slot is free again
+    assert hasher._run(lambda: threading.current_thread()) is threading.current_thread()
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+
+import pytest
+from flask import g
+
+from models import db, Notification, Program, User
+from reporting import ReportSnapshot, reads_report_snapshot, refresh_report_snapshot_command
+
+
+@pytest.fixture
+def snapshot(app, tmp_path, monkeypatch):
+    snapshot = ReportSnapshot(str(tmp_path / 'snapshot' / 'report.db'))
+    monkeypatch.setitem(app.extensions, 'report_snapshot', snapshot)
+    with app.app_context():
+        db.session.add(Program(name='CS', name_ar='علوم'))
+        db.session.commit()
+    return snapshot
+
+
+def add_program(app, name):
+    with app.app_context():
+        db.session.add(Program(name=name, name_ar='برنامج'))
+        db.session.commit()
+
+
+def count_programs(path):
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return connection.execute('SELECT COUNT(*) FROM program').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_refresh_command_swaps_the_copy_atomically(app, snapshot):
+    runner = app.test_cli_runner()
+    result = runner.invoke(refresh_report_snapshot_command)
+    assert result.exit_code == 0, result.output
+    assert 'Snapshot refreshed' in result.output
+    assert snapshot.refreshes == 1
+
+    # A report that is mid-read keeps its copy while the next refresh replaces it
+    reader = sqlite3.connect(f'file:{snapshot.path}?mode=ro', uri=True)
+    try:
+        reader.execute('BEGIN')
+        assert reader.execute('SELECT COUNT(*) FROM program').fetchone() == (1,)
+        add_program(app, 'Math')
+        assert runner.invoke(refresh_report_snapshot_command).exit_code == 0
+        assert reader.execute('SELECT COUNT(*) FROM program').fetchone() == (1,)
+    finally:
+        reader.close()
+
+    assert count_programs(snapshot.path) == 2
+    assert sorted(os.listdir(os.path.dirname(snapshot.path))) == ['report.db', 'report.db.lock']
+
+
+def test_refresh_is_skipped_while_another_runs(app, snapshot):
+    fcntl = pytest.importorskip('fcntl')
+    os.makedirs(os.path.dirname(snapshot.path))
+    with open(snapshot.path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        result = app.test_cli_runner().invoke(refresh_report_snapshot_command)
+    assert 'already running; skipped' in result.output
+    assert snapshot.as_of() is None
+
+
+def report_view():
+    """Reads programs, reads and writes activity rows, writes a program"""
+    programs = Program.query.count()
+    user = User(email='admin@example.com', full_name='Admin', role='admin', password_hash='x')
+    db.session.add_all([user, Program(name='Added by the report', name_ar='برنامج')])
+    db.session.flush()
+    db.session.add(Notification(user_id=user.id, message='Report ready'))
+    db.session.commit()
+    return {'programs': programs, 'notifications': Notification.query.count(),
+            'as_of': g.get('report_as_of')}
+
+
+def test_report_views_read_the_snapshot(app, snapshot):
+    with app.app_context():
+        snapshot.refresh(db.engines[None])
+    add_program(app, 'Math')
+
+    with app.test_request_context('/admin/dashboard'):
+        response = reads_report_snapshot(report_view)()
+        body = response.get_json()
+
+    # Program rows come from the snapshot, taken before Math was added
+    assert body['programs'] == 1
+    assert body['notifications'] == 1
+    assert response.headers['X-Data-As-Of'] == snapshot.as_of().isoformat() + 'Z'
+    assert snapshot.routed >= 1
+    # Writes went to the live database only
+    with app.app_context():
+        assert Program.query.count() == 3
+    assert count_programs(snapshot.path) == 1
+
+
+def test_report_views_read_live_data_without_a_snapshot(app, snapshot):
+    add_program(app, 'Math')
+    with app.test_request_context('/admin/dashboard'):
+        response = reads_report_snapshot(report_view)()
+
+    assert response == {'programs': 2, 'notifications': 1, 'as_of': None}
+    assert snapshot.routed == 0
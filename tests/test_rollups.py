@@ -0,0 +1,162 @@
+"""The rollups kept up to date on every flush must match a fresh backfill."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from funnel import rebuild_admissions_rollups
+from ledger import rebuild_payment_rollups, reconciliation_report
+from models import (db, AdmissionsDailyRollup, Application, Certificate, Payment, PaymentDailyRollup, Program,
+                    StudentID, User)
+
+
+def payment_rollups():
+    return sorted((row.day, row.payment_method, row.fee_type, row.status, row.payment_count, row.total_amount)
+                  for row in PaymentDailyRollup.query.all() if row.payment_count or row.total_amount)
+
+
+def assert_payment_rollups_match_backfill():
+    incremental = payment_rollups()
+    rebuild_payment_rollups()
+    assert incremental == payment_rollups()
+
+
+def funnel_counts():
+    return sorted((row.day, row.stage, row.program_id, row.level, row.nationality, row.event_count)
+                  for row in AdmissionsDailyRollup.query.all() if row.event_count)
+
+
+def assert_funnel_matches_backfill():
+    incremental = funnel_counts()
+    rebuild_admissions_rollups()
+    assert incremental == funnel_counts()
+
+
+@pytest.fixture
+def people(app):
+    with app.app_context():
+        users = [User(email=f'student{i}@example.com', full_name=f'Student {i}', role='student',
+                      nationality=nationality, password_hash='x')
+                 for i, nationality in enumerate(('Egyptian', 'International', None))]
+        programs = [Program(name='CS', name_ar='علوم'), Program(name='Math', name_ar='رياضيات')]
+        db.session.add_all(users + programs)
+        db.session.commit()
+        return [user.id for user in users], [program.id for program in programs]
+
+
+def add_application(user_id, program_id, level='masters', number=[0]):
+    number[0] += 1
+    application = Application(app_id=f'APP-{number[0]:03d}', user_id=user_id, program_id=program_id, level=level)
+    db.session.add(application)
+    return application
+
+
+# Payments
+
+def test_payment_rollups_follow_creates_edits_and_deletes(app, people):
+    (first, second, third), (cs, _) = people
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    with app.app_context():
+        application = add_application(first, cs)
+        certificate = Certificate(cert_id='CERT-1', user_id=second, type='Enrollment', copies=1)
+        db.session.add(certificate)
+        db.session.flush()
+        payments = [
+            Payment(user_id=first, application_id=application.id, amount=600, payment_method='Card'),
+            Payment(user_id=second, certificate_id=certificate.id, amount=200, payment_method='Cash',
+                    payment_date=yesterday),
+            Payment(user_id=third, amount=50, payment_method='Card', status='Pending'),
+            Payment(user_id=third, amount=75, payment_method='Card'),
+        ]
+        db.session.add_all(payments)
+        db.session.commit()
+        assert_payment_rollups_match_backfill()
+
+        payments[0].amount = 1500
+        payments[1].payment_date = yesterday - timedelta(days=3)
+        payments[2].status = 'Completed'
+        payments[3].payment_method = 'Bank Transfer'
+        db.session.commit()
+        assert_payment_rollups_match_backfill()
+
+        # Moving a payment from a certificate to an application changes its fee type
+        payments[1].certificate_id = None
+        payments[1].application_id = application.id
+        db.session.flush()
+        # A second flush in the same transaction starts from the first one's values
+        payments[1].amount = 250
+        db.session.commit()
+        assert_payment_rollups_match_backfill()
+
+        db.session.delete(payments[3])
+        db.session.delete(payments[0])
+        db.session.commit()
+        assert_payment_rollups_match_backfill()
+
+
+def test_rolled_back_payment_leaves_rollups_alone(app, people):
+    (first, _, _), _ = people
+    with app.app_context():
+        db.session.add(Payment(user_id=first, amount=600, payment_method='Card'))
+        db.session.commit()
+        before = payment_rollups()
+
+        db.session.add(Payment(user_id=first, amount=900, payment_method='Card'))
+        db.session.flush()
+        db.session.rollback()
+
+        assert payment_rollups() == before
+        assert_payment_rollups_match_backfill()
+
+
+def test_reconciliation_report_totals_payments(app, people):
+    (first, second, _), _ = people
+    with app.app_context():
+        db.session.add_all([Payment(user_id=first, amount=600, payment_method='Card'),
+                            Payment(user_id=second, amount=1500, payment_method='Card'),
+                            Payment(user_id=second, amount=200, payment_method='Cash', status='Pending')])
+        db.session.commit()
+        report = reconciliation_report(date.today() - timedelta(days=1), date.today())
+
+    assert (report['total_count'], report['total_amount']) == (3, 2300)
+    assert report['by_method'] == {'Card': {'count': 2, 'amount': 2100}, 'Cash': {'count': 1, 'amount': 200}}
+    assert report['by_status'] == {'Completed': {'count': 2, 'amount': 2100},
+                                   'Pending': {'count': 1, 'amount': 200}}
+    assert report['by_fee_type'] == {'other': {'count': 3, 'amount': 2300}}
+
+
+# Admissions funnel
+
+def test_funnel_rollups_follow_the_application_lifecycle(app, people):
+    (first, second, third), (cs, math) = people
+    with app.app_context():
+        applications = [add_application(first, cs), add_application(second, math, 'diploma'),
+                        add_application(third, cs, 'doctorate'), add_application(first, math)]
+        db.session.commit()
+        assert_funnel_matches_backfill()
+
+        applications[0].status = 'Documents Approved'
+        applications[1].status = 'Documents Approved'
+        applications[2].status = 'Documents Rejected'
+        db.session.commit()
+        assert_funnel_matches_backfill()
+
+        for application in applications[:2]:
+            application.payment_status = 'Paid'
+            db.session.add(Payment(user_id=application.user_id, application_id=application.id,
+                                   amount=600, payment_method='Card'))
+        db.session.commit()
+        assert_funnel_matches_backfill()
+
+        applications[0].status = 'Enrolled'
+        db.session.add(StudentID(student_id='2025-LOC-CS-0001', application_id=applications[0].id))
+        # Saving a status that did not change is not a new event
+        applications[1].status = 'Documents Approved'
+        db.session.commit()
+        assert_funnel_matches_backfill()
+
+        counts = {stage: 0 for stage in ('submitted', 'documents_approved', 'documents_rejected', 'paid',
+                                         'enrolled')}
+        for row in AdmissionsDailyRollup.query.all():
+            counts[row.stage] += row.event_count
+        assert counts == {'submitted': 4, 'documents_approved': 2, 'documents_rejected': 1, 'paid': 2,
+                          'enrolled': 1}
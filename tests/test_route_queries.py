@@ -0,0 +1,122 @@
+"""SQL statements per request must not grow with the data (no N+1 queries).
+
+Seeds SMALL students, requests every route in run.py as an admin, a
+student and an anonymous visitor, seeds up to LARGE students and does it
+again. Statement counts must match between the two sizes and stay within
+tests/route_baseline.json. Wall time is recorded and reported against the
+baseline at the end of the run, but never fails a test. After an intended
+change, rewrite the baseline with
+
+    UPDATE_ROUTE_BASELINE=1 python -m pytest tests/test_route_queries.py
+"""
+import json
+import os
+
+import pytest
+
+from routes import (BASELINE_PATH, ROUTE_TIMINGS, URL_PARAMS, logged_in_clients, measure, route_cases, seed,
+                    url_values)
+
+# One student first: lists capped at a few rows (dashboard) then hold a single
+# row, so a per-row lazy load adds statements once they fill up
+SMALL = 1
+LARGE = 40
+REPEAT = 3
+# Routes slower than the baseline by this factor (and by at least SLOWER_MS) are reported
+SLOWER_FACTOR = 1.5
+SLOWER_MS = 5.0
+
+UPDATE_BASELINE = os.environ.get('UPDATE_ROUTE_BASELINE') == '1'
+
+
+def _models():
+    from models import (User, Program, Course, Application, Document, Payment, StudentID, Certificate,
+                        Ticket, TicketMessage, Notification, Project, NewsAnnouncement)
+
+    return (User, Program, Course, Application, Document, Payment, StudentID, Certificate,
+            Ticket, TicketMessage, Notification, Project, NewsAnnouncement)
+
+
+def _portal_app():
+    from run import app
+
+    return app
+
+
+# Keys only depend on the URL rules, so any value stands in for the URL parameters
+ROUTE_KEYS = [case[0] for case in route_cases(_portal_app(), dict.fromkeys(URL_PARAMS, 1))]
+
+
+def _load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def measured(request):
+    from models import db
+
+    app = _portal_app()
+    models = _models()
+    # Broken routes show up as 500s in the results rather than aborting the run
+    propagate = app.config.get('PROPAGATE_EXCEPTIONS')
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    app.logger.disabled = True
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seed(db, models, 0, SMALL)
+            User, Application, Certificate, Ticket, Document, Project, NewsAnnouncement = (
+                models[0], models[3], models[7], models[8], models[4], models[11], models[12])
+            values = url_values((User, Application, Certificate, Ticket, Document, Project, NewsAnnouncement), None)
+        cases = route_cases(app, values)
+        clients = logged_in_clients(app)
+        small = measure(clients, cases, REPEAT)
+        with app.app_context():
+            seed(db, models, SMALL, LARGE - SMALL)
+        large = measure(clients, cases, REPEAT)
+    finally:
+        app.config['PROPAGATE_EXCEPTIONS'] = propagate
+        app.logger.disabled = False
+
+    baseline = _load_baseline()
+    if UPDATE_BASELINE:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(large, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    request.config.stash.setdefault(ROUTE_TIMINGS, []).extend(
+        (key, large[key]['ms'], baseline[key]['ms'])
+        for key in sorted(large)
+        if key in baseline and large[key]['ms'] > baseline[key]['ms'] * SLOWER_FACTOR
+        and large[key]['ms'] - baseline[key]['ms'] > SLOWER_MS
+    )
+    return small, large, _load_baseline()
+
+
+
+@pytest.mark.parametrize('key', ROUTE_KEYS)
+def test_queries_do_not_grow_with_data(measured, key):
+    small, large, _ = measured
+    assert large[key]['queries'] == small[key]['queries'], (
+        f'{key}: {small[key]["queries"]} statements with {SMALL} students, {large[key]["queries"]} with {LARGE}')
+
+
+@pytest.mark.parametrize('key', ROUTE_KEYS)
+def test_queries_within_baseline(measured, key):
+    _, large, baseline = measured
+    assert key in baseline, f'{key} has no baseline entry; rerun with UPDATE_ROUTE_BASELINE=1'
+    assert large[key]['queries'] <= baseline[key]['queries'], (
+        f'{key}: {large[key]["queries"]} statements, baseline {baseline[key]["queries"]}')
+
+
+@pytest.mark.parametrize('key', ROUTE_KEYS)
+def test_no_new_server_errors(measured, key):
+    _, large, baseline = measured
+    # Routes already failing in the baseline are left to their own fixes
+    if key in baseline and baseline[key]['status'] >= 500:
+        pytest.xfail(f'{key} returns {baseline[key]["status"]} in the baseline')
+    assert large[key]['status'] < 500
@@ -0,0 +1,115 @@
+import pytest
+from sqlalchemy import text
+
+from models import db, Application, Program, StudentID, User
+from search import TRIGRAM_TABLE, create_trigram_table, normalize, phone_digits, search_students
+
+
+@pytest.fixture
+def students(app):
+    with app.app_context():
+        connection = db.session.connection()
+        create_trigram_table(connection)
+        # drop_all leaves the virtual table alone, so empty it between tests
+        connection.execute(text(f'DELETE FROM {TRIGRAM_TABLE}'))
+        db.session.commit()
+
+        users = {
+            'mohamed': User(email='m.hassan@example.com', full_name='Mohamed Ali Hassan', role='student',
+                            phone='+20 10 1234 5678', password_hash='x'),
+            'ahmed': User(email='ahmed@example.com', full_name='أحمد علی', role='student', password_hash='x'),
+            'karim': User(email='karim@example.com', full_name='کریم منصور', role='student', password_hash='x'),
+            'alia': User(email='alia@example.com', full_name='Alia Samir', role='student', password_hash='x'),
+            'admin': User(email='ali.admin@example.com', full_name='Ali Admin', role='admin', password_hash='x'),
+        }
+        program = Program(name='CS', name_ar='علوم')
+        db.session.add_all(list(users.values()) + [program])
+        db.session.flush()
+        application = Application(app_id='APP-007', user_id=users['alia'].id, program_id=program.id,
+                                  level='masters')
+        db.session.add(application)
+        db.session.flush()
+        db.session.add(StudentID(student_id='2025-LOC-CS-0007', application_id=application.id))
+        db.session.commit()
+        yield {name: user.id for name, user in users.items()}
+
+
+def found(query):
+    return [(user.full_name, kind) for user, kind in search_students(query)]
+
+
+def test_normalize_folds_arabic_and_persian_variants():
+    assert normalize('أحمد') == normalize('احمد') == normalize('إحمد')
+    assert normalize('علی') == normalize('علي') == normalize('على')
+    assert normalize('کریم') == normalize('كريم')
+    assert normalize('مُحَمَّـد') == normalize('محمد')
+    assert normalize('  ALI   Hassan ') == 'ali hassan'
+
+
+@pytest.mark.parametrize('value, digits', [
+    ('+20 10 1234 5678', '01012345678'),
+    ('00201012345678', '01012345678'),
+    ('010-1234-5678', '01012345678'),
+    ('٠١٠١٢٣٤٥٦٧٨', '01012345678'),
+    ('+44 20 7946 0958', '442079460958'),
+    # Partly typed: the + still marks the country code
+    ('+20 101', '0101'),
+    ('2012345', '2012345'),
+])
+def test_phone_digits(value, digits):
+    assert phone_digits(value) == digits
+
+
+def test_prefix_matches(app, students):
+    with app.app_context():
+        # Any word of the name, but only students
+        assert found('ali') == [('Alia Samir', 'email'), ('Mohamed Ali Hassan', 'name')]
+        assert found('hass') == [('Mohamed Ali Hassan', 'name')]
+        assert found('m.has') == [('Mohamed Ali Hassan', 'email')]
+        assert found('app-00') == [('Alia Samir', 'application')]
+        assert found('2025-loc') == [('Alia Samir', 'student_id')]
+
+
+@pytest.mark.parametrize('query', ['0101234', '+20 101 234', '0020 10 1234 5678', '٠١٠١٢٣'])
+def test_phone_forms(app, students, query):
+    with app.app_context():
+        assert found(query) == [('Mohamed Ali Hassan', 'phone')]
+
+
+@pytest.mark.parametrize('query, name', [
+    ('احمد', 'أحمد علی'),
+    ('علي', 'أحمد علی'),
+    ('على', 'أحمد علی'),
+    ('كريم', 'کریم منصور'),
+])
+def test_arabic_spelling_variants(app, students, query, name):
+    with app.app_context():
+        assert found(query) == [(name, 'name')]
+
+
+def test_near_misses_use_trigrams(app, students):
+    with app.app_context():
+        assert found('mohamad') == [('Mohamed Ali Hassan', 'similar_name')]
+        # In the middle of a word, which no prefix key covers
+        assert found('assan') == [('Mohamed Ali Hassan', 'similar_name')]
+        assert found('zzzz') == []
+
+
+def test_reindexed_on_changes(app, students):
+    with app.app_context():
+        user = db.session.get(User, students['mohamed'])
+        user.full_name = 'Mohamed Tarek'
+        db.session.commit()
+        assert found('tarek') == [('Mohamed Tarek', 'name')]
+        assert found('hass') == []
+
+        user.role = 'admin'
+        db.session.commit()
+        assert found('tarek') == []
+        assert found('0101234') == []
+
+        db.session.delete(db.session.get(User, students['karim']))
+        db.session.commit()
+        assert found('كريم') == []
+        assert db.session.execute(text(f'SELECT COUNT(*) FROM {TRIGRAM_TABLE} WHERE rowid = :id'),
+                                  {'id': students['karim']}).scalar() == 0
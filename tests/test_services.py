@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import services
+from models import db, Application, Notification, Program, User
+from services import submit_application, unit_of_work
+
+
+@pytest.fixture
+def commits(app):
+    """Session commits and database COMMITs made while the test runs"""
+    counts = {'session': 0, 'database': 0}
+
+    def on_session_commit(session):
+        counts['session'] += 1
+
+    def on_database_commit(connection):
+        counts['database'] += 1
+
+    with app.app_context():
+        engine = db.engines[None]
+    event.listen(Session, 'after_commit', on_session_commit)
+    event.listen(engine, 'commit', on_database_commit)
+    yield counts
+    event.remove(Session, 'after_commit', on_session_commit)
+    event.remove(engine, 'commit', on_database_commit)
+
+
+@pytest.fixture
+def student(app):
+    with app.app_context():
+        db.session.add(User(email='admin@example.com', full_name='Admin', role='admin', password_hash='x'))
+        student = User(email='student@example.com', full_name='Student', role='student', password_hash='x')
+        db.session.add_all([student, Program(name='CS', name_ar='علوم')])
+        db.session.commit()
+        return student.id
+
+
+def test_unit_of_work_commits_once(app, commits):
+    with app.app_context():
+        with unit_of_work() as session:
+            session.add(Program(name='CS', name_ar='علوم'))
+            session.flush()
+            session.add(Program(name='Math', name_ar='رياضيات'))
+
+        assert commits == {'session': 1, 'database': 1}
+        assert Program.query.count() == 2
+
+
+def test_unit_of_work_rolls_back_on_error(app, commits):
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            with unit_of_work() as session:
+                session.add(Program(name='CS', name_ar='علوم'))
+                session.flush()
+                raise RuntimeError('payment provider down')
+
+        assert commits == {'session': 0, 'database': 0}
+        # The session is usable again and nothing was kept
+        assert Program.query.count() == 0
+
+
+def test_use_case_commits_rows_and_notifications_together(app, student, commits):
+    with app.app_context():
+        application = submit_application(db.session.get(User, student), Program.query.one().id, 'masters')
+
+        assert commits['session'] == 1
+        assert application.app_id == 'APP-001'
+        assert [n.message for n in Notification.query.all()] == ['New application received from Student']
+
+
+def test_use_case_failure_keeps_nothing(app, student, commits, monkeypatch):
+    def failing_notify(message):
+        raise RuntimeError('notification failed')
+
+    monkeypatch.setattr(services, '_notify_admins', failing_notify)
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            submit_application(db.session.get(User, student), Program.query.one().id, 'masters')
+
+        assert commits['session'] == 0
+        assert Application.query.count() == 0
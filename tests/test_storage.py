@@ -0,0 +1,177 @@
+import io
+import os
+import time
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from flask import Flask
+
+from storage import LocalStorage, S3Storage, StoredFile, create_storage
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorage(str(tmp_path))
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip('moto')
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        # 5 MB is the smallest part S3 accepts, so 11 MB goes up in three parts
+        storage = S3Storage('portal-uploads', region='us-east-1', prefix='portal', chunk_size=5 * MB)
+        storage.client.create_bucket(Bucket='portal-uploads')
+        yield storage
+
+
+def read(storage, path):
+    f = storage.open(path)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+# LocalStorage
+
+def test_local_save_open_exists_delete(local, tmp_path):
+    local.save('uploads/ab/cd/doc.pdf', io.BytesIO(b'%PDF-1.4 content'), 'application/pdf')
+
+    assert (tmp_path / 'uploads' / 'ab' / 'cd' / 'doc.pdf').read_bytes() == b'%PDF-1.4 content'
+    assert local.exists('uploads/ab/cd/doc.pdf')
+    assert read(local, 'uploads/ab/cd/doc.pdf') == b'%PDF-1.4 content'
+
+    assert local.delete('uploads/ab/cd/doc.pdf') is True
+    assert not local.exists('uploads/ab/cd/doc.pdf')
+    assert local.delete('uploads/ab/cd/doc.pdf') is False
+
+
+def test_local_save_large_file(local):
+    data = os.urandom(3 * MB + 17)
+    local.save('uploads/big.bin', io.BytesIO(data))
+    assert read(local, 'uploads/big.bin') == data
+
+
+def test_local_put_local_file_moves_it(local, tmp_path):
+    source = tmp_path / 'incoming.tmp'
+    source.write_bytes(b'scanned')
+    local.put_local_file(str(source), 'uploads/scan.png')
+    assert not source.exists()
+    assert read(local, 'uploads/scan.png') == b'scanned'
+
+
+def test_local_iter_files(local):
+    for path in ('uploads/a/1.txt', 'uploads/a/b/2.txt', 'uploads/3.txt', 'uploads/other/4.txt'):
+        local.save(path, io.BytesIO(path.encode()))
+
+    files = sorted(local.iter_files('uploads/a'))
+    assert [f.path for f in files] == ['uploads/a/1.txt', 'uploads/a/b/2.txt']
+    assert all(isinstance(f, StoredFile) and f.size == len(f.path) for f in files)
+    assert all(abs(f.modified - time.time()) < 60 for f in files)
+    assert len(list(local.iter_files('uploads'))) == 4
+    assert list(local.iter_files('uploads/missing')) == []
+
+
+def test_local_url_is_served_from_static(local):
+    app = Flask(__name__)
+    with app.test_request_context():
+        assert local.url('uploads/ab/photo.jpg') == '/static/uploads/ab/photo.jpg'
+
+
+@pytest.mark.parametrize('path', ['../run.py', 'uploads/../run.py', 'static/x', '/etc/passwd'])
+def test_local_rejects_paths_outside_uploads(local, path):
+    with pytest.raises(ValueError):
+        local.save(path, io.BytesIO(b''))
+    with pytest.raises(ValueError):
+        local.exists(path)
+
+
+# S3Storage
+
+def test_s3_save_open_exists_delete(s3):
+    s3.save('uploads/ab/doc.pdf', io.BytesIO(b'%PDF-1.4 content'), 'application/pdf')
+
+    head = s3.client.head_object(Bucket='portal-uploads', Key='portal/uploads/ab/doc.pdf')
+    assert head['ContentType'] == 'application/pdf'
+    assert s3.exists('uploads/ab/doc.pdf')
+    assert read(s3, 'uploads/ab/doc.pdf') == b'%PDF-1.4 content'
+
+    assert s3.delete('uploads/ab/doc.pdf') is True
+    assert not s3.exists('uploads/ab/doc.pdf')
+    # Deleting a missing key is not an error
+    assert s3.delete('uploads/ab/doc.pdf') is True
+
+
+def test_s3_save_uses_multipart_above_chunk_size(s3):
+    data = os.urandom(11 * MB)
+    s3.save('uploads/big.bin', io.BytesIO(data))
+
+    head = s3.client.head_object(Bucket='portal-uploads', Key='portal/uploads/big.bin')
+    # Multipart ETags end in -<number of parts>
+    assert head['ETag'].strip('"').endswith('-3')
+    assert read(s3, 'uploads/big.bin') == data
+
+
+def test_s3_save_small_file_in_one_request(s3):
+    s3.save('uploads/small.txt', io.BytesIO(b'small'))
+    head = s3.client.head_object(Bucket='portal-uploads', Key='portal/uploads/small.txt')
+    assert '-' not in head['ETag'].strip('"')
+
+
+def test_s3_put_local_file_uploads_and_removes_it(s3, tmp_path):
+    source = tmp_path / 'incoming.tmp'
+    source.write_bytes(b'scanned')
+    s3.put_local_file(str(source), 'uploads/scan.png')
+    assert not source.exists()
+    assert read(s3, 'uploads/scan.png') == b'scanned'
+
+
+def test_s3_iter_files_strips_prefix_and_pages(s3):
+    paths = [f'uploads/a/{i:04d}.txt' for i in range(1005)] + ['uploads/b/other.txt']
+    for path in paths:
+        s3.client.put_object(Bucket='portal-uploads', Key='portal/' + path, Body=path.encode())
+    # Keys outside the configured prefix are not the portal's
+    s3.client.put_object(Bucket='portal-uploads', Key='uploads/a/foreign.txt', Body=b'x')
+
+    files = list(s3.iter_files('uploads/a'))
+    # More than one page of list_objects_v2 results
+    assert len(files) == 1005
+    assert files[0] == StoredFile('uploads/a/0000.txt', len('uploads/a/0000.txt'), files[0].modified)
+    assert abs(files[0].modified - time.time()) < 60
+    assert len(list(s3.iter_files('uploads'))) == 1006
+
+
+def test_s3_url_is_presigned_for_the_key(s3):
+    s3.save('uploads/ab/photo.jpg', io.BytesIO(b'jpeg'), 'image/jpeg')
+    url = s3.url('uploads/ab/photo.jpg')
+
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    assert parsed.path.endswith('/portal/uploads/ab/photo.jpg')
+    if 'X-Amz-Expires' in query:  # SigV4
+        assert query['X-Amz-Expires'] == ['3600'] and 'X-Amz-Signature' in query
+    else:
+        assert abs(int(query['Expires'][0]) - (time.time() + 3600)) < 60 and 'Signature' in query
+
+    import requests
+
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.content == b'jpeg'
+
+
+def test_s3_rejects_paths_outside_uploads(s3):
+    with pytest.raises(ValueError):
+        s3.save('../secrets', io.BytesIO(b''))
+
+
+def test_create_storage(tmp_path):
+    storage = create_storage({'STORAGE_LOCAL_ROOT': str(tmp_path)})
+    assert isinstance(storage, LocalStorage) and storage.root == str(tmp_path)
+    with pytest.raises(ValueError):
+        create_storage({'STORAGE_BACKEND': 'ftp'})
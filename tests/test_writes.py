@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from models import db, Notification, User
+from writes import WriteCoordinator, perform_write
+
+
+@pytest.fixture
+def coordinator(app, monkeypatch):
+    coordinator = WriteCoordinator(app, window=0.1, max_batch=64)
+    monkeypatch.setitem(app.extensions, 'write_coordinator', coordinator)
+    monkeypatch.setitem(app.config, 'WRITE_TIMEOUT', 5)
+    with app.app_context():
+        user = User(email='student@example.com', full_name='Student', role='student', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        coordinator.user_id = user.id
+    return coordinator
+
+
+def add_notification(user_id, message):
+    if message == 'bad':
+        raise ValueError('bad notification')
+    db.session.add(Notification(user_id=user_id, message=message))
+    return message
+
+
+def messages(app):
+    with app.app_context():
+        return sorted(n.message for n in Notification.query.all())
+
+
+def write_in_threads(app, *writes):
+    """Run each (fn, *args) through perform_write at once; return results or exceptions"""
+    results = [None] * len(writes)
+
+    def worker(index, fn, args):
+        with app.app_context():
+            try:
+                results[index] = perform_write(fn, *args)
+            except Exception as e:
+                results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i, write[0], write[1:])) for i, write in enumerate(writes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_concurrent_writes_share_one_commit(app, coordinator):
+    user_id = coordinator.user_id
+    results = write_in_threads(app, *[(add_notification, user_id, f'n{i}') for i in range(5)])
+
+    assert results == [f'n{i}' for i in range(5)]
+    assert messages(app) == [f'n{i}' for i in range(5)]
+    assert (coordinator.batches, coordinator.writes, coordinator.failed) == (1, 5, 0)
+
+
+def test_failed_batch_is_retried_one_write_at_a_time(app, coordinator):
+    user_id = coordinator.user_id
+    results = write_in_threads(app, (add_notification, user_id, 'first'), (add_notification, user_id, 'bad'),
+                               (add_notification, user_id, 'last'))
+
+    assert results[0] == 'first' and results[2] == 'last'
+    assert isinstance(results[1], ValueError)
+    assert messages(app) == ['first', 'last']
+    assert coordinator.snapshot()['retried_batches'] == 1
+    assert (coordinator.writes, coordinator.failed) == (2, 1)
+
+
+def blocking_write(started, release):
+    def write(user_id, message):
+        started.set()
+        release.wait(10)
+        return add_notification(user_id, message)
+    return write
+
+
+def test_timed_out_write_is_cancelled_while_queued(app, coordinator, monkeypatch):
+    user_id = coordinator.user_id
+    coordinator.window = 0
+    started, release = threading.Event(), threading.Event()
+    with app.app_context():
+        # Keep the writer busy so the next write stays in the queue
+        busy = coordinator.submit(blocking_write(started, release), user_id, 'busy')
+        assert started.wait(5)
+
+        monkeypatch.setitem(app.config, 'WRITE_TIMEOUT', 0.05)
+        with pytest.raises(TimeoutError):
+            perform_write(add_notification, user_id, 'gave up')
+        release.set()
+        assert busy.result(5) == 'busy'
+
+        # The writer skipped the cancelled write instead of committing it late
+        assert perform_write(add_notification, user_id, 'next') == 'next'
+    assert messages(app) == ['busy', 'next']
+
+
+def test_timed_out_write_already_running_is_waited_for(app, coordinator, monkeypatch):
+    user_id = coordinator.user_id
+    coordinator.window = 0
+    started, release = threading.Event(), threading.Event()
+    monkeypatch.setitem(app.config, 'WRITE_TIMEOUT', 0.05)
+    timer = threading.Timer(0.3, release.set)
+    timer.start()
+    with app.app_context():
+        assert perform_write(blocking_write(started, release), user_id, 'slow') == 'slow'
+    timer.join()
+    assert messages(app) == ['slow']
@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from models import db, Ticket, TicketMessage
+from schema import add_missing_columns, create_missing_indexes
+
+# Messages shown when a ticket page opens and per "load older" request
+TICKET_MESSAGES_PAGE_SIZE = 20
+TICKET_MESSAGES_MAX_PAGE_SIZE = 100
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'sender': message.sender,
+        'message': message.message,
+        'created_at': message.created_at.isoformat() + 'Z' if message.created_at else None,
+        'created_display': message.created_at.strftime('%Y-%m-%d %H:%M') if message.created_at else '',
+    }
+
+
+def page_size(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return TICKET_MESSAGES_PAGE_SIZE
+    return max(1, min(limit, TICKET_MESSAGES_MAX_PAGE_SIZE))
+
+
+def latest_messages(ticket_id, limit=TICKET_MESSAGES_PAGE_SIZE, before_id=None):
+    """Return up to `limit` messages older than `before_id`, oldest first
+
+    Message ids only grow, so they double as the pagination cursor and the
+    (ticket_id, id) index serves the query without touching older rows.
+    """
+    query = TicketMessage.query.filter(TicketMessage.ticket_id == ticket_id)
+    if before_id is not None:
+        query = query.filter(TicketMessage.id < before_id)
+
+    # Fetch one extra row to learn whether anything older remains
+    rows = query.order_by(TicketMessage.id.desc()).limit(limit + 1).all()
+    has_older = len(rows) > limit
+    return list(reversed(rows[:limit])), has_older
+
+
+def messages_since(ticket_id, after_id, limit=TICKET_MESSAGES_MAX_PAGE_SIZE):
+    """Return messages newer than `after_id`, oldest first"""
+    return TicketMessage.query.filter(
+        TicketMessage.ticket_id == ticket_id,
+        TicketMessage.id > after_id
+    ).order_by(TicketMessage.id).limit(limit).all()
+
+
+def record_message(ticket, message):
+    """Update the ticket's inbox summary for a message being added to it"""
+    if message.created_at is None:
+        message.created_at = datetime.utcnow()
+
+    ticket.last_message_at = message.created_at
+    ticket.last_sender = message.sender
+    if ticket.id is None:
+        ticket.message_count = (ticket.message_count or 0) + 1
+    else:
+        # Incremented in SQL so concurrent replies are not lost
+        ticket.message_count = Ticket.message_count + 1
+    # A student message waits on staff; a staff reply hands it back
+    ticket.awaiting_reply = message.sender != 'Admin'
+
+
+INBOX_SORTS = {
+    'activity': lambda: (Ticket.last_message_at.desc(), Ticket.id.desc()),
+    'created': lambda: (Ticket.created_at.desc(), Ticket.id.desc()),
+    'oldest_waiting': lambda: (Ticket.last_message_at.asc(), Ticket.id.asc()),
+}
+
+
+def inbox_query(sort='activity', status=None, awaiting=False):
+    """Admin ticket inbox, sorted and filtered on the denormalized columns"""
+    query = Ticket.query.options(joinedload(Ticket.user))
+    if status:
+        query = query.filter(Ticket.status == status)
+    if awaiting:
+        query = query.filter(Ticket.awaiting_reply.is_(True))
+    order = INBOX_SORTS.get(sort, INBOX_SORTS['activity'])
+    return query.order_by(*order())
+
+
+def inbox_counts():
+    """Ticket totals per status plus the number awaiting a staff reply"""
+    counts = dict(db.session.query(Ticket.status, func.count(Ticket.id)).group_by(Ticket.status).all())
+    counts['awaiting_reply'] = Ticket.query.filter(Ticket.awaiting_reply.is_(True)).count()
+    return counts
+
+
+def rebuild_ticket_inbox():
+    """Recompute the inbox summary of every ticket from its messages"""
+    messages = TicketMessage.__table__
+    ticket = Ticket.__table__
+
+    last_sender = db.select(messages.c.sender).where(
+        messages.c.ticket_id == ticket.c.id
+    ).order_by(messages.c.id.desc()).limit(1).scalar_subquery()
+
+    db.session.execute(ticket.update().values(
+        message_count=db.select(func.count(messages.c.id)).where(
+            messages.c.ticket_id == ticket.c.id).scalar_subquery(),
+        last_message_at=db.select(func.max(messages.c.created_at)).where(
+            messages.c.ticket_id == ticket.c.id).scalar_subquery(),
+        last_sender=last_sender,
+        awaiting_reply=func.coalesce(last_sender != 'Admin', False)
+    ))
+    db.session.commit()
+
+
+@click.command('backfill-ticket-inbox')
+@with_appcontext
+def backfill_ticket_inbox_command():
+    """Add the ticket inbox columns and fill them from existing messages."""
+    added = add_missing_columns(Ticket)
+    create_missing_indexes(Ticket)
+    create_missing_indexes(TicketMessage)
+    rebuild_ticket_inbox()
+    if added:
+        click.echo(f"Added ticket columns: {', '.join(added)}")
+    click.echo(f'Rebuilt inbox summary for {Ticket.query.count()} tickets.')
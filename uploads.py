@@ -0,0 +1,184 @@
+import hashlib
+import os
+import re
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from documents import discard_preview, get_renderer
+from models import db, Document, Project, NewsAnnouncement
+from storage import STATIC_ROOT, get_storage
+
+UPLOAD_ROOT = os.path.join(STATIC_ROOT, 'uploads')
+
+# Every table column that points at an uploaded file, with its category
+UPLOAD_COLUMNS = [
+    ('documents', Document, 'file_path'),
+    ('projects', Project, 'image_path'),
+    ('news', NewsAnnouncement, 'image_path'),
+]
+
+SHARDED_PATH = re.compile(r'^uploads/(documents|projects|news)/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$')
+
+
+def shard_path(category, filename):
+    """Storage path for an upload, e.g. uploads/news/3f/a2/news_..._1.jpg
+
+    Two levels of 256 directories keep every directory small no matter how
+    many files are uploaded.
+    """
+    digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return f'uploads/{category}/{digest[:2]}/{digest[2:4]}/{filename}'
+
+
+def is_sharded(path):
+    return bool(path and SHARDED_PATH.match(path))
+
+
+def save_upload(file, category, filename):
+    """Stream an uploaded file into storage and return its stored path"""
+    path = shard_path(category, filename)
+    get_storage().save(path, file.stream, content_type=file.mimetype)
+    return path
+
+
+def delete_upload(path):
+    """Remove the file behind a stored path, and its preview; missing files are not an error"""
+    if not path:
+        return False
+    try:
+        discard_preview(path)
+        return get_storage().delete(path)
+    except Exception as e:
+        print(f"Error removing file {path}: {e}")
+        return False
+
+
+def upload_url(path):
+    """URL the browser should use to fetch a stored upload"""
+    if not path:
+        return ''
+    return get_storage().url(path)
+
+
+def _legacy_candidates(path):
+    """Places an unsharded file may actually be, given historic upload bugs"""
+    name = os.path.basename(path)
+    candidates = [os.path.join(STATIC_ROOT, path)]
+    # Documents were saved wherever UPLOAD_FOLDER pointed at the time
+    for folder in ('', 'news', 'projects'):
+        candidates.append(os.path.join(UPLOAD_ROOT, folder, name))
+    return candidates
+
+
+def migrate_row(row, column, category):
+    """Move one row's file into the sharded layout; returns True if migrated
+
+    Safe to rerun after a crash: if the file was moved but the row was not
+    yet updated, the file is found at its destination and only the row changes.
+    """
+    storage = get_storage()
+    old_path = getattr(row, column)
+    new_path = shard_path(category, os.path.basename(old_path))
+
+    if not storage.exists(new_path):
+        source = next((p for p in _legacy_candidates(old_path) if os.path.isfile(p)), None)
+        if source is None:
+            return False
+        storage.put_local_file(source, new_path)
+
+    setattr(row, column, new_path)
+    return True
+
+
+@click.command('migrate-uploads')
+@click.option('--batch-size', default=200, show_default=True, help='Rows committed per batch.')
+@with_appcontext
+def migrate_uploads_command(batch_size):
+    """Move existing uploads into the sharded layout and rewrite their paths."""
+    for category, model, column_name in UPLOAD_COLUMNS:
+        column = getattr(model, column_name)
+        moved = missing = 0
+        last_id = 0
+
+        while True:
+            # Keyset pagination so committed batches never shift the window
+            rows = model.query.filter(
+                model.id > last_id,
+                column.isnot(None),
+                column != ''
+            ).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            for row in rows:
+                last_id = row.id
+                if is_sharded(getattr(row, column_name)):
+                    continue
+                if migrate_row(row, column_name, category):
+                    moved += 1
+                else:
+                    missing += 1
+            db.session.commit()
+
+        click.echo(f'{category}: moved {moved} files, {missing} missing on disk')
+
+
+def referenced_paths(batch_size=1000):
+    """Set of every upload path referenced by a database row"""
+    paths = set()
+    for _, model, column_name in UPLOAD_COLUMNS:
+        column = getattr(model, column_name)
+        query = db.session.query(column).filter(column.isnot(None))
+        for (path,) in query.execution_options(stream_results=True).yield_per(batch_size):
+            paths.add(os.path.normpath(path).replace(os.sep, '/'))
+    return paths
+
+
+@click.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='Only list the orphaned files.')
+@click.option('--min-age-hours', default=24, show_default=True,
+              help='Skip files newer than this, so uploads in flight are never removed.')
+@click.option('--include-legacy', is_flag=True,
+              help='Also collect files outside the sharded layout (run after migrate-uploads).')
+@with_appcontext
+def gc_uploads_command(dry_run, min_age_hours, include_legacy):
+    """Remove uploaded files that no database row references."""
+    storage = get_storage()
+    referenced = referenced_paths()
+    cutoff = time.time() - min_age_hours * 3600
+    prefixes = ['uploads/'] if include_legacy else [
+        f'uploads/{category}/' for category, _, _ in UPLOAD_COLUMNS
+    ]
+
+    removed = freed = 0
+    for prefix in prefixes:
+        for stored in storage.iter_files(prefix):
+            if not include_legacy and not is_sharded(stored.path):
+                continue
+            if stored.path in referenced or stored.modified > cutoff:
+                continue
+
+            removed += 1
+            freed += stored.size
+            if dry_run:
+                click.echo(f'orphan: {stored.path}')
+            else:
+                storage.delete(stored.path)
+                discard_preview(stored.path)
+
+    action = 'Found' if dry_run else 'Removed'
+    click.echo(f'{action} {removed} orphaned files ({freed / 1024 / 1024:.1f} MB)')
+
+    # Previews left behind by uploads deleted some other way
+    renderer = get_renderer()
+    wanted = {renderer.path_for(path) for path in referenced}
+    stale = [path for path, modified in renderer.iter_cached() if path not in wanted and modified <= cutoff]
+    if not dry_run:
+        for path in stale:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    click.echo(f'{action} {len(stale)} orphaned previews')
@@ -0,0 +1,170 @@
+"""Group commit for small independent writes.
+
+SQLite has a single write lock, so many workers each committing one
+notification or reply spend most of their time waiting for it. When
+WRITE_COORDINATOR is on, small writes are handed to one writer thread per
+process that runs them back to back and commits them together after a short
+window (WRITE_BATCH_WINDOW_MS) or once WRITE_BATCH_MAX writes are queued.
+
+A write is a function that stages changes on db.session without committing.
+Callers get a Future and block on it, so they still see the write's result or
+its exception. If a batch fails to commit, its writes are retried one by one
+so a single bad write cannot fail the others. A caller that gives up waiting
+(WRITE_TIMEOUT) cancels its write if it is still queued; once the writer has
+picked it up the caller waits for the outcome instead, so a TimeoutError
+always means the write was never run.
+"""
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from flask import current_app
+
+from models import db
+
+PendingWrite = namedtuple('PendingWrite', ['fn', 'args', 'future'])
+
+
+class WriteCoordinator:
+    """Runs queued writes on a dedicated thread and commits them in groups"""
+
+    def __init__(self, app, window=0.005, max_batch=64):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+        self.failed = 0
+        self.retried_batches = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_writer(self):
+        # Started lazily so each forked worker process gets its own writer
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, name='write-coordinator', daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) for the next group commit and return its Future"""
+        self._ensure_writer()
+        future = Future()
+        self._queue.put(PendingWrite(fn, args, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = [w for w in self._next_batch() if w.future.set_running_or_notify_cancel()]
+                if batch:
+                    self._commit_batch(batch)
+                # Never carry objects from one batch into the next
+                db.session.close()
+
+    def _commit_batch(self, batch):
+        try:
+            results = [w.fn(*w.args) for w in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                self._fail(batch[0], e)
+                return
+            # Find the bad write by committing each one on its own
+            self.retried_batches += 1
+            for write in batch:
+                self._commit_one(write)
+            return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for write, result in zip(batch, results):
+            write.future.set_result(result)
+
+    def _commit_one(self, write):
+        try:
+            result = write.fn(*write.args)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self._fail(write, e)
+            return
+        self.batches += 1
+        self.writes += 1
+        write.future.set_result(result)
+
+    def _fail(self, write, exc):
+        self.failed += 1
+        write.future.set_exception(exc)
+
+    def snapshot(self):
+        return {
+            'queued': self._queue.qsize(),
+            'batches': self.batches,
+            'writes': self.writes,
+            'failed': self.failed,
+            'retried_batches': self.retried_batches,
+            'avg_batch_size': round(self.writes / self.batches, 2) if self.batches else 0,
+        }
+
+
+def init_write_coordinator(app):
+    """Create the app's write coordinator if WRITE_COORDINATOR is enabled"""
+    if app.config.get('WRITE_COORDINATOR'):
+        app.extensions['write_coordinator'] = WriteCoordinator(
+            app,
+            window=app.config.get('WRITE_BATCH_WINDOW_MS', 5) / 1000,
+            max_batch=app.config.get('WRITE_BATCH_MAX', 64)
+        )
+
+
+def perform_write(fn, *args):
+    """Run a small write and return fn's result once it is committed
+
+    fn(*args) stages changes on db.session and must not commit. Without the
+    coordinator it runs and commits right here in the request's session.
+    """
+    coordinator = current_app.extensions.get('write_coordinator')
+    if coordinator is None:
+        try:
+            result = fn(*args)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result
+    future = coordinator.submit(fn, *args)
+    try:
+        return future.result(current_app.config.get('WRITE_TIMEOUT', 10))
+    except FutureTimeoutError:
+        # Still queued: the writer skips cancelled writes, so it never runs.
+        # Already in its batch: it may commit any moment, so wait it out.
+        if future.cancel():
+            raise
+    return future.result()
+
+
+def write_metrics():
+    coordinator = current_app.extensions.get('write_coordinator')
+    return coordinator.snapshot() if coordinator else {'enabled': False}